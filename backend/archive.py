@@ -0,0 +1,329 @@
+import argparse
+import mmap
+import os
+import struct
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from structured_log import get_logger, fields
+
+logger = get_logger('archive')
+
+# segment layout: header, records grouped by chat and sorted by id, then per chat an array
+# of ids followed by an array of record offsets, then the chat index the header points at
+MAGIC = b"VSCSEG01"
+HEADER = struct.Struct("<8sQQQ")
+RECORD = struct.Struct("<QqqdIH")
+INDEX_ENTRY = struct.Struct("<QQ")
+CHAT_ID = struct.Struct("<H")
+SEGMENT_SUFFIX = ".seg"
+# group messages have no single receiver; user ids are positive, so -1 stands for NULL
+NO_RECEIVER = -1
+
+def write_segment(path, rows):
+    """Writes message rows (id, sender, receiver, ciphertext, iv, chat_id, timestamp) as one segment file"""
+    chats = {}
+    for row in rows:
+        chats.setdefault(row[5], []).append(row)
+    temporary = path + ".tmp"
+    try:
+        _write_segment(temporary, rows, chats)
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except FileNotFoundError:
+            pass
+        raise
+    os.replace(temporary, path)
+
+def _write_segment(temporary, rows, chats):
+    with open(temporary, "wb") as f:
+        f.write(HEADER.pack(MAGIC, 0, 0, 0))
+        tables = []
+        for chat_id in sorted(chats):
+            messages = sorted(chats[chat_id], key=lambda row: row[0])
+            ids, offsets = [], []
+            for message_id, sender, receiver, ciphertext, iv, _, timestamp in messages:
+                ciphertext, iv = bytes(ciphertext), bytes(iv)
+                ids.append(message_id)
+                offsets.append(f.tell())
+                receiver = NO_RECEIVER if receiver is None else int(receiver)
+                f.write(RECORD.pack(message_id, int(sender), receiver, timestamp.timestamp(), len(ciphertext), len(iv)))
+                f.write(ciphertext)
+                f.write(iv)
+            f.write(b"\0" * (-f.tell() % 8))
+            tables.append((chat_id, len(ids), f.tell()))
+            f.write(struct.pack(f"<{len(ids)}Q", *ids))
+            f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+        index_offset = f.tell()
+        for chat_id, count, table_offset in tables:
+            encoded = chat_id.encode("utf-8")
+            f.write(CHAT_ID.pack(len(encoded)))
+            f.write(encoded)
+            f.write(INDEX_ENTRY.pack(count, table_offset))
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, len(rows), index_offset, len(tables)))
+        f.flush()
+        os.fsync(f.fileno())
+
+class Segment:
+    """
+    Read-only view of one segment file through mmap; only the chat index is parsed up front
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        magic, self.count, index_offset, chat_count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a message segment")
+        self.chats = {}
+        self.min_id = None
+        self.max_id = None
+        position = index_offset
+        for _ in range(chat_count):
+            (length,) = CHAT_ID.unpack_from(self.map, position)
+            position += CHAT_ID.size
+            chat_id = bytes(self.map[position:position + length]).decode("utf-8")
+            position += length
+            count, table_offset = INDEX_ENTRY.unpack_from(self.map, position)
+            position += INDEX_ENTRY.size
+            ids = self.view[table_offset:table_offset + count * 8].cast("Q")
+            offsets = self.view[table_offset + count * 8:table_offset + count * 16].cast("Q")
+            self.chats[chat_id] = (ids, offsets)
+            self.min_id = ids[0] if self.min_id is None else min(self.min_id, ids[0])
+            self.max_id = ids[-1] if self.max_id is None else max(self.max_id, ids[-1])
+
+    def read(self, chat_id, offset):
+        message_id, sender, receiver, timestamp, ciphertext_length, iv_length = RECORD.unpack_from(self.map, offset)
+        start = offset + RECORD.size
+        ciphertext = bytes(self.map[start:start + ciphertext_length])
+        iv = bytes(self.map[start + ciphertext_length:start + ciphertext_length + iv_length])
+        return (message_id, sender, None if receiver == NO_RECEIVER else receiver, ciphertext, iv, chat_id, datetime.fromtimestamp(timestamp))
+
+    def ids(self, chat_id):
+        entry = self.chats.get(chat_id)
+        return entry[0] if entry else ()
+
+    def before(self, chat_id, before_id, limit):
+        """Up to limit rows older than before_id, oldest first, and whether older ones remain"""
+        entry = self.chats.get(chat_id)
+        if entry is None:
+            return [], False
+        ids, offsets = entry
+        end = len(ids) if before_id is None else bisect_left(ids, before_id)
+        start = max(0, end - limit)
+        return [self.read(chat_id, offsets[i]) for i in range(start, end)], start > 0
+
+    def after(self, chat_id, since_id, limit):
+        """Up to limit rows newer than since_id, oldest first, and whether newer ones remain"""
+        entry = self.chats.get(chat_id)
+        if entry is None:
+            return [], False
+        ids, offsets = entry
+        start = 0 if since_id is None else bisect_right(ids, since_id)
+        end = min(len(ids), start + limit)
+        return [self.read(chat_id, offsets[i]) for i in range(start, end)], end < len(ids)
+
+    def first_after_time(self, chat_id, since_ts):
+        """Id just before the first row newer than since_ts; rows are in id order, not strictly time order"""
+        entry = self.chats.get(chat_id)
+        if entry is None:
+            return None
+        ids, offsets = entry
+        for i in range(len(ids)):
+            if struct.unpack_from("<d", self.map, offsets[i] + 24)[0] > since_ts:
+                return ids[i] - 1
+        return ids[-1]
+
+    def close(self):
+        for ids, offsets in self.chats.values():
+            ids.release()
+            offsets.release()
+        self.chats = {}
+        self.view.release()
+        self.map.close()
+
+class Archive:
+    """
+    Cold message history kept in segment files under one directory.
+
+    Segments cover disjoint, increasing id ranges, so a chat's history is read newest
+    segment first for pages and oldest first for catch up. The directory is rescanned at
+    most every refresh_interval seconds so segments written by the archiver show up.
+    """
+
+    def __init__(self, directory, refresh_interval=10.0):
+        self.directory = directory
+        self.refresh_interval = refresh_interval
+        self.segments = []
+        self.loaded = {}
+        self.checked = None
+        self.lock = threading.Lock()
+        self.reads = 0
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and self.checked is not None and now - self.checked < self.refresh_interval:
+            return
+        with self.lock:
+            self.checked = now
+            try:
+                names = sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+            except FileNotFoundError:
+                names = []
+            for name in names:
+                if name not in self.loaded:
+                    try:
+                        self.loaded[name] = Segment(os.path.join(self.directory, name))
+                    except (OSError, ValueError, struct.error) as e:
+                        logger.error("Archive segment error", extra=fields(segment=name, error=str(e)))
+            segments = [segment for segment in self.loaded.values() if segment.min_id is not None]
+            self.segments = sorted(segments, key=lambda segment: segment.min_id)
+
+    def max_id(self):
+        self.refresh()
+        segments = self.segments
+        return segments[-1].max_id if segments else 0
+
+    def get_page(self, chat_id, before_id, limit):
+        """Up to limit archived rows older than before_id, oldest first, and whether older ones remain"""
+        self.refresh()
+        self.reads += 1
+        messages = []
+        segments = [segment for segment in reversed(self.segments) if before_id is None or segment.min_id < before_id]
+        for i, segment in enumerate(segments):
+            rows, more = segment.before(chat_id, before_id, limit - len(messages))
+            messages = rows + messages
+            if len(messages) >= limit:
+                return messages, more or any(next_segment.ids(chat_id) for next_segment in segments[i + 1:])
+        return messages, False
+
+    def complete_page(self, chat_id, messages, before_id, limit):
+        """Fills a history page (oldest first) whose hot rows ran out from the archive; returns (messages, next_cursor)"""
+        floor = messages[0][0] if messages else before_id
+        older, more = self.get_page(chat_id, floor, max(1, limit - len(messages)))
+        if len(messages) >= limit:
+            return messages, messages[0][0] if older else None
+        messages = older + messages
+        return messages, messages[0][0] if more and messages else None
+
+    def get_since(self, chat_id, since_id, limit):
+        """Up to limit archived rows newer than since_id, oldest first, and whether newer archived ones remain"""
+        self.refresh()
+        self.reads += 1
+        messages = []
+        segments = [segment for segment in self.segments if since_id is None or segment.max_id > since_id]
+        for i, segment in enumerate(segments):
+            rows, more = segment.after(chat_id, since_id, limit - len(messages))
+            messages.extend(rows)
+            if len(messages) >= limit:
+                return messages, more or any(next_segment.ids(chat_id) for next_segment in segments[i + 1:])
+        return messages, False
+
+    def id_before_time(self, chat_id, since_ts):
+        """Translates a timestamp into an id cursor for get_since, or None when nothing archived is older"""
+        self.refresh()
+        cursor = None
+        for segment in self.segments:
+            found = segment.first_after_time(chat_id, since_ts)
+            if found is None:
+                continue
+            cursor = found
+            if found < segment.ids(chat_id)[-1]:
+                break
+        return cursor
+
+    def stats(self):
+        with self.lock:
+            return {
+                "directory": self.directory,
+                "segments": len(self.segments),
+                "messages": sum(segment.count for segment in self.segments),
+                "max_id": self.segments[-1].max_id if self.segments else 0,
+                "reads": self.reads
+            }
+
+def archive_messages(connection, directory, older_than, segment_rows=100000, delete_batch=1000):
+    """
+    Moves messages older than the cutoff out of the hot table into new segments.
+
+    Rows are taken in id order and the scan stops at the first row younger than the
+    cutoff, so every segment covers a contiguous id range above the previous one. The
+    segment is durable before its rows are deleted, and the ids of the newest segment are
+    deleted again on the next run in case the previous one stopped in between.
+    """
+    os.makedirs(directory, exist_ok=True)
+    archive = Archive(directory)
+    archive.refresh(force=True)
+    cutoff = datetime.fromtimestamp(older_than)
+    cursor = connection.cursor()
+    moved = 0
+    try:
+        if archive.segments:
+            newest = archive.segments[-1]
+            _delete(connection, cursor, [message_id for ids, _ in newest.chats.values() for message_id in ids], delete_batch)
+        last_id = archive.max_id()
+        while True:
+            cursor.execute("SELECT * FROM messages WHERE id > %s ORDER BY id LIMIT %s", (last_id, segment_rows))
+            rows = cursor.fetchall()
+            cold = []
+            for row in rows:
+                if row[6] >= cutoff:
+                    break
+                cold.append(row)
+            if not cold:
+                break
+            path = os.path.join(directory, f"{cold[0][0]:020d}-{cold[-1][0]:020d}{SEGMENT_SUFFIX}")
+            write_segment(path, cold)
+            _delete(connection, cursor, [row[0] for row in cold], delete_batch)
+            moved += len(cold)
+            last_id = cold[-1][0]
+            logger.info("Archived messages", extra=fields(count=len(cold), last_id=last_id, path=path))
+            if len(cold) < len(rows) or len(rows) < segment_rows:
+                break
+    finally:
+        cursor.close()
+        for segment in archive.loaded.values():
+            segment.close()
+    return moved
+
+def _delete(connection, cursor, message_ids, batch):
+    for start in range(0, len(message_ids), batch):
+        chunk = message_ids[start:start + batch]
+        cursor.execute(f"DELETE FROM messages WHERE id IN ({', '.join(['%s'] * len(chunk))})", chunk)
+        connection.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description="Move messages older than --days from the messages table into archive segments")
+    parser.add_argument("--directory", default=os.getenv("ARCHIVE_DIR", "archive"))
+    parser.add_argument("--days", type=float, default=float(os.getenv("ARCHIVE_AFTER_DAYS", 90)))
+    parser.add_argument("--segment-rows", type=int, default=100000)
+    parser.add_argument("--every", type=float, default=0, help="repeat every N seconds instead of running once")
+    args = parser.parse_args()
+
+    import mysql.connector
+    from database import DB_CONFIG
+    while True:
+        connection = None
+        try:
+            connection = mysql.connector.connect(**DB_CONFIG)
+            moved = archive_messages(connection, args.directory, time.time() - args.days * 86400, args.segment_rows)
+            logger.info("Archive run finished", extra=fields(moved=moved))
+        except mysql.connector.Error as e:
+            logger.error("Archive error", extra=fields(error=str(e)))
+        except Exception as e:
+            # a segment that cannot be written leaves its rows in the hot table for the next run
+            logger.error("Archive segment write error", extra=fields(error=str(e)))
+        finally:
+            if connection and connection.is_connected():
+                connection.close()
+        if not args.every:
+            break
+        time.sleep(args.every)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import os
+import aiomysql
+from archive import Archive
+from common import message_row, unread_increments, HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE
+
+pool = None
+archive = Archive(os.getenv('ARCHIVE_DIR')) if os.getenv('ARCHIVE_DIR') else None
+
+async def init_pool():
+    global pool
+    if pool is None:
+        pool = await aiomysql.create_pool(
+            host="localhost",
+            user="admin",
+            password="root",
+            db="chat_db",
+            minsize=int(os.getenv('ASYNC_DB_POOL_MIN', 1)),
+            maxsize=int(os.getenv('ASYNC_DB_POOL_MAX', 20)),
+            # reads must not leave a transaction open: the pool closes connections released mid-transaction
+            autocommit=True
+        )
+    return pool
+
+async def close_pool():
+    global pool
+    if pool is not None:
+        pool.close()
+        await pool.wait_closed()
+        pool = None
+
+async def fetchone(sql, params):
+    async with pool.acquire() as connection:
+        async with connection.cursor() as cursor:
+            await cursor.execute(sql, params)
+            return await cursor.fetchone()
+
+async def fetchall(sql, params):
+    async with pool.acquire() as connection:
+        async with connection.cursor() as cursor:
+            await cursor.execute(sql, params)
+            return list(await cursor.fetchall())
+
+async def execute(sql, params, many=False):
+    async with pool.acquire() as connection:
+        async with connection.cursor() as cursor:
+            try:
+                await connection.begin()
+                if many:
+                    await cursor.executemany(sql, params)
+                else:
+                    await cursor.execute(sql, params)
+                await connection.commit()
+                return cursor.lastrowid
+            except aiomysql.Error:
+                await connection.rollback()
+                raise
+
+async def transaction(statements):
+    """Runs (sql, params, many) statements on one connection and commits once; returns the first lastrowid"""
+    async with pool.acquire() as connection:
+        async with connection.cursor() as cursor:
+            try:
+                await connection.begin()
+                first_id = None
+                for sql, params, many in statements:
+                    if many:
+                        await cursor.executemany(sql, params)
+                    else:
+                        await cursor.execute(sql, params)
+                    if first_id is None:
+                        first_id = cursor.lastrowid
+                await connection.commit()
+                return first_id
+            except aiomysql.Error:
+                await connection.rollback()
+                raise
+
+async def database_setup():
+    await init_pool()
+
+async def add_user(username, password, session_id):
+    sql = "INSERT INTO users (username, password, session_id) VALUES (%s, %s, %s)"
+    return await execute(sql, (username, password, session_id))
+
+async def get_user(username):
+    return await fetchone("SELECT * FROM users WHERE username = %s", (username,))
+
+async def get_username(user_id):
+    return await fetchone("SELECT username FROM users WHERE id = %s", (user_id,))
+
+async def session_check(session_id):
+    return await fetchone("SELECT * FROM users WHERE session_id = %s", (session_id,))
+
+async def rotate_session(user_id, session_id):
+    await execute("UPDATE users SET session_id = %s WHERE id = %s", (session_id, user_id))
+
+async def update_password(user_id, password):
+    await execute("UPDATE users SET password = %s WHERE id = %s", (password, user_id))
+
+UNREAD_INCREMENT_SQL = "INSERT INTO chat_reads (user_id, chat_id, unread_count) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE unread_count = unread_count + VALUES(unread_count)"
+
+async def add_message(message_data):
+    sql = "INSERT INTO messages (sender, receiver, ciphertext, iv, chat_id, timestamp) VALUES (%s, %s, %s, %s, %s, FROM_UNIXTIME(%s))"
+    row = message_row(message_data)
+    return await transaction([(sql, row, False), (UNREAD_INCREMENT_SQL, (row[1], row[4], 1), False)])
+
+async def add_messages(messages):
+    sql = "INSERT INTO messages (sender, receiver, ciphertext, iv, chat_id, timestamp) VALUES (%s, %s, %s, %s, %s, FROM_UNIXTIME(%s))"
+    rows = [message_row(message_data) for message_data in messages]
+    await transaction([(sql, rows, True), (UNREAD_INCREMENT_SQL, unread_increments(rows), True)])
+
+async def get_messages_page(chat_id, before_id=None, limit=HISTORY_PAGE_SIZE):
+    limit = max(1, min(int(limit), HISTORY_MAX_PAGE_SIZE))
+    if before_id is None:
+        sql = "SELECT * FROM messages WHERE chat_id = %s ORDER BY id DESC LIMIT %s"
+        messages = await fetchall(sql, (chat_id, limit + 1))
+    else:
+        sql = "SELECT * FROM messages WHERE chat_id = %s AND id < %s ORDER BY id DESC LIMIT %s"
+        messages = await fetchall(sql, (chat_id, int(before_id), limit + 1))
+    next_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        next_cursor = messages[-1][0]
+    messages.reverse()
+    if archive is not None and next_cursor is None:
+        return archive.complete_page(chat_id, messages, before_id, limit)
+    return messages, next_cursor
+
+async def get_key_exchanges(user_id):
+    return await fetchall("SELECT * FROM key_exchanges WHERE reciever_id = %s", (user_id,))
+
+async def add_key_exchange(reciever_id, sender_id, chat_id, public_key):
+    sql = "INSERT INTO key_exchanges (reciever_id, sender_id, chat_id, public_key) VALUES (%s, %s, %s, %s)"
+    await execute(sql, (reciever_id, sender_id, chat_id, public_key))
+
+async def accept_key_exchange(reciever_id, chat_id):
+    sql = "UPDATE key_exchanges SET accepted = TRUE WHERE reciever_id = %s AND chat_id = %s"
+    await execute(sql, (reciever_id, chat_id))
+
+async def get_accepted_key_exchanges(user_id):
+    sql = "SELECT * FROM key_exchanges WHERE (reciever_id = %s OR sender_id = %s) AND accepted = TRUE"
+    return await fetchall(sql, (user_id, user_id))
+
+async def get_chat_list(user_id):
+    sql = """
+        SELECT k.reciever_id, k.sender_id, k.chat_id, ru.username, su.username,
+            COALESCE(r.unread_count, 0), COALESCE(r.last_read_id, 0)
+        FROM key_exchanges k
+        LEFT JOIN users ru ON ru.id = k.reciever_id
+        LEFT JOIN users su ON su.id = k.sender_id
+        LEFT JOIN chat_reads r ON r.user_id = %s AND r.chat_id = k.chat_id
+        WHERE (k.reciever_id = %s OR k.sender_id = %s) AND k.accepted = TRUE
+    """
+    return await fetchall(sql, (user_id, user_id, user_id))
+
+async def mark_read(user_id, chat_id, message_id):
+    sql = """
+        INSERT INTO chat_reads (user_id, chat_id, last_read_id, unread_count)
+        VALUES (%s, %s, %s, (SELECT COUNT(*) FROM messages WHERE chat_id = %s AND id > %s AND receiver = %s))
+        ON DUPLICATE KEY UPDATE
+            unread_count = IF(VALUES(last_read_id) > last_read_id, VALUES(unread_count), unread_count),
+            last_read_id = GREATEST(last_read_id, VALUES(last_read_id))
+    """
+    await execute(sql, (user_id, chat_id, int(message_id), chat_id, int(message_id), user_id))
+    return await fetchone("SELECT last_read_id, unread_count FROM chat_reads WHERE user_id = %s AND chat_id = %s", (user_id, chat_id))
+
+async def get_key_exchange(chat_id):
+    return await fetchone("SELECT * FROM key_exchanges WHERE chat_id = %s", (chat_id,))
+
+def get_pool_status():
+    if pool:
+        return {
+            "pool_min": pool.minsize,
+            "pool_max": pool.maxsize,
+            "pool_size": pool.size,
+            "pool_free": pool.freesize
+        }
+    return None
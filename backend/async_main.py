@@ -0,0 +1,357 @@
+import atexit
+import logging
+import os
+import time
+import uuid
+from http.cookies import SimpleCookie
+import socketio
+from aiohttp import web
+from common import decode_chatid, format_message, to_bytes, wire_message, HISTORY_PAGE_SIZE
+from exchange_index import chat_members, is_member
+from password_hashing import PasswordHasher, AttemptThrottle, HashingOverloaded, Throttled
+from structured_log import get_logger, fields
+
+STORAGE_BACKEND = os.getenv('VSC_STORAGE', 'mysql')
+if STORAGE_BACKEND == 'memory':
+    from memory_store import AsyncMemoryStore
+    db = AsyncMemoryStore()
+else:
+    import async_database as db
+
+ALLOWED_ORIGIN = "http://localhost:3000"
+api_logger = get_logger('api')
+password_hasher = PasswordHasher(
+    workers=int(os.getenv('HASH_WORKERS', 2)),
+    max_pending=int(os.getenv('HASH_MAX_PENDING', 32)),
+    rounds=int(os.getenv('BCRYPT_ROUNDS', 12))
+).start()
+atexit.register(password_hasher.stop)
+ip_throttle = AttemptThrottle(int(os.getenv('AUTH_IP_ATTEMPTS', 30)), float(os.getenv('AUTH_IP_WINDOW', 60)))
+username_throttle = AttemptThrottle(int(os.getenv('AUTH_USERNAME_ATTEMPTS', 10)), float(os.getenv('AUTH_USERNAME_WINDOW', 300)))
+
+sio = socketio.AsyncServer(async_mode='aiohttp', cors_allowed_origins=ALLOWED_ORIGIN, cors_credentials=True)
+
+@web.middleware
+async def cors_middleware(request, handler):
+    if request.method == 'OPTIONS':
+        response = web.Response()
+    else:
+        response = await handler(request)
+    response.headers['Access-Control-Allow-Origin'] = ALLOWED_ORIGIN
+    response.headers['Access-Control-Allow-Credentials'] = 'true'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+    return response
+
+app = web.Application(middlewares=[cors_middleware])
+routes = web.RouteTableDef()
+
+def overloaded_response():
+    return web.json_response({"success": False, "message": "Server busy, please try again later"}, status=503, headers={'Retry-After': '1'})
+
+def throttled_response(e):
+    return web.json_response({"success": False, "message": "Too many attempts, please try again later"}, status=429, headers={'Retry-After': str(max(1, int(e.retry_after + 0.5)))})
+
+def report_error(event, error):
+    logger = get_logger(event)
+    # tracebacks only when the event is logged at DEBUG; the error text is enough to alert on
+    logger.error("Event error", exc_info=error if logger.isEnabledFor(logging.DEBUG) else None, extra=fields(error=str(error)))
+
+def session_response(body, session_id, status=200):
+    resp = web.json_response(body, status=status)
+    resp.set_cookie('session_id', session_id, httponly=True, secure=False, samesite='None')
+    return resp
+
+@routes.post('/api/signup')
+async def signup(request):
+    try:
+        data = await request.json()
+        username = data['username']
+        password = data['password']
+        ip_throttle.hit(request.remote)
+        session_id = uuid.uuid4().hex
+        hashed_password = await password_hasher.hash_async(password)
+        await db.add_user(username, hashed_password, session_id)
+        return session_response({'success': True, 'message': 'User created successfully', 'session_id': session_id}, session_id)
+    except Throttled as e:
+        return throttled_response(e)
+    except HashingOverloaded:
+        return overloaded_response()
+    except Exception as e:
+        api_logger.error("Signup error", extra=fields(error=str(e)))
+        return web.json_response({'success': False, 'message': 'Signup failed'}, status=401)
+
+@routes.post('/api/login')
+async def login(request):
+    data = await request.json()
+    username = data['username']
+    password = data['password']
+    try:
+        ip_throttle.hit(request.remote)
+        username_throttle.hit(username)
+        user_info = await db.get_user(username)
+        if not user_info:
+            return web.json_response({"success": False, "message": "User not found"}, status=401)
+        password_hash = user_info[2]
+        if not await password_hasher.verify_async(password, password_hash):
+            return web.json_response({"success": False, "message": "Wrong Password"}, status=401)
+        username_throttle.reset(username)
+        if password_hasher.needs_rehash(password_hash):
+            try:
+                await db.update_password(user_info[0], await password_hasher.hash_async(password))
+            except HashingOverloaded:
+                pass
+        return session_response({"success": True, "message": "Login successful", "session_id": user_info[3]}, user_info[3])
+    except Throttled as e:
+        return throttled_response(e)
+    except HashingOverloaded:
+        return overloaded_response()
+    except Exception as e:
+        api_logger.error("Login error", extra=fields(error=str(e)))
+        return web.json_response({"success": False, "message": "Error occurred, please try again later"}, status=500)
+
+@routes.post('/api/check_username')
+async def check_username(request):
+    data = await request.json()
+    try:
+        if await db.get_user(data['username']):
+            return web.json_response({"success": False, "message": "Username not available"}, status=409)
+        return web.json_response({"success": True, "message": "Username is available"}, status=200)
+    except Exception as e:
+        api_logger.error("Check username error", extra=fields(error=str(e)))
+        return web.json_response({"success": False, "message": "Error occurred, please try again later"}, status=500)
+
+@routes.post('/api/username_to_id')
+async def username_to_id(request):
+    try:
+        data = await request.json()
+        user = await db.get_user(data['username'])
+        if user:
+            return web.json_response({"success": True, "message": "Username to id conversion successful", "data": {"User_id": user[0]}}, status=200)
+        return web.json_response({"success": False, "message": "User not found"}, status=404)
+    except Exception as e:
+        api_logger.error("Username to ID error", extra=fields(error=str(e)))
+        return web.json_response({"success": False, "message": "Error occurred, please try again later"}, status=500)
+
+@routes.get('/api/authenticate')
+async def authenticate(request):
+    try:
+        user = await db.session_check(request.cookies['session_id'])
+        if user:
+            return web.json_response({"success": True, "message": "Authentication successful", "data": {"User_id": user[0], "Username": user[1]}}, status=200)
+        return web.json_response({"success": False, "message": "Authentication Failed"}, status=401)
+    except Exception as e:
+        api_logger.error("Authentication error", extra=fields(error=str(e)))
+        return web.json_response({"success": False, "message": "Error occurred, please try again later"}, status=500)
+
+@routes.post('/api/logout')
+async def logout(request):
+    try:
+        session_id = request.cookies.get('session_id')
+        user = await db.session_check(session_id) if session_id else None
+        if not user:
+            return web.json_response({"success": False, "message": "Authentication Failed"}, status=401)
+        await db.rotate_session(user[0], uuid.uuid4().hex)
+        for sid, _ in list(sio.manager.get_participants('/', f"user_{user[0]}")):
+            await sio.disconnect(sid)
+        resp = web.json_response({"success": True, "message": "Logout successful"}, status=200)
+        resp.del_cookie('session_id')
+        return resp
+    except Exception as e:
+        api_logger.error("Logout error", extra=fields(error=str(e)))
+        return web.json_response({"success": False, "message": "Error occurred, please try again later"}, status=500)
+
+# -- websocket --
+async def current_user(sid):
+    session = await sio.get_session(sid)
+    return session.get('user_id')
+
+async def history_page(chat_id, data):
+    before_id = data.get('before_id')
+    limit = data.get('limit', HISTORY_PAGE_SIZE)
+    messages, next_cursor = await db.get_messages_page(chat_id, before_id, limit)
+    return {"chat_id": chat_id, "messages": [wire_message(format_message(m), False) for m in messages], "next_cursor": next_cursor}
+
+@sio.on('connect')
+async def handle_connect(sid, environ, auth=None):
+    cookie = SimpleCookie(environ.get('HTTP_COOKIE', ''))
+    session_id = cookie['session_id'].value if 'session_id' in cookie else None
+    user = await db.session_check(session_id) if session_id else None
+    if not user:
+        return False
+
+    user_id = user[0]
+    await sio.save_session(sid, {'user_id': user_id})
+    try:
+        await sio.enter_room(sid, f"user_{user_id}")
+        key_exchanges = await db.get_key_exchanges(user_id)
+        await sio.emit('key_exchange_requests', key_exchanges, to=sid)
+    except Exception as e:
+        report_error('connect', e)
+        return False
+
+@sio.on('connected_chats')
+async def handle_connected_chats(sid):
+    user_id = await current_user(sid)
+    try:
+        chats = await db.get_chat_list(user_id)
+        for chat in chats:
+            await sio.enter_room(sid, f"chat_{chat[2]}")
+        await sio.emit('connected_chats', {'chats': [{"reciever_id": int(chat[0]), "sender_id": int(chat[1]), "chat_id": chat[2], "unread_messages": chat[5], "last_read_id": chat[6], "reciever_username": chat[3], "sender_username": chat[4]} for chat in chats]}, to=sid)
+    except Exception as e:
+        report_error('connected_chats', e)
+
+@sio.on('connect_chat')
+async def handle_connect_chat(sid, data):
+    user_id = await current_user(sid)
+    chat_id = data.get('chat_id') if data else None
+    if not chat_id:
+        await sio.disconnect(sid)
+        return
+
+    try:
+        if user_id not in decode_chatid(chat_id):
+            await sio.disconnect(sid)
+            return
+        await sio.enter_room(sid, f"chat_{chat_id}")
+        await sio.emit('message_history', await history_page(chat_id, data), to=sid)
+    except Exception as e:
+        report_error('connect_chat', e)
+        await sio.disconnect(sid)
+
+@sio.on('key_exchange_requests')
+async def handle_key_exchange_requests(sid):
+    user_id = await current_user(sid)
+    key_exchanges = await db.get_key_exchanges(user_id)
+    await sio.emit('key_exchange_requests', key_exchanges, to=sid)
+
+@sio.on('key_exchange_success')
+async def handle_key_exchange_success(sid, data):
+    user_id = await current_user(sid)
+    try:
+        chat_id = data.get('chat_id')
+        public_key = data.get('public_key')
+        if not chat_id or not public_key:
+            return
+
+        if not is_member(user_id, chat_id):
+            await sio.disconnect(sid)
+            return
+
+        # only the receiver of the request can complete it
+        exchange = await db.get_key_exchange(chat_id)
+        if exchange is None or exchange[1] != user_id:
+            return
+        if exchange[5]:
+            get_logger('key_exchange_success').info("Key exchange already accepted, ignoring", extra=fields(chat_id=chat_id))
+            return
+
+        await db.accept_key_exchange(user_id, chat_id)
+        await sio.emit('key_exchange_success', {
+            'sender_id': user_id,
+            'chat_id': chat_id,
+            'public_key': public_key
+        }, room=f"chat_{chat_id}")
+    except Exception as e:
+        report_error('key_exchange_success', e)
+
+@sio.on('key_exchange_request')
+async def handle_key_exchange_request(sid, data):
+    user_id = await current_user(sid)
+    try:
+        reciever_id = data.get('reciever_id')
+        chat_id = data.get('chat_id')
+        public_key = data.get('public_key')
+
+        if not all([reciever_id, chat_id, public_key]):
+            return
+
+        if reciever_id == user_id or chat_members(chat_id) != {user_id, reciever_id}:
+            await sio.disconnect(sid)
+            return
+
+        if await db.get_key_exchange(chat_id):
+            get_logger('key_exchange_request').info("Key exchange already exists, ignoring request", extra=fields(chat_id=chat_id))
+            return
+
+        await db.add_key_exchange(reciever_id, user_id, chat_id, public_key)
+        await sio.enter_room(sid, f"chat_{chat_id}")
+        await sio.emit('new_key_exchange_request', {
+            'sender_id': user_id,
+            'chat_id': chat_id,
+            'public_key': public_key
+        }, room=f"user_{reciever_id}")
+    except Exception as e:
+        report_error('key_exchange_request', e)
+
+@sio.on('get_history')
+async def handle_get_history(sid, data):
+    user_id = await current_user(sid)
+    try:
+        chat_id = data.get('chat_id') if data else None
+        if not chat_id:
+            return
+        if user_id not in decode_chatid(chat_id):
+            await sio.disconnect(sid)
+            return
+        await sio.emit('message_history', await history_page(chat_id, data), to=sid)
+    except Exception as e:
+        report_error('get_history', e)
+
+@sio.on('send_message')
+async def handle_send_message(sid, data):
+    user_id = await current_user(sid)
+    try:
+        chat_id = data.get('chat_id')
+        if not chat_id:
+            return
+        if user_id not in decode_chatid(chat_id):
+            await sio.disconnect(sid)
+            return
+
+        message_data = {
+            'sender': data.get('sender'),
+            'receiver': data.get('receiver'),
+            'ciphertext': to_bytes(data.get('ciphertext')),
+            'iv': to_bytes(data.get('iv')),
+            'timestamp': time.time(),
+        }
+        if user_id != message_data['sender'] or {message_data['sender'], message_data['receiver']} != set(decode_chatid(chat_id)):
+            await sio.disconnect(sid)
+            return
+
+        await db.add_message(message_data)
+        await sio.emit('new_message', wire_message(message_data, False), room=f"chat_{chat_id}")
+    except Exception as e:
+        report_error('send_message', e)
+
+@sio.on('mark_read')
+async def handle_mark_read(sid, data):
+    user_id = await current_user(sid)
+    try:
+        chat_id = data.get('chat_id') if data else None
+        message_id = data.get('message_id') if data else None
+        if not chat_id or message_id is None:
+            return
+        if user_id not in decode_chatid(chat_id):
+            await sio.disconnect(sid)
+            return
+        last_read_id, unread = await db.mark_read(user_id, chat_id, message_id)
+        await sio.emit('read_state', {'chat_id': chat_id, 'last_read_id': last_read_id, 'unread_messages': unread}, room=f"user_{user_id}")
+    except Exception as e:
+        report_error('mark_read', e)
+
+async def on_startup(app):
+    await db.database_setup()
+
+async def on_cleanup(app):
+    if STORAGE_BACKEND != 'memory':
+        await db.close_pool()
+
+app.add_routes(routes)
+app.on_startup.append(on_startup)
+app.on_cleanup.append(on_cleanup)
+sio.attach(app)
+
+if __name__ == "__main__":
+    web.run_app(app, host=os.getenv('HOST', '127.0.0.1'), port=int(os.getenv('PORT', 5000)))
@@ -0,0 +1,308 @@
+import fcntl
+import hashlib
+import hmac
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ATTACHMENT_ID = re.compile(r'^[0-9a-f]{64}$')
+UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+COPY_SIZE = 1024 * 1024
+
+class AttachmentError(Exception):
+    pass
+
+class UploadNotFound(AttachmentError):
+    pass
+
+class InvalidChunk(AttachmentError):
+    pass
+
+class IncompleteUpload(AttachmentError):
+    pass
+
+class QuotaExceeded(AttachmentError):
+    pass
+
+def proof_digest(nonce, path):
+    """The answer to a proof challenge: hex sha256 of the nonce followed by the stored blob"""
+    digest = hashlib.sha256(nonce.encode('ascii'))
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(COPY_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class AttachmentStore:
+    """
+    Encrypted attachment blobs on disk, named by the SHA-256 of their ciphertext.
+
+    An upload declares its total size and chunk size up front; chunks are written at
+    index * chunk_size in a sparse part file and marked in a one-byte-per-chunk map, so
+    chunks may arrive in any order, be retried, or resume after a restart or on another
+    worker sharing the directory. A received chunk is never rewritten, so the SHA-256 can be
+    kept running over the leading chunks as they land, and completing the upload only
+    finalises it before moving the part file into objects/, where identical ciphertext is
+    only ever stored once.
+
+    A declared sha256 that is already stored does not skip the upload on its own word: the
+    client gets a nonce and has to answer with sha256(nonce || ciphertext), which only a
+    holder of the bytes can compute; the expected answer is hashed on a small thread pool as
+    soon as the nonce is issued. Every upload started counts against its owner's
+    daily_quota bytes, kept in quota/ so all workers sharing the directory see the same total.
+    """
+
+    def __init__(self, directory, max_size=100 * 1024 * 1024, max_chunk_size=4 * 1024 * 1024, upload_ttl=86400, daily_quota=1024 * 1024 * 1024, proof_workers=2):
+        self.directory = directory
+        self.uploads = os.path.join(directory, 'uploads')
+        self.objects = os.path.join(directory, 'objects')
+        self.quota = os.path.join(directory, 'quota')
+        self.max_size = max_size
+        self.max_chunk_size = max_chunk_size
+        self.upload_ttl = upload_ttl
+        self.daily_quota = daily_quota
+        self.lock = threading.Lock()
+        self.digests = {}
+        self.proofs = {}
+        self.proof_pool = ThreadPoolExecutor(max_workers=proof_workers, thread_name_prefix='attachment-proof')
+        self.created = 0
+        self.completed = 0
+        self.deduplicated = 0
+        self.proofs_failed = 0
+        self.quota_rejected = 0
+        self.chunks_written = 0
+        self.bytes_written = 0
+
+    def _upload_path(self, upload_id, suffix):
+        if not UPLOAD_ID.match(upload_id or ''):
+            raise UploadNotFound(upload_id)
+        return os.path.join(self.uploads, upload_id + suffix)
+
+    def object_path(self, attachment_id):
+        """Path of a completed attachment, or None"""
+        if not ATTACHMENT_ID.match(attachment_id or ''):
+            return None
+        path = os.path.join(self.objects, attachment_id[:2], attachment_id)
+        return path if os.path.exists(path) else None
+
+    def _load(self, upload_id, owner):
+        try:
+            with open(self._upload_path(upload_id, '.json')) as f:
+                upload = json.load(f)
+        except FileNotFoundError:
+            raise UploadNotFound(upload_id)
+        if upload['owner'] != owner:
+            raise UploadNotFound(upload_id)
+        return upload
+
+    def _charge(self, owner, size):
+        """Adds size bytes to the owner's usage for today, refusing to go over daily_quota; a negative size refunds"""
+        path = os.path.join(self.quota, f"{owner}-{time.strftime('%Y%m%d', time.gmtime())}")
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            # workers share the directory, so the read-modify-write holds the file lock
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            used = int(os.pread(fd, 32, 0) or 0)
+            if size > 0 and used + size > self.daily_quota:
+                self.quota_rejected += 1
+                raise QuotaExceeded("Daily attachment quota exceeded")
+            os.ftruncate(fd, 0)
+            os.pwrite(fd, str(max(0, used + size)).encode('ascii'), 0)
+        finally:
+            os.close(fd)
+
+    def create(self, owner, size, chunk_size, sha256=None):
+        """
+        Starts an upload. When a blob with the declared sha256 and size is already stored the
+        upload also carries a proof nonce, and answering it through prove() skips sending the bytes.
+        """
+        try:
+            size, chunk_size = int(size), int(chunk_size)
+        except (TypeError, ValueError):
+            raise InvalidChunk("Attachment size and chunk size are required")
+        if not 0 < size <= self.max_size or not 0 < chunk_size <= self.max_chunk_size:
+            raise InvalidChunk("Attachment or chunk size out of range")
+        if sha256 is not None and not ATTACHMENT_ID.match(str(sha256)):
+            raise InvalidChunk("Invalid sha256")
+        # made by the first upload rather than when the server imports this
+        os.makedirs(self.uploads, exist_ok=True)
+        os.makedirs(self.quota, exist_ok=True)
+        self.expire()
+        self._charge(owner, size)
+        upload_id = uuid.uuid4().hex
+        chunks = -(-size // chunk_size)
+        with open(self._upload_path(upload_id, '.part'), 'wb') as f:
+            f.truncate(size)
+        with open(self._upload_path(upload_id, '.map'), 'wb') as f:
+            f.truncate(chunks)
+        existing = self.object_path(sha256) if sha256 is not None else None
+        nonce = uuid.uuid4().hex if existing and os.path.getsize(existing) == size else None
+        upload = {"owner": owner, "size": size, "chunk_size": chunk_size, "chunks": chunks, "sha256": sha256, "nonce": nonce, "created": time.time()}
+        with open(self._upload_path(upload_id, '.json'), 'w') as f:
+            json.dump(upload, f)
+        if nonce:
+            with self.lock:
+                self.proofs[upload_id] = self.proof_pool.submit(proof_digest, nonce, existing)
+        self.created += 1
+        created = {"upload_id": upload_id, "chunks": chunks, "complete": False}
+        if nonce:
+            created["proof_nonce"] = nonce
+        return created
+
+    def prove(self, owner, upload_id, proof):
+        """
+        Completes an upload against the stored blob if proof is the hex sha256 of the nonce
+        followed by the blob. One attempt per upload; after a wrong answer the chunks are still needed.
+        """
+        upload = self._load(upload_id, owner)
+        if not upload.get("nonce"):
+            raise InvalidChunk("Upload has no proof challenge")
+        path = self.object_path(upload["sha256"])
+        if path is None:
+            raise InvalidChunk("Upload has no proof challenge")
+        with self.lock:
+            expected = self.proofs.pop(upload_id, None)
+        if expected is None:
+            # challenged on another worker, or before a restart
+            expected = self.proof_pool.submit(proof_digest, upload["nonce"], path)
+        if not hmac.compare_digest(expected.result(), str(proof or '')):
+            upload["nonce"] = None
+            with open(self._upload_path(upload_id, '.json'), 'w') as f:
+                json.dump(upload, f)
+            self.proofs_failed += 1
+            raise InvalidChunk("Proof does not match the stored attachment")
+        self._discard(upload_id)
+        self._charge(owner, -upload["size"])
+        self.deduplicated += 1
+        return {"attachment_id": upload["sha256"], "size": upload["size"], "complete": True}
+
+    def status(self, owner, upload_id):
+        """Chunk indexes still missing, for a client resuming the upload"""
+        upload = self._load(upload_id, owner)
+        with open(self._upload_path(upload_id, '.map'), 'rb') as f:
+            received = f.read()
+        missing = [index for index, flag in enumerate(received) if not flag]
+        return {"upload_id": upload_id, "size": upload["size"], "chunk_size": upload["chunk_size"], "chunks": upload["chunks"], "missing": missing}
+
+    def write_chunk(self, owner, upload_id, index, stream, length):
+        """Streams one chunk from a file-like body straight to its place in the part file"""
+        upload = self._load(upload_id, owner)
+        index = int(index)
+        if not 0 <= index < upload["chunks"]:
+            raise InvalidChunk("Chunk index out of range")
+        offset = index * upload["chunk_size"]
+        expected = min(upload["chunk_size"], upload["size"] - offset)
+        if length is not None and length != expected:
+            raise InvalidChunk(f"Chunk {index} must be {expected} bytes")
+        # a marked chunk is never rewritten, which keeps every worker's running digest valid; the
+        # map lock makes check, write and mark one step when a chunk is sent twice at once
+        map_fd = os.open(self._upload_path(upload_id, '.map'), os.O_RDWR)
+        try:
+            fcntl.flock(map_fd, fcntl.LOCK_EX)
+            if os.pread(map_fd, 1, index) == b'\x01':
+                return
+            fd = os.open(self._upload_path(upload_id, '.part'), os.O_WRONLY)
+            try:
+                written = 0
+                while written < expected:
+                    data = stream.read(min(COPY_SIZE, expected - written))
+                    if not data:
+                        break
+                    os.pwrite(fd, data, offset + written)
+                    written += len(data)
+                if written != expected or stream.read(1):
+                    raise InvalidChunk(f"Chunk {index} must be {expected} bytes")
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            # the chunk is durable before it is marked, so a crash can only cost a resend
+            os.pwrite(map_fd, b'\x01', index)
+        finally:
+            os.close(map_fd)
+        self.chunks_written += 1
+        self.bytes_written += expected
+        self._advance(upload_id, upload)
+
+    def _advance(self, upload_id, upload):
+        """Hashes the received chunks that follow the running digest, reading them back while they are still in the page cache"""
+        with self.lock:
+            state = self.digests.get(upload_id)
+            if state is None:
+                state = self.digests[upload_id] = {"lock": threading.Lock(), "sha256": hashlib.sha256(), "next": 0}
+        with state["lock"]:
+            with open(self._upload_path(upload_id, '.map'), 'rb') as f:
+                received = f.read()
+            if state["next"] < upload["chunks"] and received[state["next"]]:
+                with open(self._upload_path(upload_id, '.part'), 'rb') as f:
+                    f.seek(state["next"] * upload["chunk_size"])
+                    while state["next"] < upload["chunks"] and received[state["next"]]:
+                        state["sha256"].update(f.read(upload["chunk_size"]))
+                        state["next"] += 1
+            return state["sha256"].hexdigest()
+
+    def complete(self, owner, upload_id):
+        status = self.status(owner, upload_id)
+        if status["missing"]:
+            raise IncompleteUpload(f"{len(status['missing'])} chunks missing")
+        upload = self._load(upload_id, owner)
+        part = self._upload_path(upload_id, '.part')
+        # all chunks are in, so this only hashes what another worker or a previous process received
+        attachment_id = self._advance(upload_id, upload)
+        if upload["sha256"] is not None and upload["sha256"] != attachment_id:
+            raise InvalidChunk("Uploaded data does not match the declared sha256")
+        target = os.path.join(self.objects, attachment_id[:2], attachment_id)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(target):
+            self.deduplicated += 1
+            os.remove(part)
+        else:
+            os.replace(part, target)
+        self._discard(upload_id)
+        self.completed += 1
+        return {"attachment_id": attachment_id, "size": upload["size"], "complete": True}
+
+    def _discard(self, upload_id):
+        with self.lock:
+            self.digests.pop(upload_id, None)
+            self.proofs.pop(upload_id, None)
+        for suffix in ('.part', '.map', '.json'):
+            try:
+                os.remove(self._upload_path(upload_id, suffix))
+            except FileNotFoundError:
+                pass
+
+    def expire(self):
+        """Removes uploads that have not been touched for upload_ttl seconds, and quota counters from past days"""
+        cutoff = time.time() - self.upload_ttl
+        for name in os.listdir(self.uploads):
+            upload_id, suffix = os.path.splitext(name)
+            if suffix == '.map' and os.path.getmtime(os.path.join(self.uploads, name)) < cutoff:
+                self._discard(upload_id)
+        # uploads completed or expired by another worker leave their state behind here
+        with self.lock:
+            tracked = set(self.digests) | set(self.proofs)
+        for upload_id in tracked:
+            if not os.path.exists(self._upload_path(upload_id, '.map')):
+                self._discard(upload_id)
+        cutoff = time.time() - 2 * 86400
+        for name in os.listdir(self.quota):
+            path = os.path.join(self.quota, name)
+            if os.path.getmtime(path) < cutoff:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        return {
+            "created": self.created,
+            "completed": self.completed,
+            "deduplicated": self.deduplicated,
+            "proofs_failed": self.proofs_failed,
+            "quota_rejected": self.quota_rejected,
+            "chunks_written": self.chunks_written,
+            "bytes_written": self.bytes_written
+        }
@@ -0,0 +1,60 @@
+import argparse
+import threading
+import time
+from database import get_connection, add_message, add_messages
+from message_writer import MessageWriter
+
+BENCH_SENDER = 900000001
+BENCH_RECEIVER = 900000002
+
+def cleanup():
+    connection = get_connection()
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM messages WHERE chat_id = %s", (f"{BENCH_SENDER}:{BENCH_RECEIVER}",))
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+def run(store, total, threads):
+    per_thread = total // threads
+    message_data = {'sender': BENCH_SENDER, 'receiver': BENCH_RECEIVER, 'ciphertext': "x" * 64, 'iv': "y" * 16}
+
+    def worker():
+        for _ in range(per_thread):
+            store(dict(message_data, timestamp=time.time()))
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return per_thread * threads, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Messages/sec for per-row inserts versus the write-behind queue")
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--batch", type=int, default=256)
+    parser.add_argument("--interval", type=float, default=0.005)
+    args = parser.parse_args()
+
+    print(f"{'mode':>22} {'messages':>9} {'seconds':>8} {'msg/s':>9}")
+    try:
+        count, elapsed = run(add_message, args.messages, args.threads)
+        print(f"{'per-row':>22} {count:>9} {elapsed:>8.2f} {count / elapsed:>9.0f}")
+
+        for durable in (False, True):
+            writer = MessageWriter(add_messages, max_batch=args.batch, flush_interval=args.interval, durable=durable)
+            writer.start()
+            start = time.perf_counter()
+            count, _ = run(writer.submit, args.messages, args.threads)
+            writer.stop()
+            elapsed = time.perf_counter() - start
+            mode = "write-behind durable" if durable else "write-behind"
+            print(f"{mode:>22} {count:>9} {elapsed:>8.2f} {count / elapsed:>9.0f}")
+    finally:
+        cleanup()
+
+if __name__ == "__main__":
+    main()
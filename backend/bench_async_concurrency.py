@@ -0,0 +1,71 @@
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+import aiohttp
+import socketio
+
+async def signup(url, username):
+    async with aiohttp.ClientSession() as session:
+        async with session.post(f"{url}/api/signup", json={'username': username, 'password': 'bench-password'}) as resp:
+            data = await resp.json()
+            return data['session_id']
+
+async def open_client(url, session_id):
+    client = socketio.AsyncClient(reconnection=False)
+    await client.connect(url, headers={'Cookie': f"session_id={session_id}"}, transports=['websocket'])
+    return client
+
+def rss_mb(pid):
+    if pid is None:
+        return None
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return None
+
+async def probe_latency(client, samples):
+    latencies = []
+    reply = asyncio.Queue()
+    client.on('connected_chats', lambda data: reply.put_nowait(time.perf_counter()))
+    for _ in range(samples):
+        start = time.perf_counter()
+        await client.emit('connected_chats')
+        latencies.append((await asyncio.wait_for(reply.get(), 10) - start) * 1000)
+    return latencies
+
+async def run(args):
+    session_id = await signup(args.url, f"bench_{uuid.uuid4().hex[:8]}")
+    probe = await open_client(args.url, session_id)
+    idle = []
+    print(f"{'idle sockets':>12} {'connect s':>10} {'p50 ms':>8} {'p99 ms':>8} {'server MB':>10}")
+    try:
+        for target in [int(s) for s in args.sockets.split(',')]:
+            start = time.perf_counter()
+            while len(idle) < target:
+                batch = min(args.batch, target - len(idle))
+                idle.extend(await asyncio.gather(*[open_client(args.url, session_id) for _ in range(batch)]))
+            connect_time = time.perf_counter() - start
+            latencies = sorted(await probe_latency(probe, args.samples))
+            p50 = statistics.median(latencies)
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            rss = rss_mb(args.pid)
+            rss_text = f"{rss:>10.1f}" if rss is not None else f"{'n/a':>10}"
+            print(f"{len(idle):>12} {connect_time:>10.2f} {p50:>8.2f} {p99:>8.2f} {rss_text}")
+    finally:
+        await asyncio.gather(*[client.disconnect() for client in idle + [probe]], return_exceptions=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Hold N idle sockets open and measure event latency on one active socket")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--sockets", default="100,1000,5000", help="comma separated idle socket counts")
+    parser.add_argument("--batch", type=int, default=100, help="concurrent connects per batch")
+    parser.add_argument("--samples", type=int, default=200, help="latency probes per step")
+    parser.add_argument("--pid", type=int, default=None, help="server pid for RSS reporting")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
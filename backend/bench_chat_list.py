@@ -0,0 +1,78 @@
+import argparse
+import statistics
+import time
+from database import get_connection, get_accepted_key_exchanges, get_username, get_messages, get_chat_list, generate_chatid
+
+BENCH_PREFIX = "bench_cl_"
+
+def seed_chats(count, messages_per_chat):
+    connection = get_connection()
+    cursor = connection.cursor()
+    cursor.execute("INSERT INTO users (username, password, session_id) VALUES (%s, '', NULL)", (f"{BENCH_PREFIX}me",))
+    user_id = cursor.lastrowid
+    chat_ids = []
+    for i in range(count):
+        cursor.execute("INSERT INTO users (username, password, session_id) VALUES (%s, '', NULL)", (f"{BENCH_PREFIX}{i}",))
+        peer_id = cursor.lastrowid
+        chat_id = generate_chatid(user_id, peer_id)
+        chat_ids.append(chat_id)
+        cursor.execute(
+            "INSERT INTO key_exchanges (reciever_id, sender_id, chat_id, public_key, accepted) VALUES (%s, %s, %s, '', TRUE)",
+            (user_id, peer_id, chat_id)
+        )
+        cursor.executemany(
+            "INSERT INTO messages (sender, receiver, ciphertext, iv, chat_id) VALUES (%s, %s, %s, %s, %s)",
+            [(peer_id, user_id, "x" * 64, "y" * 16, chat_id) for _ in range(messages_per_chat)]
+        )
+    connection.commit()
+    cursor.close()
+    connection.close()
+    return user_id, chat_ids
+
+def cleanup(chat_ids):
+    connection = get_connection()
+    cursor = connection.cursor()
+    for chat_id in chat_ids:
+        cursor.execute("DELETE FROM messages WHERE chat_id = %s", (chat_id,))
+        cursor.execute("DELETE FROM key_exchanges WHERE chat_id = %s", (chat_id,))
+    cursor.execute("DELETE FROM users WHERE username LIKE %s", (f"{BENCH_PREFIX}%",))
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+def per_chat_path(user_id):
+    return [
+        (k[1], k[2], k[3], get_username(k[1]), get_username(k[2]), len(get_messages(k[3])))
+        for k in get_accepted_key_exchanges(user_id)
+    ]
+
+def batched_path(user_id):
+    return get_chat_list(user_id)
+
+def time_call(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the per-chat chat list path against get_chat_list")
+    parser.add_argument("--sizes", default="10,100,1000", help="comma separated chat counts")
+    parser.add_argument("--messages", type=int, default=20, help="messages seeded per chat")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'chats':>6} {'per-chat ms':>12} {'batched ms':>11} {'queries before':>15} {'queries after':>14}")
+    for size in [int(s) for s in args.sizes.split(',')]:
+        user_id, chat_ids = seed_chats(size, args.messages)
+        try:
+            per_chat = time_call(lambda: per_chat_path(user_id), args.repeat)
+            batched = time_call(lambda: batched_path(user_id), args.repeat)
+            print(f"{size:>6} {per_chat:>12.2f} {batched:>11.2f} {1 + 3 * size:>15} {1:>14}")
+        finally:
+            cleanup(chat_ids)
+
+if __name__ == "__main__":
+    main()
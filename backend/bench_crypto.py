@@ -0,0 +1,55 @@
+import argparse
+import os
+import time
+from crypto_example import ECDHEKeyExchange, CryptoSession
+
+def rate(fn, count):
+    start = time.perf_counter()
+    fn()
+    return count / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description="Messages per second through ECDHEKeyExchange against CryptoSession, one at a time and in batches")
+    parser.add_argument("--count", type=int, default=5000)
+    parser.add_argument("--size", type=int, default=256, help="plaintext bytes per message")
+    parser.add_argument("--batch", type=int, default=100)
+    args = parser.parse_args()
+
+    alice, bob = ECDHEKeyExchange(), ECDHEKeyExchange()
+    alice.generate_keypair()
+    bob.generate_keypair()
+    bob_pem = bob.get_public_key_pem()
+    session = CryptoSession(alice)
+    receiver = CryptoSession(bob)
+    text = os.urandom(args.size // 2).hex()
+    raw = text.encode('utf-8')
+    batches = [[text] * args.batch for _ in range(max(1, args.count // args.batch))]
+    count = len(batches) * args.batch
+    secret = alice.compute_shared_secret(bob.public_key)
+
+    def legacy_derive_each():
+        # what a client does when it derives the key for every message
+        for _ in range(count):
+            alice.encrypt_message(text, alice.compute_shared_secret(alice.load_public_key_from_pem(bob_pem)))
+
+    encrypted = [alice.encrypt_message(text, secret) for _ in range(count)]
+    sealed = [bytes(record) for batch in batches for record in session.encrypt_many(bob_pem, batch, raw=True)]
+
+    print(f"{'path':>28} {'msgs/s':>12}")
+    rows = [
+        ("legacy, derive each", lambda: legacy_derive_each()),
+        ("legacy encrypt_message", lambda: [alice.encrypt_message(text, secret) for _ in range(count)]),
+        ("session encrypt", lambda: [session.encrypt(bob_pem, text) for _ in range(count)]),
+        ("session encrypt raw", lambda: [session.encrypt(bob_pem, raw, raw=True) for _ in range(count)]),
+        ("session encrypt_many", lambda: [session.encrypt_many(bob_pem, batch) for batch in batches]),
+        ("session encrypt_many raw", lambda: [session.encrypt_many(bob_pem, batch, raw=True) for batch in batches]),
+        ("legacy decrypt_message", lambda: [bob.decrypt_message(item, secret) for item in encrypted]),
+        ("session decrypt", lambda: [receiver.decrypt(alice.public_key, item) for item in encrypted]),
+        ("session decrypt raw", lambda: [receiver.decrypt(alice.public_key, item, raw=True) for item in sealed]),
+        ("session decrypt_many raw", lambda: [receiver.decrypt_many(alice.public_key, sealed[i:i + args.batch], raw=True) for i in range(0, count, args.batch)]),
+    ]
+    for label, fn in rows:
+        print(f"{label:>28} {rate(fn, count):>12.0f}")
+
+if __name__ == "__main__":
+    main()
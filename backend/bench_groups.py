@@ -0,0 +1,87 @@
+import argparse
+import base64
+import json
+import time
+import uuid
+from bench_socketio import InProcessDriver, ServerDriver, percentiles, wait_for_event
+from common import generate_chatid
+
+def add_contacts(driver, owner, owner_id, members):
+    """Accepted key exchanges between the owner and every member, which the server requires before grouping them"""
+    for client, user_id in members:
+        chat_id = generate_chatid(owner_id, user_id)
+        driver.emit(owner, 'key_exchange_request', {'reciever_id': user_id, 'chat_id': chat_id, 'public_key': 'bench-key-owner'})
+        wait_for_event(driver, client, 'new_key_exchange_request', match=lambda d: d['chat_id'] == chat_id)
+        driver.emit(client, 'key_exchange_success', {'chat_id': chat_id, 'public_key': 'bench-key-member'})
+        wait_for_event(driver, owner, 'key_exchange_success', match=lambda d: d['chat_id'] == chat_id)
+
+def run_group(driver, size, messages, suffix):
+    """
+    Creates a group of size members, sends messages from the owner and times delivery to every member.
+
+    Delivery is when each member's packet was handed to its socket: stamped by the test client
+    queue in process, and on arrival by the client in server mode.
+    """
+    clients = [driver.signup(f"g{size}_{i}_{suffix}") for i in range(size)]
+    (owner, owner_id), members = clients[0], clients[1:]
+    add_contacts(driver, owner, owner_id, members)
+    driver.emit(owner, 'create_group', {'name': f"bench {size}", 'member_ids': [user_id for _, user_id in members]})
+    info, _ = wait_for_event(driver, owner, 'group_added')
+    if info is None:
+        raise RuntimeError(f"group of {size} was not created")
+    chat_id = info['chat_id']
+    for client, _ in members:
+        driver.emit(client, 'connect_chat', {'chat_id': chat_id})
+    for client, _ in clients:
+        driver.received(client)
+
+    latencies = []
+    send_times = []
+    delivered = 0
+    for n in range(messages):
+        token = base64.b64encode(f"group-{n}".encode('ascii')).decode('ascii')
+        sent_at = time.perf_counter()
+        driver.emit(owner, 'send_message', {'chat_id': chat_id, 'sender': owner_id, 'ciphertext': token, 'iv': 'AAAAAWJlbmNoLWl2LTEy'})
+        returned_at = time.perf_counter()
+        send_times.append(returned_at - sent_at)
+        for client, _ in members:
+            data, received_at = wait_for_event(driver, client, 'new_message', match=lambda d: d.get('ciphertext') == token)
+            if data is not None:
+                delivered += 1
+                latencies.append(received_at - sent_at)
+    for client, _ in clients:
+        driver.close(client)
+    return {
+        "members": size,
+        "messages": messages,
+        "deliveries_expected": messages * (size - 1),
+        "deliveries": delivered,
+        "send": percentiles(send_times),
+        "delivery": percentiles(latencies)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Group message delivery latency at several group sizes")
+    parser.add_argument("--mode", choices=("inprocess", "server"), default="inprocess")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--sizes", default="10,100,500")
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    driver = InProcessDriver() if args.mode == "inprocess" else ServerDriver(args.url)
+    suffix = uuid.uuid4().hex[:6]
+    results = []
+    print(f"{'members':>8} {'delivered':>10} {'send p50 ms':>12} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for size in [int(s) for s in args.sizes.split(',')]:
+        result = run_group(driver, size, args.messages, suffix)
+        results.append(result)
+        delivery = result["delivery"] or {}
+        print(f"{size:>8} {result['deliveries']:>5}/{result['deliveries_expected']:<4} {result['send']['p50_ms']:>12.2f} "
+              f"{delivery.get('p50_ms', 0):>8.2f} {delivery.get('p95_ms', 0):>8.2f} {delivery.get('p99_ms', 0):>8.2f} {delivery.get('max_ms', 0):>8.2f}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import argparse
+import statistics
+import time
+from database import get_connection, get_messages, get_messages_page, HISTORY_PAGE_SIZE
+
+BENCH_CHAT_ID = "bench:history"
+
+def seed_messages(count):
+    connection = get_connection()
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM messages WHERE chat_id = %s", (BENCH_CHAT_ID,))
+    sql = "INSERT INTO messages (sender, receiver, ciphertext, iv, chat_id) VALUES (%s, %s, %s, %s, %s)"
+    rows = [("1", "2", "x" * 64, "y" * 16, BENCH_CHAT_ID) for _ in range(count)]
+    for start in range(0, count, 5000):
+        cursor.executemany(sql, rows[start:start + 5000])
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+def cleanup():
+    connection = get_connection()
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM messages WHERE chat_id = %s", (BENCH_CHAT_ID,))
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+def time_call(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare first-page history latency against full history reads")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma separated chat sizes")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=HISTORY_PAGE_SIZE)
+    args = parser.parse_args()
+
+    print(f"{'messages':>10} {'first page ms':>14} {'deep page ms':>13} {'full fetch ms':>14}")
+    try:
+        for size in [int(s) for s in args.sizes.split(',')]:
+            seed_messages(size)
+            _, cursor = get_messages_page(BENCH_CHAT_ID, None, args.limit)
+            first_page = time_call(lambda: get_messages_page(BENCH_CHAT_ID, None, args.limit), args.repeat)
+            deep_page = time_call(lambda: get_messages_page(BENCH_CHAT_ID, cursor, args.limit), args.repeat)
+            full_fetch = time_call(lambda: get_messages(BENCH_CHAT_ID), max(1, args.repeat // 10))
+            print(f"{size:>10} {first_page:>14.2f} {deep_page:>13.2f} {full_fetch:>14.2f}")
+    finally:
+        cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import argparse
+import base64
+import contextlib
+import os
+import time
+import structured_log
+from structured_log import LogPipeline, get_logger, fields
+
+def old_print(chat_id, data):
+    # what handle_send_message used to do for every message
+    print(chat_id)
+    print(data)
+
+def run(label, fn, data, count, pipeline=None):
+    start = time.perf_counter()
+    for i in range(count):
+        fn(i, data)
+    caller = time.perf_counter() - start
+    if pipeline is not None:
+        pipeline.stop()
+    total = time.perf_counter() - start
+    stats = pipeline.stats() if pipeline is not None else {}
+    print(f"{label:>22} {caller / count * 1e6:>10.2f} {total / count * 1e6:>10.2f} {stats.get('suppressed', 0):>11} {stats.get('dropped', 0):>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Per message cost on the calling thread of the old print() calls against the queued JSON logger")
+    parser.add_argument("--count", type=int, default=50000)
+    parser.add_argument("--size", type=int, default=1024, help="plaintext bytes per message")
+    parser.add_argument("--sink", default=os.devnull, help="file both print() and the log writer go to")
+    args = parser.parse_args()
+
+    data = {
+        'chat_id': '1:2',
+        'sender': 1,
+        'receiver': 2,
+        'ciphertext': base64.b64encode(os.urandom(args.size + 16)).decode('ascii'),
+        'iv': base64.b64encode(os.urandom(12)).decode('ascii')
+    }
+    logger = get_logger('bench_send_message')
+    structured_log.pipeline.stop()
+
+    def info(i, data):
+        logger.info("Message sent", extra=fields(chat_id=data['chat_id'], message_id=i, size=len(data['ciphertext'])))
+
+    def debug(i, data):
+        logger.debug("Message sent", extra=fields(chat_id=data['chat_id'], message_id=i, size=len(data['ciphertext'])))
+
+    print(f"{'mode':>22} {'caller us':>10} {'total us':>10} {'suppressed':>11} {'dropped':>8}")
+    with open(args.sink, 'w') as sink:
+        with contextlib.redirect_stdout(sink):
+            start = time.perf_counter()
+            for i in range(args.count):
+                old_print(data['chat_id'], data)
+            elapsed = (time.perf_counter() - start) / args.count * 1e6
+        print(f"{'print payload':>22} {elapsed:>10.2f} {elapsed:>10.2f} {0:>11} {0:>8}")
+        # queue sized to hold the whole run so nothing is dropped and total includes writing every line
+        run("queued json", info, data, args.count, LogPipeline(sink, max_queue=args.count, rate=0).start())
+        run("queued json, limited", info, data, args.count, LogPipeline(sink, max_queue=args.count).start())
+        run("queued json, sampled", info, data, args.count, LogPipeline(sink, max_queue=args.count, rate=0, sample={'bench_send_message': 0.01}).start())
+        run("below level", debug, data, args.count, LogPipeline(sink, max_queue=args.count).start())
+
+if __name__ == "__main__":
+    main()
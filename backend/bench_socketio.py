@@ -0,0 +1,273 @@
+import argparse
+import json
+import os
+import queue
+import random
+import subprocess
+import sys
+import time
+import urllib.request
+import uuid
+from collections import defaultdict
+
+def percentiles(samples):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    def pick(p):
+        return samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+    return {"count": len(samples), "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": samples[-1] * 1000}
+
+class TimedQueue(list):
+    """Test client packet queue that stamps each packet when the server hands it over"""
+
+    def append(self, item):
+        item['received_at'] = time.perf_counter()
+        super().append(item)
+
+class InProcessDriver:
+    """
+    Drives main.py through the Flask-SocketIO test client; every emit runs its handler synchronously
+    """
+
+    def __init__(self):
+        os.environ.setdefault('VSC_STORAGE', 'memory')
+        os.environ.setdefault('BCRYPT_ROUNDS', '4')
+        # a handful of simulated users sends far faster than any real client
+        os.environ.setdefault('EVENT_RATE', '0')
+        os.environ.setdefault('AUTH_IP_ATTEMPTS', '1000000')
+        self.query_counts = defaultdict(int)
+        self.current_event = None
+        self._count_queries()
+        import main
+        self.main = main
+
+    def _count_queries(self):
+        # storage is wrapped before main imports from it, so the callbacks main hands to its
+        # caches and queues are counted too; only one driver per process sees main's calls
+        import storage
+        def counted(fn):
+            def wrapper(*args, **kwargs):
+                self.query_counts[self.current_event] += 1
+                return fn(*args, **kwargs)
+            return wrapper
+        for name in storage.QUERIES:
+            setattr(storage, name, counted(getattr(storage, name)))
+
+    def signup(self, username):
+        http = self.main.app.test_client()
+        http.post('/api/signup', json={'username': username, 'password': 'bench-password'})
+        user_id = http.get('/api/authenticate').json['data']['User_id']
+        client = self.main.socketio.test_client(self.main.app, flask_test_client=http)
+        client.queue = TimedQueue(client.queue)
+        return client, user_id
+
+    def emit(self, client, event, data=None):
+        self.current_event = event
+        if data is None:
+            client.emit(event)
+        else:
+            client.emit(event, data)
+        self.current_event = None
+
+    def received(self, client, timeout=0):
+        now = time.perf_counter()
+        messages = client.get_received()
+        # get_received swaps in a plain list
+        client.queue = TimedQueue(client.queue)
+        return [(m['name'], m['args'][0] if m['args'] else None, m.get('received_at', now)) for m in messages]
+
+    def close(self, client):
+        client.disconnect()
+
+class ServerDriver:
+    """
+    Drives a running server with real python-socketio clients
+    """
+
+    def __init__(self, url):
+        import socketio
+        self.socketio = socketio
+        self.url = url
+        self.query_counts = None
+
+    def signup(self, username):
+        request = urllib.request.Request(f"{self.url}/api/signup", data=json.dumps({'username': username, 'password': 'bench-password'}).encode('utf-8'), headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request) as resp:
+            session_id = json.loads(resp.read())['session_id']
+        request = urllib.request.Request(f"{self.url}/api/authenticate", headers={'Cookie': f"session_id={session_id}"})
+        with urllib.request.urlopen(request) as resp:
+            user_id = json.loads(resp.read())['data']['User_id']
+        client = self.socketio.Client(reconnection=False, websocket_extra_options={'suppress_origin': True})
+        client.inbox = queue.Queue()
+        client.on('*', lambda event, data=None: client.inbox.put((event, data, time.perf_counter())))
+        client.connect(self.url, headers={'Cookie': f"session_id={session_id}"}, transports=['websocket'])
+        return client, user_id
+
+    def emit(self, client, event, data=None):
+        if data is None:
+            client.emit(event)
+        else:
+            client.emit(event, data)
+
+    def received(self, client, timeout=0):
+        messages = []
+        try:
+            messages.append(client.inbox.get(timeout=timeout) if timeout else client.inbox.get_nowait())
+            while True:
+                messages.append(client.inbox.get_nowait())
+        except queue.Empty:
+            pass
+        return messages
+
+    def close(self, client):
+        client.disconnect()
+
+def wait_for_event(driver, client, event, timeout=5.0, match=None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for name, data, received_at in driver.received(client, timeout=0.05):
+            if name == event and (match is None or match(data)):
+                return data, received_at
+    return None, None
+
+def run(driver, args):
+    rng = random.Random(args.seed)
+    latencies = defaultdict(list)
+    suffix = uuid.uuid4().hex[:6]
+    from common import generate_chatid
+
+    users = []
+    for i in range(args.users):
+        start = time.perf_counter()
+        client, user_id = driver.signup(f"b{suffix}{i}")
+        latencies["signup_connect"].append(time.perf_counter() - start)
+        users.append((client, user_id))
+        driver.received(client)
+
+    pairs = set()
+    while len(pairs) < min(args.chats, args.users * (args.users - 1) // 2):
+        a, b = rng.sample(range(args.users), 2)
+        pairs.add((min(a, b), max(a, b)))
+
+    chats = []
+    for a, b in sorted(pairs):
+        (client_a, id_a), (client_b, id_b) = users[a], users[b]
+        chat_id = generate_chatid(id_a, id_b)
+        start = time.perf_counter()
+        driver.emit(client_a, 'key_exchange_request', {'reciever_id': id_b, 'chat_id': chat_id, 'public_key': 'bench-key-a'})
+        _, received_at = wait_for_event(driver, client_b, 'new_key_exchange_request', match=lambda d: d['chat_id'] == chat_id)
+        if received_at:
+            latencies["key_exchange_request"].append(received_at - start)
+        start = time.perf_counter()
+        driver.emit(client_b, 'key_exchange_success', {'chat_id': chat_id, 'public_key': 'bench-key-b'})
+        _, received_at = wait_for_event(driver, client_a, 'key_exchange_success', match=lambda d: d['chat_id'] == chat_id)
+        if received_at:
+            latencies["key_exchange_success"].append(received_at - start)
+        for client in (client_a, client_b):
+            start = time.perf_counter()
+            driver.emit(client, 'connect_chat', {'chat_id': chat_id})
+            _, received_at = wait_for_event(driver, client, 'message_history')
+            if received_at:
+                latencies["connect_chat"].append(received_at - start)
+        chats.append((client_a, id_a, client_b, id_b, chat_id))
+    for client, _ in users:
+        driver.received(client)
+
+    interval = 1.0 / args.rate if args.rate > 0 else 0
+    sent = delivered = 0
+    pending = {}
+    start_load = time.perf_counter()
+    next_send = start_load
+    while time.perf_counter() - start_load < args.duration:
+        client_a, id_a, client_b, id_b, chat_id = rng.choice(chats)
+        if rng.random() < 0.5:
+            client_a, id_a, client_b, id_b = client_b, id_b, client_a, id_a
+        # hex is valid base64 of a whole number of bytes, so it comes back unchanged
+        token = f"{sent:08x}{uuid.uuid4().hex[:8]}"
+        sent_at = time.perf_counter()
+        pending[token] = sent_at
+        driver.emit(client_a, 'send_message', {'chat_id': chat_id, 'sender': id_a, 'receiver': id_b, 'ciphertext': token, 'iv': 'YmVuY2gtaXYtMTIz'})
+        sent += 1
+        for name, data, received_at in driver.received(client_b):
+            if name == 'new_message' and data['ciphertext'] in pending:
+                latencies["send_message_delivery"].append(received_at - pending.pop(data['ciphertext']))
+                delivered += 1
+        if interval:
+            next_send += interval
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    drain_deadline = time.monotonic() + 5
+    while pending and time.monotonic() < drain_deadline:
+        for client, _ in users:
+            for name, data, received_at in driver.received(client, timeout=0.01):
+                if name == 'new_message' and data['ciphertext'] in pending:
+                    latencies["send_message_delivery"].append(received_at - pending.pop(data['ciphertext']))
+                    delivered += 1
+    elapsed = time.perf_counter() - start_load
+
+    for client, _ in users:
+        driver.close(client)
+
+    events = {name: percentiles(samples) for name, samples in latencies.items()}
+    queries_per_event = None
+    if driver.query_counts is not None:
+        counts = {"send_message": sent, "key_exchange_request": len(chats), "key_exchange_success": len(chats), "connect_chat": 2 * len(chats)}
+        queries_per_event = {event: driver.query_counts.get(event, 0) / count for event, count in counts.items() if count}
+    return {
+        "messages_sent": sent,
+        "messages_delivered": delivered,
+        "throughput_msgs_per_s": delivered / elapsed if elapsed else 0,
+        "latency": events,
+        "db_queries_per_event": queries_per_event
+    }
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(baseline, current):
+    print(f"{'event':>24} {'p50 before':>11} {'p50 after':>10} {'p99 before':>11} {'p99 after':>10}")
+    for event, after in current["results"]["latency"].items():
+        before = baseline["results"]["latency"].get(event)
+        if not before or not after:
+            continue
+        print(f"{event:>24} {before['p50_ms']:>11.3f} {after['p50_ms']:>10.3f} {before['p99_ms']:>11.3f} {after['p99_ms']:>10.3f}")
+    print(f"{'throughput msg/s':>24} {baseline['results']['throughput_msgs_per_s']:>11.1f} {current['results']['throughput_msgs_per_s']:>10.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Socket.IO load generator for the signup -> key exchange -> chat -> message flow")
+    parser.add_argument("--mode", choices=("inprocess", "server"), default="inprocess")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="server URL for --mode server")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=200, help="messages per second across all chats, 0 for as fast as possible")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of message load")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None, help="write the JSON report to this file")
+    parser.add_argument("--compare", default=None, help="baseline JSON report to compare this run against")
+    args = parser.parse_args()
+
+    driver = InProcessDriver() if args.mode == "inprocess" else ServerDriver(args.url)
+    report = {
+        "revision": git_revision(),
+        "timestamp": time.time(),
+        "config": vars(args),
+        "results": run(driver, args)
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+import argparse
+import base64
+import os
+import time
+from socketio import packet, msgpack_packet
+from common import to_bytes, wire_message
+
+def encoded_size(encoded):
+    if isinstance(encoded, list):
+        return sum(len(part) for part in encoded)
+    return len(encoded)
+
+def decode(packet_class, encoded):
+    if isinstance(encoded, list):
+        pkt = packet_class(encoded_packet=encoded[0])
+        for attachment in encoded[1:]:
+            pkt.add_attachment(attachment)
+        return pkt.data
+    return packet_class(encoded_packet=encoded).data
+
+def json_path(ciphertext, iv):
+    # text clients: base64 in, raw bytes stored, base64 out again
+    message = {'sender': 1, 'receiver': 2, 'ciphertext': to_bytes(ciphertext), 'iv': to_bytes(iv), 'timestamp': time.time()}
+    return packet.Packet(packet.EVENT, data=['new_message', wire_message(message, False)]).encode()
+
+def binary_path(ciphertext, iv):
+    message = {'sender': 1, 'receiver': 2, 'ciphertext': ciphertext, 'iv': iv, 'timestamp': time.time()}
+    return packet.Packet(packet.EVENT, data=['new_message', message]).encode()
+
+def msgpack_path(ciphertext, iv):
+    message = {'sender': 1, 'receiver': 2, 'ciphertext': ciphertext, 'iv': iv, 'timestamp': time.time()}
+    return msgpack_packet.MsgPackPacket(packet.EVENT, data=['new_message', message]).encode()
+
+def measure(fn, args, packet_class, repeat):
+    encoded = fn(*args)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        decode(packet_class, fn(*args))
+    return encoded_size(encoded), (time.perf_counter() - start) / repeat * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes on the wire and server CPU per new_message for the JSON, binary attachment and msgpack formats")
+    parser.add_argument("--sizes", default="64,256,1024,4096,16384", help="comma separated plaintext sizes in bytes")
+    parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'plaintext':>10} {'json B':>8} {'binary B':>9} {'msgpack B':>10} {'json us':>8} {'binary us':>10} {'msgpack us':>11}")
+    for size in [int(s) for s in args.sizes.split(',')]:
+        # AES-GCM adds a 16 byte tag; the IV is 12 bytes
+        ciphertext, iv = os.urandom(size + 16), os.urandom(12)
+        text_args = (base64.b64encode(ciphertext).decode('ascii'), base64.b64encode(iv).decode('ascii'))
+        json_bytes, json_us = measure(json_path, text_args, packet.Packet, args.repeat)
+        binary_bytes, binary_us = measure(binary_path, (ciphertext, iv), packet.Packet, args.repeat)
+        msgpack_bytes, msgpack_us = measure(msgpack_path, (ciphertext, iv), msgpack_packet.MsgPackPacket, args.repeat)
+        print(f"{size:>10} {json_bytes:>8} {binary_bytes:>9} {msgpack_bytes:>10} {json_us:>8.2f} {binary_us:>10.2f} {msgpack_us:>11.2f}")
+
+if __name__ == "__main__":
+    main()
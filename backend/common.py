@@ -0,0 +1,62 @@
+import base64
+import time
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+GROUP_PREFIX = "g:"
+
+def generate_chatid(userid1, userid2):
+    user_pair = tuple(sorted([userid1, userid2]))
+    return f"{user_pair[0]}:{user_pair[1]}"
+
+def decode_chatid(chatid):
+    userid1, userid2 = tuple(chatid.split(':'))
+    return int(userid1), int(userid2)
+
+def group_chatid(group_id):
+    return f"{GROUP_PREFIX}{int(group_id)}"
+
+def is_group_chatid(chatid):
+    return isinstance(chatid, str) and chatid.startswith(GROUP_PREFIX)
+
+def decode_group_chatid(chatid):
+    return int(chatid[len(GROUP_PREFIX):])
+
+def message_chatid(message_data):
+    """Group messages carry their chat id; direct ones are addressed by the sender and receiver pair"""
+    return message_data.get('chat_id') or generate_chatid(message_data.get('sender'), message_data.get('receiver'))
+
+def message_row(message_data):
+    return (
+        message_data.get('sender'),
+        message_data.get('receiver'),
+        message_data.get('ciphertext'),
+        message_data.get('iv'),
+        message_chatid(message_data),
+        message_data.get('timestamp') or time.time()
+    )
+
+def unread_increments(rows):
+    """(receiver, chat_id, count) for a batch of message_row tuples; group messages have no receiver and are counted on read"""
+    counts = {}
+    for row in rows:
+        if row[1] is None:
+            continue
+        key = (row[1], row[4])
+        counts[key] = counts.get(key, 0) + 1
+    return [(receiver, chat_id, count) for (receiver, chat_id), count in counts.items()]
+
+def format_message(m):
+    return {"id": m[0], "sender": m[1], "receiver": m[2], "ciphertext": bytes(m[3]), "iv": bytes(m[4]), "chat_id": m[5], "timestamp": m[6].timestamp()}
+
+def to_bytes(value):
+    """ciphertext and iv arrive as base64 text from JSON clients and as raw bytes from binary ones"""
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    return base64.b64decode(value, validate=True)
+
+def wire_message(message, binary):
+    """Stored messages carry raw bytes; JSON clients get them back as base64 text"""
+    if binary:
+        return message
+    return {**message, "ciphertext": base64.b64encode(message["ciphertext"]).decode("ascii"), "iv": base64.b64encode(message["iv"]).decode("ascii")}
@@ -0,0 +1,232 @@
+import threading
+import time
+from collections import deque
+import mysql.connector
+from mysql.connector import errors
+from metrics import POOL_CHECKOUT_WAIT, POOL_IN_USE
+
+class PoolTimeout(errors.PoolError):
+    pass
+
+class PooledConnection:
+    """
+    Checked-out connection; close() hands it back to the manager instead of closing the socket
+    """
+
+    def __init__(self, manager, connection, created_at):
+        self._manager = manager
+        self._connection = connection
+        self._created_at = created_at
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def is_connected(self):
+        # the query functions only call close() when this is true, so report the
+        # checkout itself; the manager drops the connection on release if it died
+        return not self._released
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._manager.release(self._connection, self._created_at)
+
+class ConnectionManager:
+    """
+    Bounded MySQL connection pool that waits for a free connection instead of failing.
+
+    Connections are opened on demand between min_size and max_size, pinged before
+    reuse once they have been idle for validate_after seconds and closed once they
+    are older than max_age seconds. Connections idle for idle_timeout seconds are
+    closed until the pool is back down to min_size.
+    """
+
+    def __init__(self, connect_args, min_size=2, max_size=10, wait_timeout=5.0, max_age=1800.0, validate_after=30.0, idle_timeout=300.0):
+        self.connect_args = connect_args
+        self.min_size = min_size
+        self.max_size = max_size
+        self.wait_timeout = wait_timeout
+        self.max_age = max_age
+        self.validate_after = validate_after
+        self.idle_timeout = idle_timeout
+        self.idle = deque()
+        self.size = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.condition = threading.Condition()
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.created = 0
+        self.recycled = 0
+        self.invalid = 0
+        self.trimmed = 0
+        self.recent_checkouts = deque()
+
+    def fill(self):
+        """Opens connections until min_size are open"""
+        while True:
+            with self.condition:
+                if self.size >= self.min_size:
+                    return
+                self.size += 1
+            try:
+                connection = self._connect()
+            except mysql.connector.Error:
+                with self.condition:
+                    self.size -= 1
+                raise
+            with self.condition:
+                self.idle.append((connection, time.monotonic(), time.monotonic()))
+                self.condition.notify()
+
+    def _connect(self):
+        connection = mysql.connector.connect(**self.connect_args)
+        with self.condition:
+            self.created += 1
+        return connection
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except mysql.connector.Error:
+            pass
+
+    def _trim(self, now):
+        """Takes connections idle for idle_timeout out of the pool down to min_size; call with the condition held"""
+        trimmed = []
+        # released connections are appended, so the longest idle is on the left
+        while self.idle and self.size > self.min_size and now - self.idle[0][2] > self.idle_timeout:
+            trimmed.append(self.idle.popleft()[0])
+            self.size -= 1
+        self.trimmed += len(trimmed)
+        return trimmed
+
+    def _usable(self, connection, created_at, last_used, now):
+        if now - created_at > self.max_age:
+            with self.condition:
+                self.recycled += 1
+            return False
+        if now - last_used > self.validate_after:
+            try:
+                connection.ping(reconnect=False)
+            except mysql.connector.Error:
+                with self.condition:
+                    self.invalid += 1
+                return False
+        return True
+
+    def get_connection(self, timeout=None):
+        timeout = self.wait_timeout if timeout is None else timeout
+        start = time.perf_counter()
+        deadline = time.monotonic() + timeout
+        waited = False
+        while True:
+            with self.condition:
+                while not self.idle and self.size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(f"No connection available within {timeout}s ({self.size} open, {self.in_use} in use)")
+                    waited = True
+                    self.waiting += 1
+                    try:
+                        self.condition.wait(remaining)
+                    finally:
+                        self.waiting -= 1
+                if self.idle:
+                    connection, created_at, last_used = self.idle.pop()
+                else:
+                    connection = None
+                    self.size += 1
+            if connection is None:
+                try:
+                    connection = self._connect()
+                except mysql.connector.Error:
+                    with self.condition:
+                        self.size -= 1
+                        self.condition.notify()
+                    raise
+                created_at = time.monotonic()
+            elif not self._usable(connection, created_at, last_used, time.monotonic()):
+                self._discard(connection)
+                with self.condition:
+                    self.size -= 1
+                    self.condition.notify()
+                continue
+            return self._checked_out(connection, created_at, start, waited)
+
+    def _checked_out(self, connection, created_at, start, waited):
+        elapsed = time.perf_counter() - start
+        now = time.monotonic()
+        with self.condition:
+            self.in_use += 1
+            self.checkouts += 1
+            self.recent_checkouts.append(now)
+            while self.recent_checkouts[0] < now - 10:
+                self.recent_checkouts.popleft()
+            if waited:
+                self.waits += 1
+                self.wait_time += elapsed
+        POOL_CHECKOUT_WAIT.observe(value=elapsed)
+        POOL_IN_USE.inc()
+        return PooledConnection(self, connection, created_at)
+
+    def release(self, connection, created_at):
+        POOL_IN_USE.dec()
+        expired = time.monotonic() - created_at > self.max_age
+        broken = False
+        if not expired:
+            try:
+                if connection.unread_result:
+                    connection.consume_results()
+                if connection.in_transaction:
+                    connection.rollback()
+            except mysql.connector.Error:
+                broken = True
+        keep = not (expired or broken)
+        if not keep:
+            self._discard(connection)
+        with self.condition:
+            self.in_use -= 1
+            self.recycled += expired
+            self.invalid += broken
+            if keep:
+                self.idle.append((connection, created_at, time.monotonic()))
+            else:
+                self.size -= 1
+            self.condition.notify()
+            trimmed = self._trim(time.monotonic())
+        for connection in trimmed:
+            self._discard(connection)
+
+    def close(self):
+        with self.condition:
+            idle, self.idle = list(self.idle), deque()
+            self.size -= len(idle)
+        for connection, _, _ in idle:
+            self._discard(connection)
+
+    def stats(self):
+        now = time.monotonic()
+        with self.condition:
+            recent = sum(1 for t in self.recent_checkouts if t >= now - 10)
+            return {
+                "pool_min": self.min_size,
+                "pool_max": self.max_size,
+                "pool_size": self.size,
+                "pool_idle": len(self.idle),
+                "pool_in_use": self.in_use,
+                "pool_waiting": self.waiting,
+                "checkouts": self.checkouts,
+                "checkouts_per_second": recent / 10,
+                "waits": self.waits,
+                "wait_time_avg": self.wait_time / self.waits if self.waits else 0.0,
+                "timeouts": self.timeouts,
+                "created": self.created,
+                "recycled": self.recycled,
+                "invalid": self.invalid,
+                "trimmed": self.trimmed
+            }
@@ -2,9 +2,16 @@ from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import ec
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from collections import OrderedDict
 import os
 import base64
-from typing import Tuple
+import io
+from typing import Iterable, List, Tuple, Union
+
+NONCE_SIZE = 12
+TAG_SIZE = 16
+PeerKey = Union[ec.EllipticCurvePublicKey, str, bytes]
 
 class ECDHEKeyExchange:
     
@@ -120,4 +127,292 @@ class ECDHEKeyExchange:
         
         plaintext = decryptor.update(ciphertext) + decryptor.finalize()
         
-        return plaintext.decode('utf-8')
\ No newline at end of file
+        return plaintext.decode('utf-8')
+
+class CryptoSession:
+    """
+    Per-peer AES-GCM contexts on top of an ECDHEKeyExchange.
+
+    The derived key and its AESGCM context are cached per peer public key (LRU, at most
+    max_peers), so ECDH and HKDF run once per peer instead of once per message. Text mode
+    produces and accepts the same {'ciphertext', 'nonce', 'tag'} dicts as encrypt_message;
+    raw mode uses nonce || ciphertext || tag bytes and skips base64 entirely.
+    """
+
+    def __init__(self, key_exchange: ECDHEKeyExchange, max_peers: int = 1024, key_length: int = 32):
+        self.key_exchange = key_exchange
+        self.max_peers = max_peers
+        self.key_length = key_length
+        self.peers = OrderedDict()
+        self.derivations = 0
+        # key objects are unhashable and serialising one costs more than a message, so the
+        # last peer is also remembered by identity
+        self.last_peer = None
+        self.last_aead = None
+
+    def _peer_id(self, peer: PeerKey) -> bytes:
+        if isinstance(peer, str):
+            return peer.encode('utf-8')
+        if isinstance(peer, (bytes, bytearray)):
+            return bytes(peer)
+        return peer.public_bytes(serialization.Encoding.X962, serialization.PublicFormat.CompressedPoint)
+
+    def _load_peer(self, peer: PeerKey) -> ec.EllipticCurvePublicKey:
+        if isinstance(peer, str):
+            return self.key_exchange.load_public_key_from_pem(peer)
+        if isinstance(peer, (bytes, bytearray)):
+            return self.key_exchange.load_public_key_from_bytes(bytes(peer))
+        return peer
+
+    def aead(self, peer: PeerKey) -> AESGCM:
+        """AES-GCM context for a peer given as a key object, PEM string or X9.62 bytes"""
+        if peer is self.last_peer:
+            return self.last_aead
+        peer_id = self._peer_id(peer)
+        aead = self.peers.get(peer_id)
+        if aead is not None:
+            self.peers.move_to_end(peer_id)
+            self.last_peer, self.last_aead = peer, aead
+            return aead
+        # the same peer may arrive as PEM one time and as point bytes the next
+        public_key = self._load_peer(peer)
+        aead = self.peers.get(self._peer_id(public_key))
+        if aead is None:
+            aead = AESGCM(self.key_exchange.compute_shared_secret(public_key, self.key_length))
+            self.peers[self._peer_id(public_key)] = aead
+            self.derivations += 1
+        self.peers[peer_id] = aead
+        while len(self.peers) > self.max_peers:
+            self.peers.popitem(last=False)
+        self.last_peer, self.last_aead = peer, aead
+        return aead
+
+    def forget(self, peer: PeerKey) -> None:
+        """Drop a peer's key, including entries cached under its other encodings"""
+        aead = self.peers.pop(self._peer_id(peer), None)
+        for peer_id in [peer_id for peer_id, cached in self.peers.items() if cached is aead]:
+            del self.peers[peer_id]
+        self.last_peer = self.last_aead = None
+
+    def encrypt(self, peer: PeerKey, message: Union[str, bytes], raw: bool = False) -> Union[dict, bytes]:
+        """Encrypt one message; see encrypt_many for the output formats"""
+        return bytes(self.encrypt_many(peer, [message], raw=raw)[0]) if raw else self.encrypt_many(peer, [message])[0]
+
+    def decrypt(self, peer: PeerKey, encrypted_data: Union[dict, bytes], raw: bool = False) -> Union[str, bytes]:
+        """Decrypt one message; raw returns bytes instead of text"""
+        result = self.decrypt_many(peer, [encrypted_data], raw=raw)[0]
+        return bytes(result) if raw else result
+
+    def encrypt_many(self, peer: PeerKey, messages: Iterable[Union[str, bytes]], raw: bool = False) -> list:
+        """
+        Encrypt a batch of messages for one peer
+
+        All nonces come from one urandom call and every ciphertext is written into a
+        single preallocated buffer.
+
+        Returns:
+            raw: memoryviews of nonce || ciphertext || tag, all views into one shared buffer
+            otherwise: dicts with base64 'ciphertext', 'nonce' and 'tag'
+        """
+        aead = self.aead(peer)
+        plaintexts = [m.encode('utf-8') if isinstance(m, str) else m for m in messages]
+        sizes = [NONCE_SIZE + len(plaintext) + TAG_SIZE for plaintext in plaintexts]
+        nonces = os.urandom(NONCE_SIZE * len(plaintexts))
+        buffer = bytearray(sum(sizes))
+        view = memoryview(buffer)
+        results = []
+        offset = 0
+        for i, plaintext in enumerate(plaintexts):
+            nonce = nonces[i * NONCE_SIZE:(i + 1) * NONCE_SIZE]
+            end = offset + sizes[i]
+            view[offset:offset + NONCE_SIZE] = nonce
+            _encrypt_into(aead, nonce, plaintext, view[offset + NONCE_SIZE:end])
+            record = view[offset:end]
+            if raw:
+                results.append(record)
+            else:
+                results.append({
+                    'ciphertext': base64.b64encode(record[NONCE_SIZE:-TAG_SIZE]).decode('utf-8'),
+                    'nonce': base64.b64encode(nonce).decode('utf-8'),
+                    'tag': base64.b64encode(record[-TAG_SIZE:]).decode('utf-8')
+                })
+            offset = end
+        return results
+
+    def decrypt_many(self, peer: PeerKey, encrypted: Iterable[Union[dict, bytes]], raw: bool = False) -> list:
+        """
+        Decrypt a batch of messages from one peer into a single preallocated buffer
+
+        Args:
+            encrypted: raw nonce || ciphertext || tag bytes, or dicts from encrypt_message
+            raw: return memoryviews of the plaintexts (views into one shared buffer) instead of str
+
+        Raises:
+            cryptography.exceptions.InvalidTag if any message fails authentication
+        """
+        aead = self.aead(peer)
+        records = [_split_record(item) for item in encrypted]
+        sizes = [len(sealed) - TAG_SIZE for _, sealed in records]
+        buffer = bytearray(sum(sizes))
+        view = memoryview(buffer)
+        results = []
+        offset = 0
+        for (nonce, sealed), size in zip(records, sizes):
+            plaintext = view[offset:offset + size]
+            _decrypt_into(aead, nonce, sealed, plaintext)
+            results.append(plaintext if raw else str(plaintext, 'utf-8'))
+            offset += size
+        return results
+
+def _split_record(item: Union[dict, bytes]) -> Tuple[bytes, bytes]:
+    """(nonce, ciphertext || tag) from either wire format"""
+    if isinstance(item, dict):
+        return base64.b64decode(item['nonce']), base64.b64decode(item['ciphertext']) + base64.b64decode(item['tag'])
+    view = memoryview(item)
+    return view[:NONCE_SIZE], view[NONCE_SIZE:]
+
+def _encrypt_into(aead: AESGCM, nonce: bytes, plaintext: bytes, out: memoryview) -> None:
+    if hasattr(aead, 'encrypt_into'):
+        aead.encrypt_into(nonce, plaintext, None, out)
+    else:
+        # cryptography < 44 has no _into variants; one extra copy per message
+        out[:] = aead.encrypt(nonce, plaintext, None)
+
+def _decrypt_into(aead: AESGCM, nonce: bytes, sealed: bytes, out: memoryview) -> None:
+    if hasattr(aead, 'decrypt_into'):
+        aead.decrypt_into(nonce, sealed, None, out)
+    else:
+        out[:] = aead.decrypt(bytes(nonce), bytes(sealed), None)
+
+ATTACHMENT_CHUNK_SIZE = 64 * 1024
+
+class AttachmentCipher:
+    """
+    Streaming AES-GCM for attachments, one fixed-size chunk at a time.
+
+    Chunk i is sealed with nonce = prefix (7 random bytes) || i (4 bytes) || last (1 byte),
+    so chunks cannot be reordered, dropped or have the stream cut short without failing
+    authentication. Every sealed chunk except the last is exactly chunk_size + 16 bytes,
+    which lets the server place resumed uploads by index alone. The key and prefix travel
+    to the recipient inside the (end-to-end encrypted) message that references the file.
+    """
+
+    def __init__(self, key: bytes = None, prefix: bytes = None, chunk_size: int = ATTACHMENT_CHUNK_SIZE):
+        self.key = key or AESGCM.generate_key(bit_length=256)
+        self.prefix = prefix or os.urandom(7)
+        if len(self.prefix) != 7:
+            raise ValueError("Nonce prefix must be 7 bytes")
+        self.chunk_size = chunk_size
+        self.aead = AESGCM(self.key)
+
+    @property
+    def sealed_chunk_size(self) -> int:
+        return self.chunk_size + TAG_SIZE
+
+    def sealed_size(self, plaintext_size: int) -> int:
+        """Ciphertext size for a plaintext of this size; an empty file is still one chunk"""
+        chunks = max(1, -(-plaintext_size // self.chunk_size))
+        return plaintext_size + chunks * TAG_SIZE
+
+    def _nonce(self, index: int, last: bool) -> bytes:
+        if index >= 2 ** 32:
+            raise ValueError("Attachment has too many chunks")
+        return self.prefix + index.to_bytes(4, 'big') + (b'\x01' if last else b'\x00')
+
+    def encrypt_chunk(self, index: int, plaintext: bytes, last: bool) -> bytes:
+        return self.aead.encrypt(self._nonce(index, last), plaintext, None)
+
+    def decrypt_chunk(self, index: int, sealed: bytes, last: bool) -> bytes:
+        """Raises cryptography.exceptions.InvalidTag for a chunk that is out of place or altered"""
+        return self.aead.decrypt(self._nonce(index, last), sealed, None)
+
+    def encrypt_stream(self, readable) -> Iterable[Tuple[int, bytes]]:
+        """Yield (index, sealed chunk) pairs from a binary file object, reading one chunk ahead"""
+        current = readable.read(self.chunk_size)
+        index = 0
+        while True:
+            following = readable.read(self.chunk_size)
+            yield index, self.encrypt_chunk(index, current, not following)
+            if not following:
+                return
+            current = following
+            index += 1
+
+    def decrypt_stream(self, chunks: Iterable[bytes]) -> Iterable[bytes]:
+        """Yield plaintext chunks from sealed chunks in order; fails if the stream is truncated"""
+        index = 0
+        pending = None
+        for sealed in chunks:
+            if pending is not None:
+                yield self.decrypt_chunk(index, pending, False)
+                index += 1
+            pending = sealed
+        if pending is None:
+            raise ValueError("Attachment stream is empty")
+        yield self.decrypt_chunk(index, pending, True)
+
+    def encrypted_chunks(self, data: bytes) -> List[bytes]:
+        """Sealed chunks for an in-memory plaintext"""
+        return [sealed for _, sealed in self.encrypt_stream(io.BytesIO(data))]
+
+    def reference(self) -> dict:
+        """What the sender puts inside the encrypted message next to the attachment id"""
+        return {
+            'key': base64.b64encode(self.key).decode('utf-8'),
+            'prefix': base64.b64encode(self.prefix).decode('utf-8'),
+            'chunk_size': self.chunk_size
+        }
+
+    @classmethod
+    def from_reference(cls, reference: dict) -> 'AttachmentCipher':
+        return cls(base64.b64decode(reference['key']), base64.b64decode(reference['prefix']), reference['chunk_size'])
+
+class GroupSession:
+    """
+    Sender-key encryption for group chats: each member encrypts a message once under their
+    own sender key, and hands that key to every other member sealed with the pairwise key
+    from their accepted key exchange (via a CryptoSession).
+
+    The wire iv is key_id (4 bytes) || nonce (12 bytes), so receivers know which of a
+    sender's keys to use and the server stores nothing beyond ciphertext and iv.
+    """
+
+    def __init__(self, crypto_session: CryptoSession):
+        self.crypto_session = crypto_session
+        self.key_id = 0
+        self.sender_key = None
+        self.received = {}
+        self.rotate()
+
+    def rotate(self) -> int:
+        """New sender key, e.g. after a member leaves; distribute it again before sending"""
+        self.key_id += 1
+        self.sender_key = AESGCM.generate_key(bit_length=256)
+        self.aead = AESGCM(self.sender_key)
+        return self.key_id
+
+    def distribution(self, members: dict) -> List[dict]:
+        """Envelopes for the group_sender_key event; members maps user id -> their public key"""
+        envelopes = []
+        for recipient_id, public_key in members.items():
+            sealed = self.crypto_session.encrypt(public_key, self.key_id.to_bytes(4, 'big') + self.sender_key, raw=True)
+            envelopes.append({'recipient_id': recipient_id, 'ciphertext': sealed[NONCE_SIZE:], 'iv': sealed[:NONCE_SIZE]})
+        return envelopes
+
+    def add_sender_key(self, sender_id: int, sender_public_key: PeerKey, ciphertext: bytes, iv: bytes) -> int:
+        """Opens an envelope from group_sender_keys and remembers the sender's key; returns its key id"""
+        opened = self.crypto_session.decrypt(sender_public_key, bytes(iv) + bytes(ciphertext), raw=True)
+        key_id = int.from_bytes(opened[:4], 'big')
+        self.received[(sender_id, key_id)] = AESGCM(opened[4:])
+        return key_id
+
+    def encrypt(self, message: Union[str, bytes]) -> Tuple[bytes, bytes]:
+        """(ciphertext, iv) for send_message, the same for every member"""
+        plaintext = message.encode('utf-8') if isinstance(message, str) else message
+        nonce = os.urandom(NONCE_SIZE)
+        return self.aead.encrypt(nonce, plaintext, None), self.key_id.to_bytes(4, 'big') + nonce
+
+    def decrypt(self, sender_id: int, ciphertext: bytes, iv: bytes) -> bytes:
+        """Raises KeyError when the sender's key has not been received yet"""
+        key_id = int.from_bytes(iv[:4], 'big')
+        return self.received[(sender_id, key_id)].decrypt(bytes(iv[4:]), bytes(ciphertext), None)
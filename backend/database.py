@@ -1,41 +1,201 @@
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
 import mysql.connector
-from mysql.connector import pooling
-import time
+from migrations import migrate
+from connection_manager import ConnectionManager
+from archive import Archive
+from structured_log import get_logger, fields
+from metrics import DB_CALLS_PER_EVENT, DB_CHECKOUTS_PER_EVENT
+from common import generate_chatid, decode_chatid, message_row, unread_increments, HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE
 
+logger = get_logger('database')
 
+DB_CONFIG = {
+    "host": "localhost",
+    "user": "admin",
+    "password": "root",
+    "database": "chat_db"
+}
+
+connection_manager = ConnectionManager(
+    DB_CONFIG,
+    min_size=int(os.getenv('DB_POOL_MIN', 2)),
+    max_size=int(os.getenv('DB_POOL_MAX', 10)),
+    wait_timeout=float(os.getenv('DB_POOL_WAIT_TIMEOUT', 5)),
+    max_age=float(os.getenv('DB_POOL_MAX_AGE', 1800)),
+    validate_after=float(os.getenv('DB_POOL_VALIDATE_AFTER', 30)),
+    idle_timeout=float(os.getenv('DB_POOL_IDLE_TIMEOUT', 300))
+)
 try:
-    connection_pool = pooling.MySQLConnectionPool(
-        pool_name="chat_pool",
-        pool_size=10,
-        pool_reset_session=True,
-        host="localhost",
-        user="admin",
-        password="root",
-        database="chat_db"
-    )
-    print("Connection pool created successfully")
+    connection_manager.fill()
+    logger.info("Connection pool created successfully")
 except mysql.connector.Error as e:
-    print(f"Error creating connection pool: {e}")
-    connection_pool = None
+    logger.error("Error creating connection pool", extra=fields(error=str(e)))
 
-def get_connection():
-    if connection_pool is None:
+# cold history moved out of the messages table by archive.py, read back when the hot rows run out
+archive = Archive(os.getenv('ARCHIVE_DIR')) if os.getenv('ARCHIVE_DIR') else None
+
+current = threading.local()
+prepared_statements = weakref.WeakKeyDictionary()
+# server-side statements kept open per connection; queries whose text varies with their arguments would otherwise pile up
+PREPARED_STATEMENTS = int(os.getenv('DB_PREPARED_STATEMENTS', 64))
+
+class StatementCursor:
+    """
+    Cursor facade that runs each SQL string on a prepared cursor cached per connection
+    """
+
+    def __init__(self, unit):
+        self.unit = unit
+        self.cursor = None
+        self.plain = None
+
+    def execute(self, sql, params=()):
+        self.cursor = self.unit.statement(sql)
+        self.cursor.execute(sql, params)
+
+    def executemany(self, sql, rows):
+        # a plain cursor rewrites batched INSERTs into one multi-row statement
+        if self.plain is None:
+            self.plain = self.unit.connection.cursor()
+        self.cursor = self.plain
+        self.cursor.executemany(sql, rows)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def close(self):
+        if self.cursor is not None and self.unit.connection.unread_result:
+            self.cursor.fetchall()
+        if self.plain is not None:
+            self.plain.close()
+            self.plain = None
+        self.cursor = None
+
+class UnitOfWork:
+    """
+    One pooled connection shared by every query in a socket event, committed once at the end
+
+    Side effects that must only be seen once the writes are durable (emits, caches, queues)
+    are registered with after_commit and run after the commit, with the connection already
+    back in the pool; a rolled back unit drops them.
+    """
+
+    def __init__(self):
+        self.connection = None
+        self.statements = None
+        self.calls = 0
+        self.checkouts = 0
+        self.failed = False
+        self.callbacks = []
+
+    def get_connection(self):
+        self.calls += 1
+        if self.connection is None:
+            self.connection = connection_manager.get_connection()
+            self.statements = prepared_statements.setdefault(self.connection._connection, OrderedDict())
+            self.checkouts += 1
+        return UnitConnection(self)
+
+    def statement(self, sql):
+        cursor = self.statements.get(sql)
+        if cursor is not None:
+            self.statements.move_to_end(sql)
+            return cursor
+        cursor = self.statements[sql] = self.connection.cursor(prepared=True)
+        while len(self.statements) > PREPARED_STATEMENTS:
+            _, evicted = self.statements.popitem(last=False)
+            try:
+                # deallocates the statement on the server
+                evicted.close()
+            except mysql.connector.Error as e:
+                logger.warning("Close prepared statement error", extra=fields(error=str(e)))
+        return cursor
+
+    def after_commit(self, callback):
+        self.callbacks.append(callback)
+
+    def finish(self):
+        callbacks, self.callbacks = self.callbacks, []
+        if self.connection is not None:
+            try:
+                if self.failed:
+                    self.connection.rollback()
+                else:
+                    self.connection.commit()
+            finally:
+                self.connection.close()
+                self.connection = None
+        if self.failed:
+            return
+        run_callbacks(callbacks)
+
+def run_callbacks(callbacks):
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            logger.error("After commit callback error", extra=fields(error=str(e)))
+
+class UnitConnection:
+    """
+    What get_connection() hands out inside a unit of work; commit and close are deferred to the unit
+    """
+
+    def __init__(self, unit):
+        self.unit = unit
+
+    def cursor(self):
+        return StatementCursor(self.unit)
 
-        return mysql.connector.connect(
-            host="localhost",
-            user="admin",
-            password="root",
-            database="chat_db"
-        )
-    return connection_pool.get_connection()
+    def commit(self):
+        pass
 
-def generate_chatid(userid1, userid2):
-    user_pair = tuple(sorted([userid1, userid2]))
-    return f"{user_pair[0]}:{user_pair[1]}"
+    def rollback(self):
+        self.unit.failed = True
 
-def decode_chatid(chatid):
-    userid1, userid2 = tuple(chatid.split(':'))
-    return int(userid1), int(userid2)
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+@contextmanager
+def unit_of_work(event=None):
+    if getattr(current, 'unit', None) is not None:
+        yield current.unit
+        return
+    unit = current.unit = UnitOfWork()
+    try:
+        yield unit
+    except BaseException:
+        unit.failed = True
+        raise
+    finally:
+        current.unit = None
+        try:
+            unit.finish()
+        finally:
+            if event:
+                DB_CALLS_PER_EVENT.observe(event, value=unit.calls)
+                DB_CHECKOUTS_PER_EVENT.observe(event, value=unit.checkouts)
+
+def after_commit(callback):
+    """Runs callback once the current unit of work has committed, or right away outside one"""
+    unit = getattr(current, 'unit', None)
+    if unit is None:
+        callback()
+    else:
+        unit.after_commit(callback)
+
+def get_connection():
+    unit = getattr(current, 'unit', None)
+    if unit is not None:
+        return unit.get_connection()
+    return connection_manager.get_connection()
 
 def database_setup():
     connection = None
@@ -44,43 +204,12 @@ def database_setup():
         cursor = connection.cursor()
         cursor.execute("CREATE DATABASE IF NOT EXISTS chat_db")
         cursor.execute("USE chat_db")
-        
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                username VARCHAR(16) UNIQUE,
-                password VARCHAR(32),
-                session_id CHAR(32)
-            )
-        """)
-        
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS messages (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                sender VARCHAR(10),
-                receiver VARCHAR(10),
-                ciphertext TEXT,
-                iv VARCHAR(24),
-                chat_id VARCHAR(50),
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS key_exchanges (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                reciever_id VARCHAR(20),
-                sender_id VARCHAR(20),
-                chat_id VARCHAR(50),
-                public_key TEXT,
-                accepted BOOLEAN DEFAULT FALSE
-            )
-        """)
-        
+        migrate(connection)
+
         connection.commit()
-        print("Database setup completed successfully")
+        logger.info("Database setup completed successfully")
     except mysql.connector.Error as e:
-        print(f"Database setup error: {e}")
+        logger.error("Database setup error", extra=fields(error=str(e)))
         if connection:
             connection.rollback()
         raise
@@ -97,7 +226,7 @@ def add_user(username, password, session_id):
         cursor.execute(sql, (username, password, session_id))
         connection.commit()
     except mysql.connector.Error as e:
-        print(f"Add user error: {e}")
+        logger.error("Add user error", extra=fields(error=str(e)))
         if connection:
             connection.rollback()
         raise
@@ -116,7 +245,7 @@ def get_user(username):
         user = cursor.fetchone()
         return user
     except mysql.connector.Error as e:
-        print(f"Get user error: {e}")
+        logger.error("Get user error", extra=fields(error=str(e)))
         raise
     finally:
         if connection and connection.is_connected():
@@ -132,7 +261,7 @@ def get_username(user_id):
         username = cursor.fetchone()
         return username
     except mysql.connector.Error as e:
-        print(f"Get username error: {e}")
+        logger.error("Get username error", extra=fields(error=str(e)))
         raise
     finally:
         if connection and connection.is_connected():
@@ -148,7 +277,43 @@ def session_check(session_id):
         user = cursor.fetchone()
         return user
     except mysql.connector.Error as e:
-        print(f"Session check error: {e}")
+        logger.error("Session check error", extra=fields(error=str(e)))
+        raise
+    finally:
+        if connection and connection.is_connected():
+            cursor.close()
+            connection.close()
+
+def rotate_session(user_id, session_id):
+    connection = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        sql = "UPDATE users SET session_id = %s WHERE id = %s"
+        cursor.execute(sql, (session_id, user_id))
+        connection.commit()
+    except mysql.connector.Error as e:
+        logger.error("Rotate session error", extra=fields(error=str(e)))
+        if connection:
+            connection.rollback()
+        raise
+    finally:
+        if connection and connection.is_connected():
+            cursor.close()
+            connection.close()
+
+def update_password(user_id, password):
+    connection = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        sql = "UPDATE users SET password = %s WHERE id = %s"
+        cursor.execute(sql, (password, user_id))
+        connection.commit()
+    except mysql.connector.Error as e:
+        logger.error("Update password error", extra=fields(error=str(e)))
+        if connection:
+            connection.rollback()
         raise
     finally:
         if connection and connection.is_connected():
@@ -161,19 +326,37 @@ def add_message(message_data):
         connection = get_connection()
         cursor = connection.cursor()
         sql = "INSERT INTO messages (sender, receiver, ciphertext, iv, chat_id, timestamp) VALUES (%s, %s, %s, %s, %s, FROM_UNIXTIME(%s))"
-        print(message_data)
-        chat_id = generate_chatid(message_data.get('sender'), message_data.get('receiver'))
-        cursor.execute(sql, (
-            message_data.get('sender'), 
-            message_data.get('receiver'), 
-            message_data.get('ciphertext'), 
-            message_data.get('iv'), 
-            chat_id,
-            time.time()
-        ))
+        row = message_row(message_data)
+        cursor.execute(sql, row)
+        message_id = cursor.lastrowid
+        sql = "INSERT INTO chat_reads (user_id, chat_id, unread_count) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE unread_count = unread_count + VALUES(unread_count)"
+        for increment in unread_increments([row]):
+            cursor.execute(sql, increment)
         connection.commit()
+        return message_id
     except mysql.connector.Error as e:
-        print(f"Add message error: {e}")
+        logger.error("Add message error", extra=fields(error=str(e)))
+        if connection:
+            connection.rollback()
+        raise
+    finally:
+        if connection and connection.is_connected():
+            cursor.close()
+            connection.close()
+
+def add_messages(messages):
+    connection = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        sql = "INSERT INTO messages (sender, receiver, ciphertext, iv, chat_id, timestamp) VALUES (%s, %s, %s, %s, %s, FROM_UNIXTIME(%s))"
+        rows = [message_row(message_data) for message_data in messages]
+        cursor.executemany(sql, rows)
+        sql = "INSERT INTO chat_reads (user_id, chat_id, unread_count) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE unread_count = unread_count + VALUES(unread_count)"
+        cursor.executemany(sql, unread_increments(rows))
+        connection.commit()
+    except mysql.connector.Error as e:
+        logger.error("Add messages error", extra=fields(error=str(e)))
         if connection:
             connection.rollback()
         raise
@@ -190,9 +373,231 @@ def get_messages(chat_id):
         sql = "SELECT * FROM messages WHERE chat_id = %s ORDER BY timestamp ASC"
         cursor.execute(sql, (chat_id,))
         messages = cursor.fetchall()
+        if archive is not None:
+            archived, _ = archive.get_since(chat_id, None, float('inf'))
+            if archived:
+                messages = archived + [m for m in messages if m[0] > archived[-1][0]]
         return messages
     except mysql.connector.Error as e:
-        print(f"Get messages error: {e}")
+        logger.error("Get messages error", extra=fields(error=str(e)))
+        raise
+    finally:
+        if connection and connection.is_connected():
+            cursor.close()
+            connection.close()
+
+def get_messages_page(chat_id, before_id=None, limit=HISTORY_PAGE_SIZE):
+    connection = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        limit = max(1, min(int(limit), HISTORY_MAX_PAGE_SIZE))
+        if before_id is None:
+            sql = "SELECT * FROM messages WHERE chat_id = %s ORDER BY id DESC LIMIT %s"
+            cursor.execute(sql, (chat_id, limit + 1))
+        else:
+            sql = "SELECT * FROM messages WHERE chat_id = %s AND id < %s ORDER BY id DESC LIMIT %s"
+            cursor.execute(sql, (chat_id, int(before_id), limit + 1))
+        messages = cursor.fetchall()
+        next_cursor = None
+        if len(messages) > limit:
+            messages = messages[:limit]
+            next_cursor = messages[-1][0]
+        messages.reverse()
+        if archive is not None and next_cursor is None:
+            return archive.complete_page(chat_id, messages, before_id, limit)
+        return messages, next_cursor
+    except mysql.connector.Error as e:
+        logger.error("Get messages page error", extra=fields(error=str(e)))
+        raise
+    finally:
+        if connection and connection.is_connected():
+            cursor.close()
+            connection.close()
+
+def get_messages_since(chat_id, since_id=None, since_ts=None, limit=HISTORY_MAX_PAGE_SIZE):
+    connection = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        limit = max(1, min(int(limit), HISTORY_MAX_PAGE_SIZE))
+        archived = []
+        if archive is not None:
+            cursor_id = int(since_id) if since_id is not None else archive.id_before_time(chat_id, float(since_ts))
+            if cursor_id is not None and cursor_id < archive.max_id():
+                archived, more = archive.get_since(chat_id, cursor_id, limit)
+                if len(archived) == limit:
+                    return archived, True
+        if since_id is not None:
+            sql = "SELECT * FROM messages WHERE chat_id = %s AND id > %s ORDER BY id LIMIT %s"
+            cursor.execute(sql, (chat_id, archived[-1][0] if archived else int(since_id), limit + 1 - len(archived)))
+        else:
+            sql = "SELECT * FROM messages WHERE chat_id = %s AND timestamp > FROM_UNIXTIME(%s) ORDER BY timestamp, id LIMIT %s"
+            cursor.execute(sql, (chat_id, float(since_ts), limit + 1 - len(archived)))
+        messages = cursor.fetchall()
+        if archived:
+            messages = archived + [m for m in messages if m[0] > archived[-1][0]]
+        more = len(messages) > limit
+        return messages[:limit], more
+    except mysql.connector.Error as e:
+        logger.error("Get messages since error", extra=fields(error=str(e)))
+        raise
+    finally:
+        if connection and connection.is_connected():
+            cursor.close()
+            connection.close()
+
+def get_messages_since_many(since, limit=HISTORY_MAX_PAGE_SIZE):
+    """since maps chat_id -> last seen message id; returns chat_id -> (messages, more) in one round trip"""
+    if not since:
+        return {}
+    limit = max(1, min(int(limit), HISTORY_MAX_PAGE_SIZE))
+    result = {}
+    if archive is not None:
+        archived_max = archive.max_id()
+        since = dict(since)
+        for chat_id, since_id in list(since.items()):
+            if int(since_id) < archived_max:
+                archived, _ = archive.get_since(chat_id, int(since_id), limit)
+                if len(archived) == limit:
+                    result[chat_id] = (archived, True)
+                    del since[chat_id]
+                elif archived:
+                    result[chat_id] = (archived, False)
+                    since[chat_id] = archived[-1][0]
+        if not since:
+            return result
+    connection = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        branch = "(SELECT * FROM messages WHERE chat_id = %s AND id > %s ORDER BY id LIMIT %s)"
+        sql = " UNION ALL ".join([branch] * len(since))
+        params = []
+        for chat_id, since_id in since.items():
+            params.extend((chat_id, int(since_id), limit + 1))
+        cursor.execute(sql, params)
+        grouped = {chat_id: [] for chat_id in since}
+        for message in cursor.fetchall():
+            grouped[message[5]].append(message)
+        for chat_id, messages in grouped.items():
+            if chat_id in result:
+                messages = result[chat_id][0] + messages
+            result[chat_id] = (messages[:limit], len(messages) > limit)
+        return result
+    except mysql.connector.Error as e:
+        logger.error("Get messages since many error", extra=fields(error=str(e)))
+        raise
+    finally:
+        if connection and connection.is_connected():
+            cursor.close()
+            connection.close()
+
+def add_pending_deliveries(user_id, chat_id, message_ids, keep=None):
+    """Queues message ids for an offline user; with keep, only the user's newest keep rows are kept"""
+    connection = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        sql = "INSERT IGNORE INTO pending_deliveries (user_id, chat_id, message_id) VALUES (%s, %s, %s)"
+        cursor.executemany(sql, [(user_id, chat_id, message_id) for message_id in message_ids])
+        if keep:
+            # older rows are only a delivery hint; the messages stay reachable through history
+            sql = """
+                DELETE FROM pending_deliveries WHERE user_id = %s AND message_id < (
+                    SELECT message_id FROM (
+                        SELECT message_id FROM pending_deliveries WHERE user_id = %s ORDER BY message_id DESC LIMIT 1 OFFSET %s
+                    ) AS newest
+                )
+            """
+            cursor.execute(sql, (user_id, user_id, int(keep) - 1))
+        connection.commit()
+    except mysql.connector.Error as e:
+        logger.error("Add pending deliveries error", extra=fields(error=str(e)))
+        if connection:
+            connection.rollback()
+        raise
+    finally:
+        if connection and connection.is_connected():
+            cursor.close()
+            connection.close()
+
+def get_pending_deliveries(user_id, limit=HISTORY_MAX_PAGE_SIZE):
+    connection = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        sql = """
+            SELECT m.* FROM pending_deliveries p
+            JOIN messages m ON m.id = p.message_id
+            WHERE p.user_id = %s
+            ORDER BY p.message_id
+            LIMIT %s
+        """
+        cursor.execute(sql, (user_id, int(limit) + 1))
+        messages = cursor.fetchall()
+        return messages[:limit], len(messages) > limit
+    except mysql.connector.Error as e:
+        logger.error("Get pending deliveries error", extra=fields(error=str(e)))
+        raise
+    finally:
+        if connection and connection.is_connected():
+            cursor.close()
+            connection.close()
+
+def delete_pending_deliveries(user_id, message_ids):
+    connection = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        sql = "DELETE FROM pending_deliveries WHERE user_id = %s AND message_id = %s"
+        cursor.executemany(sql, [(user_id, int(message_id)) for message_id in message_ids])
+        connection.commit()
+    except mysql.connector.Error as e:
+        logger.error("Delete pending deliveries error", extra=fields(error=str(e)))
+        if connection:
+            connection.rollback()
+        raise
+    finally:
+        if connection and connection.is_connected():
+            cursor.close()
+            connection.close()
+
+def delete_pending_deliveries_through(user_id, cursors):
+    """Deletes the user's queued rows up to the message id given per chat in cursors (chat_id -> id)"""
+    if not cursors:
+        return
+    connection = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        conditions = " OR ".join(["(chat_id = %s AND message_id <= %s)"] * len(cursors))
+        sql = f"DELETE FROM pending_deliveries WHERE user_id = %s AND ({conditions})"
+        cursor.execute(sql, [user_id] + [value for chat_id, message_id in cursors.items() for value in (chat_id, int(message_id))])
+        connection.commit()
+    except mysql.connector.Error as e:
+        logger.error("Delete pending deliveries error", extra=fields(error=str(e)))
+        if connection:
+            connection.rollback()
+        raise
+    finally:
+        if connection and connection.is_connected():
+            cursor.close()
+            connection.close()
+
+def expire_pending_deliveries(max_age):
+    """Deletes queued rows older than max_age seconds"""
+    connection = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        sql = "DELETE FROM pending_deliveries WHERE queued_at < NOW() - INTERVAL %s SECOND"
+        cursor.execute(sql, (int(max_age),))
+        connection.commit()
+    except mysql.connector.Error as e:
+        logger.error("Expire pending deliveries error", extra=fields(error=str(e)))
+        if connection:
+            connection.rollback()
         raise
     finally:
         if connection and connection.is_connected():
@@ -209,7 +614,7 @@ def get_key_exchanges(user_id):
         key_exchanges = cursor.fetchall()
         return key_exchanges
     except mysql.connector.Error as e:
-        print(f"Get key exchanges error: {e}")
+        logger.error("Get key exchanges error", extra=fields(error=str(e)))
         raise
     finally:
         if connection and connection.is_connected():
@@ -225,7 +630,7 @@ def add_key_exchange(reciever_id, sender_id, chat_id, public_key):
         cursor.execute(sql, (reciever_id, sender_id, chat_id, public_key))
         connection.commit()
     except mysql.connector.Error as e:
-        print(f"Add key exchange error: {e}")
+        logger.error("Add key exchange error", extra=fields(error=str(e)))
         if connection:
             connection.rollback()
         raise
@@ -243,7 +648,7 @@ def accept_key_exchange(reciever_id, chat_id):
         cursor.execute(sql, (reciever_id, chat_id))
         connection.commit()
     except mysql.connector.Error as e:
-        print(f"Accept key exchange error: {e}")
+        logger.error("Accept key exchange error", extra=fields(error=str(e)))
         if connection:
             connection.rollback()
         raise
@@ -252,6 +657,27 @@ def accept_key_exchange(reciever_id, chat_id):
             cursor.close()
             connection.close()
 
+def get_user_key_exchanges(user_id):
+    connection = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        sql = """
+            SELECT * FROM key_exchanges WHERE reciever_id = %s
+            UNION ALL
+            SELECT * FROM key_exchanges WHERE sender_id = %s AND reciever_id <> %s
+        """
+        cursor.execute(sql, (user_id, user_id, user_id))
+        key_exchanges = cursor.fetchall()
+        return key_exchanges
+    except mysql.connector.Error as e:
+        logger.error("Get user key exchanges error", extra=fields(error=str(e)))
+        raise
+    finally:
+        if connection and connection.is_connected():
+            cursor.close()
+            connection.close()
+
 def get_accepted_key_exchanges(user_id):
     connection = None
     try:
@@ -262,12 +688,65 @@ def get_accepted_key_exchanges(user_id):
         key_exchanges = cursor.fetchall()
         return key_exchanges
     except mysql.connector.Error as e:
-        print(f"Get accepted key exchanges error: {e}")
+        logger.error("Get accepted key exchanges error", extra=fields(error=str(e)))
         raise
     finally:
         if connection and connection.is_connected():
             cursor.close()
             connection.close()
+def get_chat_list(user_id):
+    connection = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        sql = """
+            SELECT k.reciever_id, k.sender_id, k.chat_id, ru.username, su.username,
+                COALESCE(r.unread_count, 0), COALESCE(r.last_read_id, 0)
+            FROM key_exchanges k
+            LEFT JOIN users ru ON ru.id = k.reciever_id
+            LEFT JOIN users su ON su.id = k.sender_id
+            LEFT JOIN chat_reads r ON r.user_id = %s AND r.chat_id = k.chat_id
+            WHERE (k.reciever_id = %s OR k.sender_id = %s) AND k.accepted = TRUE
+        """
+        cursor.execute(sql, (user_id, user_id, user_id))
+        chats = cursor.fetchall()
+        return chats
+    except mysql.connector.Error as e:
+        logger.error("Get chat list error", extra=fields(error=str(e)))
+        raise
+    finally:
+        if connection and connection.is_connected():
+            cursor.close()
+            connection.close()
+def mark_read(user_id, chat_id, message_id):
+    """Advances the user's read cursor for a chat; returns (last_read_id, unread_count)"""
+    connection = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        sql = """
+            INSERT INTO chat_reads (user_id, chat_id, last_read_id, unread_count)
+            VALUES (%s, %s, %s, (SELECT COUNT(*) FROM messages WHERE chat_id = %s AND id > %s AND (receiver = %s OR (receiver IS NULL AND sender <> %s))))
+            ON DUPLICATE KEY UPDATE
+                unread_count = IF(VALUES(last_read_id) > last_read_id, VALUES(unread_count), unread_count),
+                last_read_id = GREATEST(last_read_id, VALUES(last_read_id))
+        """
+        cursor.execute(sql, (user_id, chat_id, int(message_id), chat_id, int(message_id), user_id, user_id))
+        sql = "SELECT last_read_id, unread_count FROM chat_reads WHERE user_id = %s AND chat_id = %s"
+        cursor.execute(sql, (user_id, chat_id))
+        state = cursor.fetchone()
+        connection.commit()
+        return state
+    except mysql.connector.Error as e:
+        logger.error("Mark read error", extra=fields(error=str(e)))
+        if connection:
+            connection.rollback()
+        raise
+    finally:
+        if connection and connection.is_connected():
+            cursor.close()
+            connection.close()
+
 def get_key_exchange(chat_id):
     connection = None
     try:
@@ -278,23 +757,178 @@ def get_key_exchange(chat_id):
         key_exchange = cursor.fetchone()
         return key_exchange
     except mysql.connector.Error as e:
-        print(f"Get key exchange error: {e}")
+        logger.error("Get key exchange error", extra=fields(error=str(e)))
         raise
     finally:
         if connection and connection.is_connected():
             cursor.close()
             connection.close()
+
+def create_group(owner_id, name, member_ids):
+    connection = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        sql = "INSERT INTO chat_groups (name, owner_id) VALUES (%s, %s)"
+        cursor.execute(sql, (name, owner_id))
+        group_id = cursor.lastrowid
+        sql = "INSERT IGNORE INTO group_members (group_id, user_id) VALUES (%s, %s)"
+        cursor.executemany(sql, [(group_id, user_id) for user_id in {owner_id, *member_ids}])
+        connection.commit()
+        return group_id
+    except mysql.connector.Error as e:
+        logger.error("Create group error", extra=fields(error=str(e)))
+        if connection:
+            connection.rollback()
+        raise
+    finally:
+        if connection and connection.is_connected():
+            cursor.close()
+            connection.close()
+
+def get_group(group_id):
+    connection = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        sql = "SELECT id, name, owner_id FROM chat_groups WHERE id = %s"
+        cursor.execute(sql, (group_id,))
+        return cursor.fetchone()
+    except mysql.connector.Error as e:
+        logger.error("Get group error", extra=fields(error=str(e)))
+        raise
+    finally:
+        if connection and connection.is_connected():
+            cursor.close()
+            connection.close()
+
+def add_group_members(group_id, user_ids):
+    connection = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        sql = "INSERT IGNORE INTO group_members (group_id, user_id) VALUES (%s, %s)"
+        cursor.executemany(sql, [(group_id, user_id) for user_id in user_ids])
+        connection.commit()
+    except mysql.connector.Error as e:
+        logger.error("Add group members error", extra=fields(error=str(e)))
+        if connection:
+            connection.rollback()
+        raise
+    finally:
+        if connection and connection.is_connected():
+            cursor.close()
+            connection.close()
+
+def remove_group_member(group_id, user_id):
+    """Drops the member and every sender key they sent or received in the group"""
+    connection = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        sql = "DELETE FROM group_members WHERE group_id = %s AND user_id = %s"
+        cursor.execute(sql, (group_id, user_id))
+        sql = "DELETE FROM group_sender_keys WHERE group_id = %s AND (sender_id = %s OR recipient_id = %s)"
+        cursor.execute(sql, (group_id, user_id, user_id))
+        connection.commit()
+    except mysql.connector.Error as e:
+        logger.error("Remove group member error", extra=fields(error=str(e)))
+        if connection:
+            connection.rollback()
+        raise
+    finally:
+        if connection and connection.is_connected():
+            cursor.close()
+            connection.close()
+
+def get_group_members(group_id):
+    connection = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        sql = "SELECT user_id FROM group_members WHERE group_id = %s"
+        cursor.execute(sql, (group_id,))
+        return [row[0] for row in cursor.fetchall()]
+    except mysql.connector.Error as e:
+        logger.error("Get group members error", extra=fields(error=str(e)))
+        raise
+    finally:
+        if connection and connection.is_connected():
+            cursor.close()
+            connection.close()
+
+def get_user_groups(user_id):
+    """(group_id, name, owner_id, unread_count, last_read_id) for every group the user is in"""
+    connection = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        # group messages are stored once, so unread counts come from the read cursor rather than a counter
+        sql = """
+            SELECT g.id, g.name, g.owner_id,
+                (SELECT COUNT(*) FROM messages m
+                 WHERE m.chat_id = CONCAT('g:', g.id) AND m.id > COALESCE(r.last_read_id, 0) AND m.sender <> %s),
+                COALESCE(r.last_read_id, 0)
+            FROM group_members gm
+            JOIN chat_groups g ON g.id = gm.group_id
+            LEFT JOIN chat_reads r ON r.user_id = %s AND r.chat_id = CONCAT('g:', g.id)
+            WHERE gm.user_id = %s
+        """
+        cursor.execute(sql, (user_id, user_id, user_id))
+        return cursor.fetchall()
+    except mysql.connector.Error as e:
+        logger.error("Get user groups error", extra=fields(error=str(e)))
+        raise
+    finally:
+        if connection and connection.is_connected():
+            cursor.close()
+            connection.close()
+
+def add_sender_keys(group_id, sender_id, key_id, envelopes):
+    """envelopes are (recipient_id, ciphertext, iv): the sender key sealed for each member; replaces older keys"""
+    connection = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        sql = """
+            INSERT INTO group_sender_keys (group_id, sender_id, recipient_id, key_id, ciphertext, iv)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE key_id = VALUES(key_id), ciphertext = VALUES(ciphertext), iv = VALUES(iv)
+        """
+        cursor.executemany(sql, [(group_id, sender_id, recipient_id, key_id, ciphertext, iv) for recipient_id, ciphertext, iv in envelopes])
+        connection.commit()
+    except mysql.connector.Error as e:
+        logger.error("Add sender keys error", extra=fields(error=str(e)))
+        if connection:
+            connection.rollback()
+        raise
+    finally:
+        if connection and connection.is_connected():
+            cursor.close()
+            connection.close()
+
+def get_sender_keys(group_id, recipient_id):
+    """(sender_id, key_id, ciphertext, iv) for every sender key sealed for this member"""
+    connection = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        sql = "SELECT sender_id, key_id, ciphertext, iv FROM group_sender_keys WHERE group_id = %s AND recipient_id = %s"
+        cursor.execute(sql, (group_id, recipient_id))
+        return cursor.fetchall()
+    except mysql.connector.Error as e:
+        logger.error("Get sender keys error", extra=fields(error=str(e)))
+        raise
+    finally:
+        if connection and connection.is_connected():
+            cursor.close()
+            connection.close()
+
 def get_pool_status():
-    if connection_pool:
-        return {
-            "pool_size": connection_pool.pool_size,
-            "pool_name": connection_pool.pool_name
-        }
-    return None
+    return connection_manager.stats()
+
+def get_archive_status():
+    return archive.stats() if archive is not None else None
 
 if __name__ == "__main__":
-  connection = get_connection()
-  cursor = connection.cursor()
-  cursor.execute("DROP TABLE messages")
-  connection.commit()
   database_setup()
\ No newline at end of file
@@ -0,0 +1,184 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+class Presence:
+    """
+    Which users have a socket connected to this process
+    """
+
+    def __init__(self):
+        self.sockets = defaultdict(set)
+        self.users = {}
+        self.lock = threading.Lock()
+
+    def connected(self, user_id, sid):
+        with self.lock:
+            self.sockets[user_id].add(sid)
+            self.users[sid] = user_id
+
+    def disconnected(self, sid):
+        with self.lock:
+            user_id = self.users.pop(sid, None)
+            if user_id is not None:
+                sockets = self.sockets.get(user_id)
+                if sockets is not None:
+                    sockets.discard(sid)
+                    if not sockets:
+                        del self.sockets[user_id]
+            return user_id
+
+    def sids(self, user_id):
+        with self.lock:
+            return list(self.sockets.get(user_id, ()))
+
+    def is_online(self, user_id):
+        with self.lock:
+            return user_id in self.sockets
+
+    def stats(self):
+        with self.lock:
+            return {"users": len(self.sockets), "sockets": len(self.users)}
+
+class DeliveryQueue:
+    """
+    Messages waiting for an offline recipient, kept until the client acknowledges them.
+
+    Each user holds at most max_per_user messages in memory and all users together at
+    most max_total; anything beyond that is spilled to storage as (user_id, chat_id,
+    message_id) rows, at most max_stored_per_user of the newest per user, and read back
+    when the user's queue is flushed. With shared set, other processes spill for the same
+    users, so storage is always consulted.
+
+    Besides explicit acks, anything the client has since fetched through history or catch
+    up, or marked read, is acknowledged per chat with ack_through. Entries older than ttl
+    seconds are dropped; the messages themselves stay in history.
+    """
+
+    def __init__(self, spill, load, drop, drop_through, expire_stored, max_per_user=500, max_total=100000, max_stored_per_user=1000, ttl=7 * 86400, shared=False):
+        self.spill = spill
+        self.load = load
+        self.drop = drop
+        self.drop_through = drop_through
+        self.expire_stored = expire_stored
+        self.max_per_user = max_per_user
+        self.max_total = max_total
+        self.max_stored_per_user = max_stored_per_user
+        self.ttl = ttl
+        self.expire_interval = min(ttl, 60) if ttl else None
+        self.shared = shared
+        self.queues = {}
+        self.total = 0
+        # users whose spilled rows may be in storage; unknown until first checked after a restart
+        self.spilled_users = set()
+        self.checked_users = set()
+        self.lock = threading.Lock()
+        self.last_expired = time.monotonic()
+        self.enqueued = 0
+        self.spilled = 0
+        self.acked = 0
+        self.expired = 0
+
+    def enqueue(self, user_id, message):
+        now = time.monotonic()
+        if self.expire_interval and now - self.last_expired >= self.expire_interval:
+            self.expire(now)
+        with self.lock:
+            self.enqueued += 1
+            queue = self.queues.get(user_id)
+            if user_id not in self.spilled_users and (queue is None or len(queue) < self.max_per_user) and self.total < self.max_total:
+                if queue is None:
+                    queue = self.queues[user_id] = OrderedDict()
+                queue[message["id"]] = (now, message)
+                self.total += 1
+                return
+            # once a user has spilled, later messages go to storage too so the order stays intact
+            self.spilled_users.add(user_id)
+            self.spilled += 1
+        self.spill(user_id, message["chat_id"], [message["id"]], self.max_stored_per_user)
+
+    def pending(self, user_id, limit):
+        """Up to limit unacknowledged messages, oldest first, and whether more are waiting"""
+        with self.lock:
+            queued = [message for _, message in self.queues.get(user_id, {}).values()]
+            check_storage = self._check_storage(user_id)
+            self.checked_users.add(user_id)
+        if len(queued) > limit or not check_storage:
+            return queued[:limit], len(queued) > limit
+        stored, more = self.load(user_id, limit - len(queued)) if len(queued) < limit else ([], True)
+        with self.lock:
+            if stored:
+                self.spilled_users.add(user_id)
+            elif len(queued) < limit:
+                self.spilled_users.discard(user_id)
+        return queued + stored, more
+
+    def _check_storage(self, user_id):
+        return self.shared or user_id in self.spilled_users or user_id not in self.checked_users
+
+    def ack(self, user_id, message_ids):
+        stored = []
+        with self.lock:
+            queue = self.queues.get(user_id)
+            for message_id in message_ids:
+                if queue is not None and queue.pop(message_id, None) is not None:
+                    self.total -= 1
+                    self.acked += 1
+                else:
+                    stored.append(message_id)
+            if queue is not None and not queue:
+                del self.queues[user_id]
+            check_storage = self.shared or user_id in self.spilled_users
+        if stored and check_storage:
+            self.drop(user_id, stored)
+            with self.lock:
+                self.acked += len(stored)
+
+    def ack_through(self, user_id, cursors):
+        """Acknowledges every queued message up to the id given per chat in cursors (chat_id -> message id)"""
+        with self.lock:
+            queue = self.queues.get(user_id)
+            if queue:
+                done = [message_id for message_id, (_, message) in queue.items() if message_id <= cursors.get(message["chat_id"], 0)]
+                for message_id in done:
+                    del queue[message_id]
+                self.total -= len(done)
+                self.acked += len(done)
+                if not queue:
+                    del self.queues[user_id]
+            check_storage = self._check_storage(user_id)
+        if check_storage:
+            self.drop_through(user_id, cursors)
+
+    def expire(self, now=None):
+        """Drops entries queued more than ttl seconds ago, here and in storage"""
+        now = time.monotonic() if now is None else now
+        cutoff = now - self.ttl
+        with self.lock:
+            self.last_expired = now
+            for user_id in list(self.queues):
+                queue = self.queues[user_id]
+                while queue and next(iter(queue.values()))[0] < cutoff:
+                    queue.popitem(last=False)
+                    self.total -= 1
+                    self.expired += 1
+                if not queue:
+                    del self.queues[user_id]
+        self.expire_stored(self.ttl)
+
+    def has_pending(self, user_id):
+        with self.lock:
+            return user_id in self.queues or user_id in self.spilled_users
+
+    def stats(self):
+        with self.lock:
+            return {
+                "users": len(self.queues),
+                "queued": self.total,
+                "max_total": self.max_total,
+                "spilled_users": len(self.spilled_users),
+                "enqueued": self.enqueued,
+                "spilled": self.spilled,
+                "acked": self.acked,
+                "expired": self.expired
+            }
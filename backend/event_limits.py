@@ -0,0 +1,98 @@
+import threading
+import time
+from structured_log import get_logger, fields
+
+logger = get_logger('event_limits')
+
+class EventRateLimiter:
+    """
+    Token bucket per socket; every event spends its cost and refills at rate tokens per second
+    """
+
+    def __init__(self, rate, burst, costs=None, default_cost=1.0, max_violations=50):
+        self.rate = rate
+        self.burst = burst
+        self.costs = costs or {}
+        self.default_cost = default_cost
+        self.max_violations = max_violations
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.throttled = 0
+
+    def take(self, sid, event):
+        """Returns (0, 0) when the event may run, else (seconds until it could, consecutive refusals)"""
+        cost = self.costs.get(event, self.default_cost)
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(sid)
+            if bucket is None:
+                bucket = self.buckets[sid] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                bucket[2] = 0
+                return 0, 0
+            bucket[2] += 1
+            self.throttled += 1
+            return (cost - bucket[0]) / self.rate, bucket[2]
+
+    def forget(self, sid):
+        with self.lock:
+            self.buckets.pop(sid, None)
+
+    def stats(self):
+        with self.lock:
+            return {"rate": self.rate, "burst": self.burst, "sockets": len(self.buckets), "throttled": self.throttled}
+
+class SlowConsumerMonitor:
+    """
+    Periodically disconnects sockets whose Engine.IO outbound queue has grown past max_queue.
+
+    A client that reads slower than it is sent to would otherwise buffer every emit in
+    server memory; the queue length is the only signal threading mode exposes.
+    """
+
+    def __init__(self, eio, max_queue=1000, interval=1.0, on_disconnect=None):
+        self.eio = eio
+        self.max_queue = max_queue
+        self.interval = interval
+        self.on_disconnect = on_disconnect
+        self.running = False
+        self.max_seen = 0
+        self.disconnected = 0
+
+    def check(self):
+        deepest = 0
+        slow = []
+        for eio_sid, socket in list(self.eio.sockets.items()):
+            depth = socket.queue.qsize()
+            deepest = max(deepest, depth)
+            if depth > self.max_queue:
+                slow.append(eio_sid)
+        self.max_seen = deepest
+        for eio_sid in slow:
+            logger.warning("Disconnecting slow consumer", extra=fields(sid=eio_sid))
+            self.disconnected += 1
+            if self.on_disconnect:
+                self.on_disconnect()
+            try:
+                self.eio.disconnect(eio_sid)
+            except KeyError:
+                pass
+        return len(slow)
+
+    def run(self, sleep):
+        self.running = True
+        while self.running:
+            sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                logger.error("Slow consumer check error", extra=fields(error=str(e)))
+
+    def stop(self):
+        self.running = False
+
+    def stats(self):
+        return {"max_queue": self.max_queue, "deepest_queue": self.max_seen, "disconnected": self.disconnected}
@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from common import decode_chatid, decode_group_chatid, is_group_chatid
+
+@lru_cache(maxsize=65536)
+def chat_members(chat_id):
+    """The two user ids encoded in a chat id, or None when it is malformed"""
+    try:
+        return frozenset(decode_chatid(chat_id))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def is_member(user_id, chat_id):
+    members = chat_members(chat_id)
+    return members is not None and user_id in members
+
+class ChatMembership:
+    """
+    Member sets for every chat id: direct chats decode their two members, group chats are
+    loaded once and kept in step with local membership changes.
+
+    When other processes change membership too, group entries are re-read after ttl seconds.
+    """
+
+    def __init__(self, group_loader, max_groups=10000, ttl=None):
+        self.group_loader = group_loader
+        self.max_groups = max_groups
+        self.ttl = ttl
+        self.groups = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+
+    def members(self, chat_id):
+        """frozenset of user ids in the chat, or None when the chat id is malformed"""
+        if not is_group_chatid(chat_id):
+            return chat_members(chat_id)
+        try:
+            group_id = decode_group_chatid(chat_id)
+        except ValueError:
+            return None
+        now = time.monotonic()
+        with self.lock:
+            entry = self.groups.get(group_id)
+            if entry is not None and (self.ttl is None or now - entry[1] < self.ttl):
+                self.groups.move_to_end(group_id)
+                self.hits += 1
+                return entry[0]
+        members = frozenset(self.group_loader(group_id))
+        self.set(group_id, members, now)
+        with self.lock:
+            self.loads += 1
+        return members
+
+    def is_member(self, user_id, chat_id):
+        members = self.members(chat_id)
+        return members is not None and user_id in members
+
+    def set(self, group_id, members, loaded_at=None):
+        with self.lock:
+            self.groups[group_id] = (frozenset(members), time.monotonic() if loaded_at is None else loaded_at)
+            self.groups.move_to_end(group_id)
+            while len(self.groups) > self.max_groups:
+                self.groups.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {"groups": len(self.groups), "hits": self.hits, "loads": self.loads}
+
+class ExchangeIndex:
+    """
+    Key exchange rows by chat id, loaded once per user and kept in step with local writes.
+
+    Exchanges are never deleted and acceptance never reverts, so an accepted row can
+    always be trusted. When other processes write to the same database the index is
+    not authoritative and anything short of accepted is re-read from storage.
+    """
+
+    def __init__(self, user_loader, chat_loader, max_users=50000, authoritative=True):
+        self.user_loader = user_loader
+        self.chat_loader = chat_loader
+        self.max_users = max_users
+        self.authoritative = authoritative
+        self.users = OrderedDict()
+        self.chats = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def _ensure_user(self, user_id):
+        with self.lock:
+            if user_id in self.users:
+                self.users.move_to_end(user_id)
+                return
+        exchanges = self.user_loader(user_id)
+        with self.lock:
+            self.loads += 1
+            chats = self.users.setdefault(user_id, set())
+            for exchange in exchanges:
+                self._store(exchange)
+                chats.add(exchange[3])
+            self.users.move_to_end(user_id)
+            while len(self.users) > self.max_users:
+                _, chats = self.users.popitem(last=False)
+                self.evictions += 1
+                self._forget(chats)
+
+    def _forget(self, chats):
+        for chat_id in chats:
+            if not any(member in self.users for member in chat_members(chat_id) or ()):
+                self.chats.pop(chat_id, None)
+
+    def _store(self, exchange):
+        current = self.chats.get(exchange[3])
+        if current is None or (exchange[5] and not current[5]):
+            self.chats[exchange[3]] = tuple(exchange)
+
+    def get(self, user_id, chat_id):
+        """The key exchange row for a chat the user belongs to, or None"""
+        self._ensure_user(user_id)
+        with self.lock:
+            exchange = self.chats.get(chat_id)
+        if exchange is not None and (exchange[5] or self.authoritative):
+            with self.lock:
+                self.hits += 1
+            return exchange
+        if self.authoritative:
+            with self.lock:
+                self.hits += 1
+            return None
+        exchange = self.chat_loader(chat_id)
+        if exchange is not None:
+            with self.lock:
+                self._store(exchange)
+        return exchange
+
+    def added(self, reciever_id, sender_id, chat_id, public_key):
+        with self.lock:
+            self._store((None, reciever_id, sender_id, chat_id, public_key, False))
+            for user_id in (reciever_id, sender_id):
+                if user_id in self.users:
+                    self.users[user_id].add(chat_id)
+
+    def accepted(self, chat_id):
+        with self.lock:
+            exchange = self.chats.get(chat_id)
+            if exchange is not None:
+                self.chats[chat_id] = exchange[:5] + (True,)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "users": len(self.users),
+                "chats": len(self.chats),
+                "hits": self.hits,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "authoritative": self.authoritative
+            }
@@ -0,0 +1,146 @@
+import argparse
+import ast
+import os
+import re
+import sys
+
+DATABASE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "database.py")
+SKIP_FUNCTIONS = {"database_setup"}
+# case-sensitive, so log messages and docstrings that start with the same words are not queries
+EXPLAINABLE = re.compile(r"^(?:SELECT|UPDATE|DELETE)\b")
+INSERT = re.compile(r"^(?:INSERT|REPLACE)\b")
+UNION = re.compile(r"\s+UNION(?:\s+ALL|\s+DISTINCT)?\s+", re.IGNORECASE)
+TABLE = re.compile(r"\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(?!ON\b|WHERE\b|SET\b|JOIN\b|LEFT\b|RIGHT\b|INNER\b|CROSS\b|ORDER\b|GROUP\b|HAVING\b|LIMIT\b|USING\b|VALUES\b|FOR\b)(\w+))?", re.IGNORECASE)
+COMPARED_COLUMN = re.compile(r"([\w.]+)\s*(?:=|<>|!=|<=|>=|<|>)\s*$")
+NUMERIC_PARAMETER = re.compile(r"(?:LIMIT|OFFSET|INTERVAL)\s*$|FROM_UNIXTIME\(\s*$", re.IGNORECASE)
+# the optimizer stops at these without looking at the remaining tables, so the plan proves nothing
+UNCHECKED_PLANS = ("Impossible WHERE", "no matching row in const table", "const row not found")
+
+def split_union(sql):
+    """Each branch of a UNION, without the parentheses around it, so every branch gets its own plan"""
+    branches = []
+    for branch in UNION.split(sql):
+        branch = branch.strip()
+        while branch.startswith("(") and branch.endswith(")"):
+            branch = branch[1:-1].strip()
+        branches.append(branch)
+    return branches
+
+def explainable(sql):
+    # INSERT ... SELECT and INSERT ... VALUES ((SELECT ...)) read tables too
+    return bool(EXPLAINABLE.match(sql)) or (bool(INSERT.match(sql)) and "SELECT" in sql)
+
+def collect_queries(path=DATABASE_FILE):
+    """(function, sql) for every explainable statement, and (function, fragment) for SQL assembled at runtime"""
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    queries = []
+    skipped = []
+    for node in tree.body:
+        if not isinstance(node, ast.FunctionDef) or node.name in SKIP_FUNCTIONS:
+            continue
+        formatted = {id(part) for child in ast.walk(node) if isinstance(child, ast.JoinedStr) for part in child.values}
+        for child in ast.walk(node):
+            if isinstance(child, ast.Constant) and isinstance(child.value, str):
+                sql = " ".join(child.value.split())
+                for branch in split_union(sql):
+                    if not explainable(branch):
+                        continue
+                    if id(child) in formatted:
+                        skipped.append((node.name, branch))
+                    else:
+                        queries.append((node.name, branch))
+    return queries, skipped
+
+def load_columns(cursor):
+    """column name -> tables of the current schema that have it"""
+    cursor.execute("SELECT table_name, column_name FROM information_schema.columns WHERE table_schema = DATABASE()")
+    columns = {}
+    for table, column in cursor.fetchall():
+        columns.setdefault(column.lower(), []).append(table)
+    return columns
+
+def sample_value(cursor, table, column, cache):
+    # a value that exists, so const lookups find a row and the optimizer plans the rest of the query
+    key = (table, column)
+    if key not in cache:
+        cursor.execute(f"SELECT `{column}` FROM `{table}` WHERE `{column}` IS NOT NULL LIMIT 1")
+        row = cursor.fetchone()
+        cache[key] = row[0] if row else None
+    return cache[key]
+
+def bind_sample_params(cursor, sql, columns, cache):
+    """One parameter per %s: a stored value of the column it is compared with, else a number"""
+    aliases = {}
+    for table, alias in TABLE.findall(sql):
+        aliases[table.lower()] = table
+        if alias:
+            aliases[alias.lower()] = table
+    tables = set(aliases.values())
+    params = []
+    parts = sql.split("%s")
+    for before in parts[:-1]:
+        value = None
+        compared = COMPARED_COLUMN.search(before)
+        if compared and not NUMERIC_PARAMETER.search(before):
+            qualifier, _, column = compared.group(1).rpartition(".")
+            candidates = [aliases[qualifier.lower()]] if qualifier.lower() in aliases else [t for t in columns.get(column.lower(), []) if t in tables]
+            for table in candidates:
+                if table in columns.get(column.lower(), []):
+                    value = sample_value(cursor, table, column, cache)
+                    if value is not None:
+                        break
+        params.append(value if value is not None else 10)
+    return params
+
+def explain(cursor, sql, columns, cache):
+    cursor.execute("EXPLAIN " + sql, bind_sample_params(cursor, sql, columns, cache))
+    names = [c[0] for c in cursor.description]
+    return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+def full_scans(plan, strict=False):
+    # type=ALL without a chosen key reads every row whatever possible_keys lists; strict
+    # also fails full index scans, which still touch every entry of the index
+    return [row for row in plan if (row.get("type") == "ALL" and row.get("key") is None) or (strict and row.get("type") in ("ALL", "index"))]
+
+def unchecked(plan):
+    return [row for row in plan if any(reason in str(row.get("Extra") or "") for reason in UNCHECKED_PLANS)]
+
+def main():
+    parser = argparse.ArgumentParser(description="EXPLAIN every query in database.py and fail on full table scans")
+    parser.add_argument("--strict", action="store_true", help="also fail on full index scans and on plans the optimizer cut short")
+    args = parser.parse_args()
+
+    from database import get_connection
+
+    queries, skipped = collect_queries()
+    connection = get_connection()
+    cursor = connection.cursor(buffered=True)
+    failures = 0
+    try:
+        columns = load_columns(cursor)
+        cache = {}
+        for function, sql in queries:
+            plan = explain(cursor, sql, columns, cache)
+            scans = full_scans(plan, args.strict)
+            cut_short = unchecked(plan)
+            status = "FULL SCAN" if scans else "UNCHECKED" if cut_short else "ok"
+            print(f"{status:>9}  {function}: {sql}")
+            for row in scans:
+                print(f"           table={row.get('table')} type={row.get('type')} rows={row.get('rows')} possible_keys={row.get('possible_keys')}")
+            for row in cut_short:
+                print(f"           table={row.get('table')} {row.get('Extra')}: no sample data, add rows and rerun")
+            failures += bool(scans) or (args.strict and bool(cut_short))
+        for function, sql in skipped:
+            print(f"{'SKIPPED':>9}  {function}: built at runtime, not checked: {sql}")
+    finally:
+        cursor.close()
+        connection.close()
+
+    if failures:
+        print(f"{failures} queries do full table scans or could not be checked")
+        sys.exit(1)
+    print("No full table scans")
+
+if __name__ == "__main__":
+    main()
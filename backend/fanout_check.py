@@ -0,0 +1,116 @@
+import argparse
+import json
+import os
+import queue
+import sys
+import time
+import urllib.request
+import uuid
+import socketio
+from common import generate_chatid
+from message_bus import UnixSocketBroker
+from workers import start_workers
+
+def post_json(url, body):
+    request = urllib.request.Request(url, data=json.dumps(body).encode('utf-8'), headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as resp:
+        return json.loads(resp.read())
+
+def wait_for(url, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"{url}/socket.io/?EIO=4&transport=polling")
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f"Worker at {url} did not start")
+
+def connect(url, session_id):
+    client = socketio.Client(reconnection=False, websocket_extra_options={'suppress_origin': True})
+    inbox = queue.Queue()
+    client.on('*', lambda event, data=None: inbox.put((event, data)))
+    client.connect(url, headers={'Cookie': f"session_id={session_id}"}, transports=['websocket'])
+    return client, inbox
+
+def expect(inbox, event, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            name, data = inbox.get(timeout=deadline - time.monotonic())
+        except queue.Empty:
+            break
+        if name == event:
+            return data
+    raise AssertionError(f"Did not receive {event}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that messages reach a user connected to a different worker")
+    parser.add_argument("--base-port", type=int, default=5200)
+    parser.add_argument("--storage", default=os.getenv('VSC_STORAGE', 'mysql'))
+    args = parser.parse_args()
+
+    bus_path = f"/tmp/vsc-bus-{uuid.uuid4().hex[:8]}.sock"
+    broker = UnixSocketBroker(bus_path).start()
+    workers = start_workers(2, args.base_port, f"unix://{bus_path}", {'VSC_STORAGE': args.storage})
+    urls = [f"http://127.0.0.1:{args.base_port + i}" for i in range(2)]
+    clients = []
+    try:
+        for url in urls:
+            wait_for(url)
+
+        # The in-memory engine is per process, so replay the signups on every
+        # worker in the same order to get the same user ids everywhere.
+        suffix = uuid.uuid4().hex[:6]
+        signup_urls = urls if args.storage == 'memory' else urls[:1]
+        sessions = {}
+        for url in signup_urls:
+            for name in ('alice', 'bob'):
+                sessions[(url, name)] = post_json(f"{url}/api/signup", {'username': f"{name}_{suffix}", 'password': 'pw'})['session_id']
+        alice_session = sessions[(signup_urls[0], 'alice')]
+        bob_session = sessions[(signup_urls[-1], 'bob')]
+
+        alice, alice_inbox = connect(urls[0], alice_session)
+        bob, bob_inbox = connect(urls[1], bob_session)
+        clients = [alice, bob]
+        alice_id = bob_id = None
+        for url, session_id, name in ((urls[0], alice_session, 'alice'), (urls[1], bob_session, 'bob')):
+            request = urllib.request.Request(f"{url}/api/authenticate", headers={'Cookie': f"session_id={session_id}"})
+            with urllib.request.urlopen(request) as resp:
+                user_id = json.loads(resp.read())['data']['User_id']
+            if name == 'alice':
+                alice_id = user_id
+            else:
+                bob_id = user_id
+        chat_id = generate_chatid(alice_id, bob_id)
+
+        alice.emit('key_exchange_request', {'reciever_id': bob_id, 'chat_id': chat_id, 'public_key': 'alice-key'})
+        if args.storage == 'memory':
+            # Worker 1 has its own store, so mirror the exchange row there.
+            alice_on_bob_worker, _ = connect(urls[1], sessions[(urls[1], 'alice')])
+            clients.append(alice_on_bob_worker)
+            alice_on_bob_worker.emit('key_exchange_request', {'reciever_id': bob_id, 'chat_id': chat_id, 'public_key': 'alice-key'})
+        expect(bob_inbox, 'new_key_exchange_request')
+
+        bob.emit('connect_chat', {'chat_id': chat_id})
+        expect(bob_inbox, 'message_history')
+        alice.emit('connect_chat', {'chat_id': chat_id})
+        expect(alice_inbox, 'message_history')
+
+        alice.emit('send_message', {'chat_id': chat_id, 'sender': alice_id, 'receiver': bob_id, 'ciphertext': 'Y3Jvc3Mtd29ya2Vy', 'iv': 'aXYtaXYtaXYtaXYt'})
+        message = expect(bob_inbox, 'new_message')
+        assert message['ciphertext'] == 'Y3Jvc3Mtd29ya2Vy', message
+        print("ok: message sent on worker 0 was delivered on worker 1")
+    except Exception as e:
+        print(f"FAILED: {e}")
+        sys.exit(1)
+    finally:
+        for client in clients:
+            client.disconnect()
+        for worker in workers:
+            worker.terminate()
+            worker.wait()
+        broker.stop()
+
+if __name__ == "__main__":
+    main()
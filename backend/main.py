@@ -1,18 +1,162 @@
 import flask
-import bcrypt
+import base64
 import uuid
 import os
-from database import add_user, get_user, session_check, get_messages, add_message, decode_chatid, get_key_exchanges, add_key_exchange, accept_key_exchange, get_accepted_key_exchanges, get_key_exchange, get_username
+from storage import add_user, get_user, session_check, get_messages_page, get_messages_since, get_messages_since_many, add_message, add_messages, get_key_exchanges, add_pending_deliveries, get_pending_deliveries, delete_pending_deliveries, delete_pending_deliveries_through, expire_pending_deliveries, add_key_exchange, accept_key_exchange, get_user_key_exchanges, get_key_exchange, get_chat_list, mark_read, rotate_session, update_password, create_group, get_group, add_group_members, remove_group_member, get_group_members, get_user_groups, add_sender_keys, get_sender_keys, get_pool_status, get_archive_status, unit_of_work, after_commit, HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE
+from common import format_message, generate_chatid, message_chatid, group_chatid, is_group_chatid, decode_group_chatid, to_bytes, wire_message
+from session_cache import SessionCache
+from delivery import Presence, DeliveryQueue
+from exchange_index import ExchangeIndex, ChatMembership, chat_members, is_member
+from recent_messages import RecentMessageCache
+from message_writer import MessageWriter
+from message_bus import create_manager, on_worker_event
+from workers import route_session_ids
+from metrics import registry, profiler, instrument_event, EVENT_ERRORS, EMIT_FANOUT, THROTTLED_EVENTS, SLOW_CONSUMER_DISCONNECTS
+from structured_log import pipeline, get_logger, fields
+from event_limits import EventRateLimiter, SlowConsumerMonitor
+from attachments import AttachmentStore, AttachmentError, UploadNotFound, IncompleteUpload, QuotaExceeded
+from password_hashing import PasswordHasher, AttemptThrottle, HashingOverloaded, Throttled
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_socketio import SocketIO, emit, disconnect, join_room
-import traceback
+import logging
+import functools
 import time
+import atexit
 app = flask.Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY')
 CORS(app, origins=["http://localhost:3000"], supports_credentials=True)
-socketio = SocketIO(app, cors_allowed_origins="http://localhost:3000", cors_credentials=True)
+MESSAGE_BUS = os.getenv('MESSAGE_BUS')
+# msgpack carries bytes natively, so every client on a msgpack server gets the binary wire format
+SOCKETIO_SERIALIZER = os.getenv('SOCKETIO_SERIALIZER', 'default')
+socketio = SocketIO(app, cors_allowed_origins="http://localhost:3000", cors_credentials=True, client_manager=create_manager(MESSAGE_BUS) if MESSAGE_BUS else None, serializer=SOCKETIO_SERIALIZER)
+if os.getenv('VSC_WORKER'):
+    route_session_ids(socketio.server.eio, int(os.getenv('VSC_WORKER')))
+    # behind the sticky proxy every request comes from 127.0.0.1; it passes the client on in X-Forwarded-For
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1)
+binary_clients = set()
 
 api = flask.Blueprint('api', __name__)
+api_logger = get_logger('api')
+send_logger = get_logger('send_message')
+password_hasher = PasswordHasher(
+    workers=int(os.getenv('HASH_WORKERS', 2)),
+    max_pending=int(os.getenv('HASH_MAX_PENDING', 32)),
+    rounds=int(os.getenv('BCRYPT_ROUNDS', 12))
+).start()
+atexit.register(password_hasher.stop)
+ip_throttle = AttemptThrottle(int(os.getenv('AUTH_IP_ATTEMPTS', 30)), float(os.getenv('AUTH_IP_WINDOW', 60)))
+username_throttle = AttemptThrottle(int(os.getenv('AUTH_USERNAME_ATTEMPTS', 10)), float(os.getenv('AUTH_USERNAME_WINDOW', 300)))
+
+MESSAGE_WRITE_MODE = os.getenv('MESSAGE_WRITE_MODE', 'direct')
+message_writer = None
+if MESSAGE_WRITE_MODE in ('write_behind', 'write_behind_durable'):
+    message_writer = MessageWriter(
+        add_messages,
+        max_batch=int(os.getenv('MESSAGE_WRITE_BATCH', 256)),
+        flush_interval=float(os.getenv('MESSAGE_WRITE_INTERVAL', 0.005)),
+        max_queue=int(os.getenv('MESSAGE_WRITE_QUEUE', 10000)),
+        durable=MESSAGE_WRITE_MODE == 'write_behind_durable'
+    )
+    message_writer.start()
+    atexit.register(message_writer.stop)
+session_cache = SessionCache(session_check, max_size=int(os.getenv('SESSION_CACHE_SIZE', 10000)), ttl=float(os.getenv('SESSION_CACHE_TTL', 60)))
+# each worker only sees its own writes, so with a message bus the cache is opt-in
+recent_messages = None
+RECENT_CACHE_MB = float(os.getenv('RECENT_CACHE_MB', 0 if MESSAGE_BUS else 64))
+if RECENT_CACHE_MB > 0:
+    recent_messages = RecentMessageCache(get_messages_page, capacity=int(os.getenv('RECENT_CACHE_CHAT_SIZE', 100)), max_bytes=int(RECENT_CACHE_MB * 1024 * 1024))
+# other workers' exchange writes are invisible here, so with a message bus only accepted rows are trusted
+exchange_index = ExchangeIndex(get_user_key_exchanges, get_key_exchange, max_users=int(os.getenv('EXCHANGE_INDEX_USERS', 50000)), authoritative=not MESSAGE_BUS)
+# group membership changes on other workers only reach this cache once its entries expire
+membership = ChatMembership(get_group_members, max_groups=int(os.getenv('GROUP_CACHE_SIZE', 10000)), ttl=float(os.getenv('GROUP_MEMBERS_TTL', 5)) if MESSAGE_BUS else None)
+GROUP_MAX_MEMBERS = int(os.getenv('GROUP_MAX_MEMBERS', 1000))
+LEAVE_CHAT_EVENT = 'vsc:leave_chat'
+def load_pending(user_id, limit):
+    messages, more = get_pending_deliveries(user_id, limit)
+    return [format_message(m) for m in messages], more
+
+presence = Presence()
+# with a message bus the recipient may be connected to another worker, so every queued
+# message goes to storage where whichever worker they reconnect to can flush it
+delivery_queue = DeliveryQueue(
+    add_pending_deliveries,
+    load_pending,
+    delete_pending_deliveries,
+    delete_pending_deliveries_through,
+    expire_pending_deliveries,
+    max_per_user=0 if MESSAGE_BUS else int(os.getenv('PENDING_PER_USER', 500)),
+    max_total=int(os.getenv('PENDING_TOTAL', 100000)),
+    max_stored_per_user=int(os.getenv('PENDING_STORED_PER_USER', 1000)),
+    ttl=float(os.getenv('PENDING_TTL', 7 * 86400)),
+    shared=bool(MESSAGE_BUS)
+)
+PENDING_FLUSH_LIMIT = int(os.getenv('PENDING_FLUSH_LIMIT', HISTORY_MAX_PAGE_SIZE))
+# history and key exchange reads cost more than a message because they hit storage harder
+EVENT_COSTS = {
+    'send_message': 1,
+    'mark_read': 0.5,
+    'ack_messages': 0.5,
+    'get_history': 5,
+    'connect_chat': 5,
+    'connected_chats': 5,
+    'key_exchange_requests': 2,
+    'key_exchange_request': 3,
+    'key_exchange_success': 3,
+    'create_group': 10,
+    'add_group_members': 5,
+    'remove_group_member': 5,
+    'group_sender_key': 5,
+    'get_sender_keys': 2
+}
+EVENT_RATE = float(os.getenv('EVENT_RATE', 20))
+event_limiter = EventRateLimiter(EVENT_RATE, float(os.getenv('EVENT_BURST', 40)), EVENT_COSTS) if EVENT_RATE > 0 else None
+slow_consumers = SlowConsumerMonitor(socketio.server.eio, max_queue=int(os.getenv('SLOW_CONSUMER_QUEUE', 1000)), on_disconnect=SLOW_CONSUMER_DISCONNECTS.inc)
+if slow_consumers.max_queue > 0:
+    socketio.start_background_task(slow_consumers.run, socketio.sleep)
+CATCH_UP_MAX_CHATS = int(os.getenv('CATCH_UP_MAX_CHATS', 500))
+
+def component_metrics():
+    for prefix, stats in (
+        ("vsc_session_cache", session_cache.stats()),
+        ("vsc_exchange_index", exchange_index.stats()),
+        ("vsc_membership", membership.stats()),
+        ("vsc_presence", presence.stats()),
+        ("vsc_event_limiter", event_limiter.stats() if event_limiter else {}),
+        ("vsc_slow_consumers", slow_consumers.stats()),
+        ("vsc_delivery_queue", delivery_queue.stats()),
+        ("vsc_password_hashing", password_hasher.stats()),
+        ("vsc_message_writer", message_writer.stats() if message_writer else {}),
+        ("vsc_recent_messages", recent_messages.stats() if recent_messages else {}),
+        ("vsc_attachments", attachment_store.stats()),
+        ("vsc_db_pool", get_pool_status() or {})
+    ):
+        for key, value in stats.items():
+            if isinstance(value, (int, float)):
+                yield f"{prefix}_{key}", float(value)
+
+registry.add_collector(component_metrics)
+PROFILER_ENABLED = os.getenv('PROFILER_ENABLED') == '1'
+# attachment bytes live on disk, never in MySQL
+attachment_store = AttachmentStore(
+    os.getenv('ATTACHMENT_DIR', 'attachments'),
+    max_size=int(os.getenv('ATTACHMENT_MAX_BYTES', 100 * 1024 * 1024)),
+    max_chunk_size=int(os.getenv('ATTACHMENT_MAX_CHUNK', 4 * 1024 * 1024)),
+    daily_quota=int(os.getenv('ATTACHMENT_DAILY_QUOTA', 1024 * 1024 * 1024))
+)
+# Werkzeug's file wrapper copies every download through Python 8 KiB at a time, so in
+# production run behind nginx or apache with USE_X_SENDFILE=1 and let the proxy send the file
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE') == '1'
+
+def overloaded_response():
+    resp = flask.make_response(flask.jsonify({"success": False, "message": "Server busy, please try again later"}), 503)
+    resp.headers['Retry-After'] = '1'
+    return resp
+
+def throttled_response(e):
+    resp = flask.make_response(flask.jsonify({"success": False, "message": "Too many attempts, please try again later"}), 429)
+    resp.headers['Retry-After'] = str(max(1, int(e.retry_after + 0.5)))
+    return resp
 
 @api.route('/signup', methods=['POST'])
 def signup():
@@ -20,15 +164,20 @@ def signup():
         data = flask.request.json
         username = data['username']
         password = data['password']
+        ip_throttle.hit(flask.request.remote_addr)
         session_id = uuid.uuid4().hex
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=12)).decode('utf-8')
+        hashed_password = password_hasher.hash(password)
         add_user(username, hashed_password, session_id)
 
         resp = flask.make_response(flask.jsonify({'success': True, 'message': 'User created successfully', 'session_id': session_id}), 200)
         resp.set_cookie('session_id', session_id, httponly=True, secure=False, samesite='None')
         return resp
+    except Throttled as e:
+        return throttled_response(e)
+    except HashingOverloaded:
+        return overloaded_response()
     except Exception as e:
-        print(f"Signup error: {e}")
+        api_logger.error("Signup error", extra=fields(error=str(e)))
         return flask.jsonify({'success': False, 'message': 'Signup failed'}), 401
 
 @api.route('/login', methods=['POST'])
@@ -37,11 +186,19 @@ def login():
     username = data['username']
     password = data['password']
     try:
+        ip_throttle.hit(flask.request.remote_addr)
+        username_throttle.hit(username)
         user_info = get_user(username)
         if user_info:
             password_hash = user_info[2]
-            password_check = bcrypt.checkpw(password.encode("utf-8"), password_hash.encode("utf-8"))
+            password_check = password_hasher.verify(password, password_hash)
             if password_check:
+                username_throttle.reset(username)
+                if password_hasher.needs_rehash(password_hash):
+                    try:
+                        update_password(user_info[0], password_hasher.hash(password))
+                    except HashingOverloaded:
+                        pass
                 resp = flask.make_response(flask.jsonify({"success": True, "message": "Login successful", "session_id": user_info[3]}), 200)
                 resp.set_cookie('session_id', user_info[3], httponly=True, secure=False, samesite='None')
                 
@@ -50,8 +207,12 @@ def login():
                 return flask.jsonify({"success": False, "message": "Wrong Password"}), 401
         else:
             return flask.jsonify({"success": False, "message": "User not found"}), 401
+    except Throttled as e:
+        return throttled_response(e)
+    except HashingOverloaded:
+        return overloaded_response()
     except Exception as e:
-        print(f"Login error: {e}")
+        api_logger.error("Login error", extra=fields(error=str(e)))
         return flask.jsonify({"success": False, "message": "Error occurred, please try again later"}), 500
 
 @api.route("/check_username", methods=['POST'])
@@ -65,7 +226,7 @@ def check_username():
         else:
             return flask.jsonify({"success": True, "message": "Username is available"}), 200
     except Exception as e:
-        print(f"Check username error: {e}")
+        api_logger.error("Check username error", extra=fields(error=str(e)))
         return flask.jsonify({"success": False, "message": "Error occurred, please try again later"}), 500
     
 @api.route("/username_to_id", methods=['POST'])
@@ -79,62 +240,420 @@ def username_to_id():
         else:
             return flask.jsonify({"success": False, "message": "User not found"}), 404
     except Exception as e:
-        print(f"Username to ID error: {e}")
+        api_logger.error("Username to ID error", extra=fields(error=str(e)))
         return flask.jsonify({"success": False, "message": "Error occurred, please try again later"}), 500
 
 @api.route("/authenticate", methods=['GET'])
 def authenticate():
     try:
-        user = session_check(flask.request.cookies['session_id'])
+        user = session_cache.get(flask.request.cookies['session_id'])
         if user:
             return flask.jsonify({"success": True, "message": "Authentication successful", "data": {"User_id": user[0], "Username": user[1]}}), 200
         else:
             return flask.jsonify({"success": False, "message": "Authentication Failed"}), 401
     except Exception as e:
-        print(f"Authentication error: {e}")
+        api_logger.error("Authentication error", extra=fields(error=str(e)))
         return flask.jsonify({"success": False, "message": "Error occurred, please try again later"}), 500
     
+@api.route("/logout", methods=['POST'])
+def logout():
+    try:
+        session_id = flask.request.cookies.get('session_id')
+        user = session_cache.get(session_id) if session_id else None
+        if not user:
+            return flask.jsonify({"success": False, "message": "Authentication Failed"}), 401
+        rotate_session(user[0], uuid.uuid4().hex)
+        session_cache.invalidate_user(user[0])
+        resp = flask.make_response(flask.jsonify({"success": True, "message": "Logout successful"}), 200)
+        resp.delete_cookie('session_id', samesite='None')
+        return resp
+    except Exception as e:
+        api_logger.error("Logout error", extra=fields(error=str(e)))
+        return flask.jsonify({"success": False, "message": "Error occurred, please try again later"}), 500
+
+def request_user_id():
+    session_id = flask.request.cookies.get('session_id')
+    user = session_cache.get(session_id) if session_id else None
+    return user[0] if user else None
+
+def attachment_error_response(e):
+    if isinstance(e, UploadNotFound):
+        return flask.jsonify({"success": False, "message": "Upload not found"}), 404
+    if isinstance(e, IncompleteUpload):
+        return flask.jsonify({"success": False, "message": str(e)}), 409
+    if isinstance(e, QuotaExceeded):
+        return flask.jsonify({"success": False, "message": str(e)}), 429
+    return flask.jsonify({"success": False, "message": str(e)}), 400
+
+@api.route("/attachments", methods=['POST'])
+def create_attachment():
+    try:
+        user_id = request_user_id()
+        if user_id is None:
+            return flask.jsonify({"success": False, "message": "Authentication Failed"}), 401
+        data = flask.request.get_json(silent=True) or {}
+        upload = attachment_store.create(user_id, data.get('size'), data.get('chunk_size'), data.get('sha256'))
+        return flask.jsonify({"success": True, "data": upload}), 201
+    except AttachmentError as e:
+        return attachment_error_response(e)
+    except Exception as e:
+        api_logger.error("Create attachment error", extra=fields(error=str(e)))
+        return flask.jsonify({"success": False, "message": "Error occurred, please try again later"}), 500
+
+@api.route("/attachments/uploads/<upload_id>", methods=['GET'])
+def attachment_upload_status(upload_id):
+    try:
+        user_id = request_user_id()
+        if user_id is None:
+            return flask.jsonify({"success": False, "message": "Authentication Failed"}), 401
+        return flask.jsonify({"success": True, "data": attachment_store.status(user_id, upload_id)}), 200
+    except AttachmentError as e:
+        return attachment_error_response(e)
+    except Exception as e:
+        api_logger.error("Attachment status error", extra=fields(error=str(e)))
+        return flask.jsonify({"success": False, "message": "Error occurred, please try again later"}), 500
+
+@api.route("/attachments/uploads/<upload_id>/chunks/<int:index>", methods=['PUT'])
+def upload_attachment_chunk(upload_id, index):
+    try:
+        user_id = request_user_id()
+        if user_id is None:
+            return flask.jsonify({"success": False, "message": "Authentication Failed"}), 401
+        attachment_store.write_chunk(user_id, upload_id, index, flask.request.stream, flask.request.content_length)
+        return flask.jsonify({"success": True}), 200
+    except AttachmentError as e:
+        return attachment_error_response(e)
+    except Exception as e:
+        api_logger.error("Attachment chunk error", extra=fields(error=str(e)))
+        return flask.jsonify({"success": False, "message": "Error occurred, please try again later"}), 500
+
+@api.route("/attachments/uploads/<upload_id>/proof", methods=['POST'])
+def prove_attachment(upload_id):
+    try:
+        user_id = request_user_id()
+        if user_id is None:
+            return flask.jsonify({"success": False, "message": "Authentication Failed"}), 401
+        data = flask.request.get_json(silent=True) or {}
+        return flask.jsonify({"success": True, "data": attachment_store.prove(user_id, upload_id, data.get('proof'))}), 200
+    except AttachmentError as e:
+        return attachment_error_response(e)
+    except Exception as e:
+        api_logger.error("Attachment proof error", extra=fields(error=str(e)))
+        return flask.jsonify({"success": False, "message": "Error occurred, please try again later"}), 500
+
+@api.route("/attachments/uploads/<upload_id>/complete", methods=['POST'])
+def complete_attachment(upload_id):
+    try:
+        user_id = request_user_id()
+        if user_id is None:
+            return flask.jsonify({"success": False, "message": "Authentication Failed"}), 401
+        return flask.jsonify({"success": True, "data": attachment_store.complete(user_id, upload_id)}), 200
+    except AttachmentError as e:
+        return attachment_error_response(e)
+    except Exception as e:
+        api_logger.error("Complete attachment error", extra=fields(error=str(e)))
+        return flask.jsonify({"success": False, "message": "Error occurred, please try again later"}), 500
+
+@api.route("/attachments/<attachment_id>", methods=['GET'])
+def download_attachment(attachment_id):
+    if request_user_id() is None:
+        return flask.jsonify({"success": False, "message": "Authentication Failed"}), 401
+    path = attachment_store.object_path(attachment_id)
+    if path is None:
+        return flask.jsonify({"success": False, "message": "Attachment not found"}), 404
+    # content addressed, so the id is a strong etag and the bytes never change; send_file
+    # answers Range requests, and with USE_X_SENDFILE only sets the header for the proxy
+    return flask.send_file(path, mimetype='application/octet-stream', conditional=True, etag=attachment_id, max_age=31536000)
+
+@api.route("/metrics", methods=['GET'])
+def metrics_endpoint():
+    return flask.Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+@api.route("/profiler", methods=['GET', 'POST', 'DELETE'])
+def profiler_endpoint():
+    if not PROFILER_ENABLED:
+        return flask.jsonify({"success": False, "message": "Profiler disabled"}), 404
+    if flask.request.method == 'POST':
+        profiler.reset()
+        profiler.start()
+        return flask.jsonify({"success": True, "message": "Profiler started"}), 200
+    if flask.request.method == 'DELETE':
+        profiler.stop()
+        return flask.jsonify({"success": True, "message": "Profiler stopped"}), 200
+    return flask.Response(profiler.collapsed(), mimetype="text/plain")
+
+@api.route("/status", methods=['GET'])
+def status():
+    return flask.jsonify({
+        "pool": get_pool_status(),
+        "archive": get_archive_status(),
+        "session_cache": session_cache.stats(),
+        "password_hashing": password_hasher.stats(),
+        "message_writer": message_writer.stats() if message_writer else None,
+        "recent_messages": recent_messages.stats() if recent_messages else None,
+        "presence": presence.stats(),
+        "delivery_queue": delivery_queue.stats(),
+        "logging": pipeline.stats(),
+        "attachments": attachment_store.stats()
+    }), 200
+
 # -- websocket --
 def authenticate_check():
     session_id = flask.request.cookies.get('session_id')
     if not session_id:
         disconnect()
         return None
-    user_data = session_check(session_id)
+    user_data = session_cache.get(session_id)
     if user_data:
         return user_data[0]
     disconnect()
     return None
 
+def rate_limited(event):
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            if event_limiter is None:
+                return handler(*args, **kwargs)
+            retry_after, violations = event_limiter.take(flask.request.sid, event)
+            if not retry_after:
+                return handler(*args, **kwargs)
+            THROTTLED_EVENTS.inc(event)
+            if violations >= event_limiter.max_violations:
+                get_logger(event).warning("Disconnecting throttled socket", extra=fields(sid=flask.request.sid, violations=violations))
+                disconnect()
+                return
+            emit('rate_limited', {"event": event, "retry_after": retry_after})
+        return wrapper
+    return decorator
+
+def report_error(event, error):
+    EVENT_ERRORS.inc(event)
+    logger = get_logger(event)
+    # tracebacks only when the event is logged at DEBUG; the error text is enough to alert on
+    logger.error("Event error", exc_info=error if logger.isEnabledFor(logging.DEBUG) else None, extra=fields(error=str(error)))
+
+def room_size(room):
+    return len(socketio.server.manager.rooms.get('/', {}).get(room, ()))
+
+def emit_event(event, data, room=None):
+    EMIT_FANOUT.observe(event, value=room_size(room) if room else 1)
+    if room:
+        emit(event, data, room=room)
+    else:
+        emit(event, data)
+
+def is_binary_client():
+    return flask.request.sid in binary_clients
+
+def chat_room(chat_id, binary):
+    return f"chat_{chat_id}:bin" if binary else f"chat_{chat_id}"
+
+def user_room(user_id, binary):
+    """Per user room split by wire format, for payloads that carry raw bytes"""
+    return f"user_{user_id}:bin" if binary else f"user_{user_id}:text"
+
+def wire_page(page):
+    binary = is_binary_client()
+    page["messages"] = [wire_message(m, binary) for m in page["messages"]]
+    return page
+
+def catch_up_page(chat_id, since_id=None, since_ts=None, limit=HISTORY_MAX_PAGE_SIZE):
+    if recent_messages and since_id is not None:
+        cached = recent_messages.get_since(chat_id, since_id, limit)
+        if cached is not None:
+            records, more = cached
+            return {"chat_id": chat_id, "messages": [r.to_dict() for r in records], "more": more}
+    messages, more = get_messages_since(chat_id, since_id, since_ts, limit)
+    return {"chat_id": chat_id, "messages": [format_message(m) for m in messages], "more": more}
+
+def acknowledge_seen(user_id, chats):
+    """Clears queued deliveries the client has now seen; chats maps chat_id -> newest id it has"""
+    # group messages are never queued
+    cursors = {chat_id: int(message_id) for chat_id, message_id in chats.items() if message_id and not is_group_chatid(chat_id)}
+    if cursors:
+        delivery_queue.ack_through(user_id, cursors)
+
+def newest_id(page, since_id=None):
+    ids = [message["id"] for message in page["messages"]]
+    if since_id is not None:
+        ids.append(int(since_id))
+    return max(ids, default=None)
+
+def catch_up(user_id, since):
+    """One page of missed messages for every chat in since (chat_id -> last seen id) the user belongs to"""
+    since = {chat_id: since_id for chat_id, since_id in list(since.items())[:CATCH_UP_MAX_CHATS] if membership.is_member(user_id, chat_id)}
+    seen = dict(since)
+    chats = []
+    if recent_messages:
+        for chat_id, since_id in list(since.items()):
+            cached = recent_messages.get_since(chat_id, since_id, HISTORY_MAX_PAGE_SIZE)
+            if cached is None:
+                continue
+            del since[chat_id]
+            records, more = cached
+            if records:
+                chats.append({"chat_id": chat_id, "messages": [r.to_dict() for r in records], "more": more})
+    for chat_id, (messages, more) in get_messages_since_many(since).items():
+        if messages:
+            chats.append({"chat_id": chat_id, "messages": [format_message(m) for m in messages], "more": more})
+    for chat in chats:
+        seen[chat["chat_id"]] = newest_id(chat, seen[chat["chat_id"]])
+    acknowledge_seen(user_id, seen)
+    return chats
+
+def history_page(user_id, chat_id, data):
+    if data.get('since_id') is not None or data.get('since_ts') is not None:
+        page = catch_up_page(chat_id, data.get('since_id'), data.get('since_ts'), data.get('limit', HISTORY_MAX_PAGE_SIZE))
+        acknowledge_seen(user_id, {chat_id: newest_id(page, data.get('since_id'))})
+        return page
+    before_id = data.get('before_id')
+    limit = data.get('limit', HISTORY_PAGE_SIZE)
+    if recent_messages:
+        records, next_cursor = recent_messages.get_page(chat_id, before_id, limit)
+        page = {"chat_id": chat_id, "messages": [r.to_dict() for r in records], "next_cursor": next_cursor}
+    else:
+        messages, next_cursor = get_messages_page(chat_id, before_id, limit)
+        page = {"chat_id": chat_id, "messages": [format_message(m) for m in messages], "next_cursor": next_cursor}
+    if before_id is None:
+        # the newest page is what clients without pending_messages support load when a chat opens
+        acknowledge_seen(user_id, {chat_id: newest_id(page)})
+    return page
+
+def store_message(message_data):
+    if message_writer:
+        message_writer.submit(message_data)
+        if recent_messages:
+            # the id is only known once the batch is flushed
+            recent_messages.invalidate(message_chatid(message_data))
+        return None
+    return add_message(message_data)
+
+def deliver_message(chat_id, message_data, group):
+    """Caches, queues and emits a stored message; runs after its unit of work commits"""
+    message_id = message_data.get('id')
+    if message_id is not None:
+        if recent_messages:
+            recent_messages.add(message_id, message_data)
+        if not group and not presence.is_online(message_data['receiver']):
+            delivery_queue.enqueue(message_data['receiver'], {**message_data, 'chat_id': chat_id})
+    emit_event('new_message', wire_message(message_data, False), room=chat_room(chat_id, False))
+    emit_event('new_message', message_data, room=chat_room(chat_id, True))
+    send_logger.debug("Message sent", extra=fields(chat_id=chat_id, message_id=message_id, size=len(message_data['ciphertext'])))
+
+def flush_pending(user_id):
+    messages, more = delivery_queue.pending(user_id, PENDING_FLUSH_LIMIT)
+    if messages:
+        binary = is_binary_client()
+        emit_event('pending_messages', {"messages": [wire_message(m, binary) for m in messages], "more": more})
+
+def group_info(group):
+    return {"chat_id": group_chatid(group[0]), "name": group[1], "owner_id": group[2], "unread_messages": group[3], "last_read_id": group[4]}
+
+def member_ids(values):
+    if not isinstance(values, list) or len(values) > GROUP_MAX_MEMBERS:
+        raise ValueError("member_ids must be a list of at most GROUP_MAX_MEMBERS user ids")
+    return {int(value) for value in values}
+
+def non_contacts(user_id, members):
+    """Members the user has no accepted key exchange with; sender keys can only reach contacts, and this rules out unknown ids"""
+    rejected = set()
+    for member in members:
+        exchange = exchange_index.get(user_id, generate_chatid(user_id, member))
+        if exchange is None or not exchange[5]:
+            rejected.add(member)
+    return rejected
+
+def refresh_members(group_id):
+    """Members as this unit of work sees them; the shared cache only takes them once committed"""
+    members = frozenset(get_group_members(group_id))
+    after_commit(lambda: membership.set(group_id, members))
+    return members
+
+def join_user_sockets(user_id, chat_id):
+    """Puts the user's sockets on this worker into the chat rooms; other workers' sockets join on group_added"""
+    for sid in presence.sids(user_id):
+        join_room(chat_room(chat_id, sid in binary_clients), sid=sid, namespace='/')
+
+def leave_local_sockets(data):
+    for sid in presence.sids(data['user_id']):
+        for binary in (False, True):
+            socketio.server.leave_room(sid, chat_room(data['chat_id'], binary), namespace='/')
+
+def leave_user_sockets(user_id, chat_id):
+    """Takes the user's sockets out of the chat rooms on every worker, so a removed member stops receiving"""
+    if MESSAGE_BUS:
+        socketio.server.emit(LEAVE_CHAT_EVENT, {"user_id": user_id, "chat_id": chat_id}, namespace='/')
+    else:
+        leave_local_sockets({"user_id": user_id, "chat_id": chat_id})
+
+if MESSAGE_BUS:
+    on_worker_event(socketio.server.manager, LEAVE_CHAT_EVENT, leave_local_sockets)
+
+def wire_sender_keys(keys, binary):
+    if binary:
+        return keys
+    return [{**key, "ciphertext": base64.b64encode(key["ciphertext"]).decode("ascii"), "iv": base64.b64encode(key["iv"]).decode("ascii")} for key in keys]
+
 @socketio.on('connect')
-def handle_connect():
+@instrument_event('connect')
+@unit_of_work('connect')
+def handle_connect(auth=None):
     user_id = authenticate_check()
     if user_id is None:
         return
     
     try:
+        if SOCKETIO_SERIALIZER == 'msgpack' or (isinstance(auth, dict) and auth.get('binary')):
+            binary_clients.add(flask.request.sid)
         join_room(f"user_{user_id}")
+        join_room(user_room(user_id, is_binary_client()))
         key_exchanges = get_key_exchanges(user_id)
-        emit('key_exchange_requests', key_exchanges, room=f"user_{user_id}")
+        emit_event('key_exchange_requests', key_exchanges, room=f"user_{user_id}")
+        since = auth.get('since') if isinstance(auth, dict) else None
+        if isinstance(since, dict) and since:
+            emit_event('catch_up', {"chats": [wire_page(chat) for chat in catch_up(user_id, since)]})
+        presence.connected(user_id, flask.request.sid)
+        flush_pending(user_id)
     except Exception as e:
-        print(f"Connect error: {e}")
+        report_error('connect', e)
         disconnect()
 
+@socketio.on('disconnect')
+@instrument_event('disconnect')
+def handle_disconnect(reason=None):
+    binary_clients.discard(flask.request.sid)
+    presence.disconnected(flask.request.sid)
+    if event_limiter:
+        event_limiter.forget(flask.request.sid)
+
 @socketio.on('connected_chats')
+@instrument_event('connected_chats')
+@rate_limited('connected_chats')
+@unit_of_work('connected_chats')
 def handle_connected_chats():
     user_id = authenticate_check()
     if user_id is None:
         return
     
     try:
-        key_exchanges = get_accepted_key_exchanges(user_id)
-        for key_exchange in key_exchanges:
-            join_room(f"chat_{key_exchange[3]}")
-        emit('connected_chats', {'chats': [{"reciever_id": int(key_exchange[1]), "sender_id": int(key_exchange[2]), "chat_id": key_exchange[3], "unread_messages": len(get_messages(key_exchange[2])), "reciever_username": get_username(key_exchange[1]), "sender_username": get_username(key_exchange[2])} for key_exchange in key_exchanges]}, room=f"user_{user_id}")
+        chats = get_chat_list(user_id)
+        for chat in chats:
+            join_room(chat_room(chat[2], is_binary_client()))
+        groups = get_user_groups(user_id)
+        for group in groups:
+            join_room(chat_room(group_chatid(group[0]), is_binary_client()))
+        emit_event('connected_chats', {
+            'chats': [{"reciever_id": int(chat[0]), "sender_id": int(chat[1]), "chat_id": chat[2], "unread_messages": chat[5], "last_read_id": chat[6], "reciever_username": chat[3], "sender_username": chat[4]} for chat in chats],
+            'groups': [group_info(group) for group in groups]
+        }, room=f"user_{user_id}")
     except Exception as e:
-        print(f"Connected chats error: {e}")
+        report_error('connected_chats', e)
 
 @socketio.on('connect_chat')
+@instrument_event('connect_chat')
+@rate_limited('connect_chat')
+@unit_of_work('connect_chat')
 def handle_connect_chat(data):
     user_id = authenticate_check()
     if user_id is None:
@@ -146,26 +665,30 @@ def handle_connect_chat(data):
         return
         
     try:
-        chat_users = decode_chatid(chat_id)
-        if user_id not in chat_users:
+        if not membership.is_member(user_id, chat_id):
             disconnect()
             return
 
-        messages = get_messages(chat_id)
-        join_room(f"chat_{chat_id}")
-        emit('message_history', messages, room=f"chat_{chat_id}")
+        join_room(chat_room(chat_id, is_binary_client()))
+        emit_event('message_history', wire_page(history_page(user_id, chat_id, data)))
     except Exception as e:
-        print(f"Connect chat error: {e}")
+        report_error('connect_chat', e)
         disconnect()
 @socketio.on('key_exchange_requests')
+@instrument_event('key_exchange_requests')
+@rate_limited('key_exchange_requests')
+@unit_of_work('key_exchange_requests')
 def handle_key_exchange_requests():
     user_id = authenticate_check()
     if user_id is None:
         return
     key_exchanges = get_key_exchanges(user_id)
-    emit('key_exchange_requests', key_exchanges, room=f"user_{user_id}")
+    emit_event('key_exchange_requests', key_exchanges, room=f"user_{user_id}")
 
 @socketio.on('key_exchange_success')
+@instrument_event('key_exchange_success')
+@rate_limited('key_exchange_success')
+@unit_of_work('key_exchange_success')
 def handle_key_exchange_success(data):
     user_id = authenticate_check()
     if user_id is None:
@@ -178,22 +701,35 @@ def handle_key_exchange_success(data):
         if not chat_id or not public_key:
             return
         
-        existing_exchanges = get_accepted_key_exchanges(user_id)
-        for exchange in existing_exchanges:
-            if exchange[3] == chat_id:
-                print(f"Key exchange already accepted for chat_id: {chat_id}, ignoring")
-                return
+        if not is_member(user_id, chat_id):
+            disconnect()
+            return
+
+        exchange = exchange_index.get(user_id, chat_id)
+        if exchange is None or exchange[1] != user_id:
+            return
+        if exchange[5]:
+            get_logger('key_exchange_success').info("Key exchange already accepted, ignoring", extra=fields(chat_id=chat_id))
+            return
             
         accept_key_exchange(user_id, chat_id)
-        emit('key_exchange_success', {
-            'sender_id': user_id,
-            'chat_id': chat_id,
-            'public_key': public_key
-        }, room=f"chat_{chat_id}")
+
+        def accepted():
+            exchange_index.accepted(chat_id)
+            for binary in (False, True):
+                emit_event('key_exchange_success', {
+                    'sender_id': user_id,
+                    'chat_id': chat_id,
+                    'public_key': public_key
+                }, room=chat_room(chat_id, binary))
+        after_commit(accepted)
     except Exception as e:
-        print(f"Key exchange success error: {e}")
+        report_error('key_exchange_success', e)
 
 @socketio.on('key_exchange_request')
+@instrument_event('key_exchange_request')
+@rate_limited('key_exchange_request')
+@unit_of_work('key_exchange_request')
 def handle_key_exchange_request(data):
     user_id = authenticate_check()
     if user_id is None:
@@ -204,32 +740,36 @@ def handle_key_exchange_request(data):
         chat_id = data.get('chat_id')
         public_key = data.get('public_key')
         
-        if get_key_exchange(chat_id):
-            print(f"Key exchange already exists for chat_id: {chat_id}, ignoring request")
-            return
-            
         if not all([reciever_id, chat_id, public_key]):
             return
             
-        chat_users = decode_chatid(chat_id)
-        if user_id not in chat_users:
+        if reciever_id == user_id or chat_members(chat_id) != {user_id, reciever_id}:
             disconnect()
             return
+
+        if exchange_index.get(user_id, chat_id):
+            get_logger('key_exchange_request').info("Key exchange already exists, ignoring request", extra=fields(chat_id=chat_id))
+            return
             
         add_key_exchange(reciever_id, user_id, chat_id, public_key)
-        
-        join_room(f"chat_{chat_id}")
 
-        emit('new_key_exchange_request', {
-            'sender_id': user_id,
-            'chat_id': chat_id,
-            'public_key': public_key
-        }, room=f"user_{reciever_id}")
+        def added():
+            exchange_index.added(reciever_id, user_id, chat_id, public_key)
+            join_room(chat_room(chat_id, is_binary_client()))
+            emit_event('new_key_exchange_request', {
+                'sender_id': user_id,
+                'chat_id': chat_id,
+                'public_key': public_key
+            }, room=f"user_{reciever_id}")
+        after_commit(added)
         
     except Exception as e:
-        print(f"Key exchange request error: {e}")
+        report_error('key_exchange_request', e)
 
 @socketio.on('get_history')
+@instrument_event('get_history')
+@rate_limited('get_history')
+@unit_of_work('get_history')
 def handle_get_history(data):
     user_id = authenticate_check()
     if user_id is None:
@@ -240,17 +780,18 @@ def handle_get_history(data):
         if not chat_id:
             return
             
-        chat_users = decode_chatid(chat_id)
-        if user_id not in chat_users:
+        if not membership.is_member(user_id, chat_id):
             disconnect()
             return
 
-        messages = get_messages(chat_id)
-        emit('message_history', {"messages": [{"sender": m[1], "receiver": m[2], "ciphertext": m[3], "iv": m[4], "chat_id": m[5], "timestamp": m[6].timestamp()} for m in messages]})
+        emit_event('message_history', wire_page(history_page(user_id, chat_id, data)))
     except Exception as e:
-        print(f"Get history error: {e}")
+        report_error('get_history', e)
 
 @socketio.on('send_message')
+@instrument_event('send_message')
+@rate_limited('send_message')
+@unit_of_work('send_message')
 def handle_send_message(data):
     user_id = authenticate_check()
     if user_id is None:
@@ -258,34 +799,257 @@ def handle_send_message(data):
         
     try:
         chat_id = data.get('chat_id')
-        print(chat_id)
         if not chat_id:
             return
             
-        chat_users = decode_chatid(chat_id)
-        if user_id not in chat_users:
+        if not membership.is_member(user_id, chat_id):
             disconnect()
             return
-        print(data)
+        group = is_group_chatid(chat_id)
         message_data = {
             'sender': data.get('sender'),
-            'receiver': data.get('receiver'),
-            'ciphertext': data.get('ciphertext'),
-            'iv': data.get('iv'),
+            # group messages are encrypted once under the sender's key and stored once for everyone
+            'receiver': None if group else data.get('receiver'),
+            'ciphertext': to_bytes(data.get('ciphertext')),
+            'iv': to_bytes(data.get('iv')),
             'timestamp': time.time(),
         }
+        if group:
+            message_data['chat_id'] = chat_id
 
-        if user_id != message_data['sender']:
+        if user_id != message_data['sender'] or (not group and chat_members(chat_id) != {message_data['sender'], message_data['receiver']}):
             disconnect()
             return
 
-        add_message(message_data)
-        emit('new_message', message_data, room=f"chat_{chat_id}")
+        message_id = store_message(message_data)
+        if message_id is not None:
+            message_data['id'] = message_id
+        after_commit(lambda: deliver_message(chat_id, message_data, group))
         
     except Exception as e:
-        print(f"Send message error: {traceback.format_exc()}")
+        report_error('send_message', e)
+
+@socketio.on('mark_read')
+@instrument_event('mark_read')
+@rate_limited('mark_read')
+@unit_of_work('mark_read')
+def handle_mark_read(data):
+    user_id = authenticate_check()
+    if user_id is None:
+        return
+
+    try:
+        chat_id = data.get('chat_id') if data else None
+        message_id = data.get('message_id') if data else None
+        if not chat_id or message_id is None:
+            return
+
+        if not membership.is_member(user_id, chat_id):
+            disconnect()
+            return
+
+        last_read_id, unread = mark_read(user_id, chat_id, message_id)
+
+        def read():
+            acknowledge_seen(user_id, {chat_id: last_read_id})
+            emit_event('read_state', {'chat_id': chat_id, 'last_read_id': last_read_id, 'unread_messages': unread}, room=f"user_{user_id}")
+        after_commit(read)
+    except Exception as e:
+        report_error('mark_read', e)
+
+@socketio.on('ack_messages')
+@instrument_event('ack_messages')
+@rate_limited('ack_messages')
+@unit_of_work('ack_messages')
+def handle_ack_messages(data):
+    user_id = authenticate_check()
+    if user_id is None:
+        return
+
+    try:
+        message_ids = data.get('message_ids') if data else None
+        if not isinstance(message_ids, list) or not message_ids:
+            return
+
+        delivery_queue.ack(user_id, [int(i) for i in message_ids[:PENDING_FLUSH_LIMIT]])
+        if data.get('more'):
+            flush_pending(user_id)
+    except Exception as e:
+        report_error('ack_messages', e)
+
+@socketio.on('create_group')
+@instrument_event('create_group')
+@rate_limited('create_group')
+@unit_of_work('create_group')
+def handle_create_group(data):
+    user_id = authenticate_check()
+    if user_id is None:
+        return
+
+    try:
+        name = data.get('name') if data else None
+        if not isinstance(name, str) or not name.strip():
+            return
+        members = member_ids(data.get('member_ids', [])) - {user_id}
+        rejected = non_contacts(user_id, members)
+        if rejected:
+            emit_event('group_error', {"message": "Members must be accepted contacts", "user_ids": sorted(rejected)})
+            return
+        group_id = create_group(user_id, name.strip()[:100], members)
+        chat_id = group_chatid(group_id)
+        members = refresh_members(group_id)
+        info = {"chat_id": chat_id, "name": name.strip()[:100], "owner_id": user_id, "member_ids": sorted(members)}
+
+        def created():
+            for member in members:
+                join_user_sockets(member, chat_id)
+                emit_event('group_added', info, room=f"user_{member}")
+        after_commit(created)
+    except Exception as e:
+        report_error('create_group', e)
+
+@socketio.on('add_group_members')
+@instrument_event('add_group_members')
+@rate_limited('add_group_members')
+@unit_of_work('add_group_members')
+def handle_add_group_members(data):
+    user_id = authenticate_check()
+    if user_id is None:
+        return
+
+    try:
+        chat_id = data.get('chat_id') if data else None
+        if not is_group_chatid(chat_id):
+            return
+        group = get_group(decode_group_chatid(chat_id))
+        if group is None or group[2] != user_id:
+            return
+        added = member_ids(data.get('member_ids')) - membership.members(chat_id)
+        if not added:
+            return
+        if len(membership.members(chat_id)) + len(added) > GROUP_MAX_MEMBERS:
+            emit_event('group_error', {"chat_id": chat_id, "message": "Group is full"})
+            return
+        rejected = non_contacts(user_id, added)
+        if rejected:
+            emit_event('group_error', {"chat_id": chat_id, "message": "Members must be accepted contacts", "user_ids": sorted(rejected)})
+            return
+        add_group_members(group[0], added)
+        members = refresh_members(group[0])
+        info = {"chat_id": chat_id, "name": group[1], "owner_id": group[2], "member_ids": sorted(members)}
+
+        def joined():
+            for member in added:
+                join_user_sockets(member, chat_id)
+                emit_event('group_added', info, room=f"user_{member}")
+            # existing members hand their sender keys to the newcomers
+            for binary in (False, True):
+                emit_event('group_members', {"chat_id": chat_id, "member_ids": sorted(members), "added": sorted(added), "removed": []}, room=chat_room(chat_id, binary))
+        after_commit(joined)
+    except Exception as e:
+        report_error('add_group_members', e)
+
+@socketio.on('remove_group_member')
+@instrument_event('remove_group_member')
+@rate_limited('remove_group_member')
+@unit_of_work('remove_group_member')
+def handle_remove_group_member(data):
+    user_id = authenticate_check()
+    if user_id is None:
+        return
+
+    try:
+        chat_id = data.get('chat_id') if data else None
+        removed = data.get('user_id') if data else None
+        if not is_group_chatid(chat_id) or removed is None:
+            return
+        group = get_group(decode_group_chatid(chat_id))
+        # the owner removes anyone, everyone else can only leave
+        if group is None or (group[2] != user_id and removed != user_id) or not membership.is_member(removed, chat_id):
+            return
+        remove_group_member(group[0], removed)
+        members = refresh_members(group[0])
+
+        def left():
+            leave_user_sockets(removed, chat_id)
+            emit_event('group_removed', {"chat_id": chat_id}, room=f"user_{removed}")
+            # remaining members rotate their sender keys so the removed member cannot read what follows
+            for binary in (False, True):
+                emit_event('group_members', {"chat_id": chat_id, "member_ids": sorted(members), "added": [], "removed": [removed]}, room=chat_room(chat_id, binary))
+        after_commit(left)
+    except Exception as e:
+        report_error('remove_group_member', e)
+
+@socketio.on('group_sender_key')
+@instrument_event('group_sender_key')
+@rate_limited('group_sender_key')
+@unit_of_work('group_sender_key')
+def handle_group_sender_key(data):
+    """
+    A member's sender key, sealed separately for every other member with the pairwise
+    key from their accepted key exchange; the server only stores and relays the envelopes.
+    """
+    user_id = authenticate_check()
+    if user_id is None:
+        return
+
+    try:
+        chat_id = data.get('chat_id') if data else None
+        envelopes = data.get('envelopes') if data else None
+        if not is_group_chatid(chat_id) or not isinstance(envelopes, list):
+            return
+
+        if not membership.is_member(user_id, chat_id):
+            disconnect()
+            return
+
+        members = membership.members(chat_id)
+        key_id = int(data.get('key_id', 0))
+        sealed = [(int(e['recipient_id']), to_bytes(e['ciphertext']), to_bytes(e['iv'])) for e in envelopes[:GROUP_MAX_MEMBERS]]
+        sealed = [envelope for envelope in sealed if envelope[0] in members and envelope[0] != user_id]
+        if not sealed:
+            return
+        add_sender_keys(decode_group_chatid(chat_id), user_id, key_id, sealed)
+
+        def distributed():
+            # each envelope goes only to its recipient, so a distribution costs one envelope per member
+            for recipient_id, ciphertext, iv in sealed:
+                keys = [{"sender_id": user_id, "recipient_id": recipient_id, "key_id": key_id, "ciphertext": ciphertext, "iv": iv}]
+                for binary in (False, True):
+                    emit_event('group_sender_keys', {"chat_id": chat_id, "keys": wire_sender_keys(keys, binary)}, room=user_room(recipient_id, binary))
+        after_commit(distributed)
+    except Exception as e:
+        report_error('group_sender_key', e)
+
+@socketio.on('get_sender_keys')
+@instrument_event('get_sender_keys')
+@rate_limited('get_sender_keys')
+@unit_of_work('get_sender_keys')
+def handle_get_sender_keys(data):
+    user_id = authenticate_check()
+    if user_id is None:
+        return
+
+    try:
+        chat_id = data.get('chat_id') if data else None
+        if not is_group_chatid(chat_id):
+            return
+
+        if not membership.is_member(user_id, chat_id):
+            disconnect()
+            return
+
+        keys = [{"sender_id": row[0], "recipient_id": user_id, "key_id": row[1], "ciphertext": bytes(row[2]), "iv": bytes(row[3])} for row in get_sender_keys(decode_group_chatid(chat_id), user_id)]
+        emit_event('group_sender_keys', {"chat_id": chat_id, "keys": wire_sender_keys(keys, is_binary_client())})
+    except Exception as e:
+        report_error('get_sender_keys', e)
 
 app.register_blueprint(api, url_prefix="/api")
 
 if __name__ == "__main__":
-    socketio.run(app, debug=True)
\ No newline at end of file
+    if not app.config['USE_X_SENDFILE']:
+        get_logger('attachments').warning("Attachment downloads are copied through the worker; set USE_X_SENDFILE=1 behind nginx or apache")
+    if os.getenv('VSC_WORKER'):
+        socketio.run(app, host=os.getenv('HOST', '127.0.0.1'), port=int(os.getenv('PORT', 5000)), allow_unsafe_werkzeug=True)
+    else:
+        socketio.run(app, debug=True)
\ No newline at end of file
@@ -0,0 +1,345 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from collections import defaultdict
+from datetime import datetime
+from structured_log import get_logger, fields
+from common import message_chatid, group_chatid, HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE
+
+class MemoryStore:
+    """
+    In-memory storage engine with the same API and row shapes as database.py
+
+    Rows are tuples in the MySQL column order so handlers can't tell the two apart.
+    Every lookup the handlers make is served from a dedicated index.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.local = threading.local()
+        self.users = {}
+        self.users_by_name = {}
+        self.users_by_session = {}
+        self.messages = defaultdict(list)
+        self.key_exchanges = {}
+        self.exchanges_by_receiver = defaultdict(list)
+        self.exchanges_by_sender = defaultdict(list)
+        self.exchanges_by_chat = {}
+        self.accepted_by_user = defaultdict(set)
+        self.reads = {}
+        self.message_index = {}
+        self.pending = defaultdict(dict)
+        self.groups = {}
+        self.group_members = defaultdict(set)
+        self.groups_by_user = defaultdict(set)
+        self.sender_keys = {}
+        self.next_group_id = 1
+        self.next_user_id = 1
+        self.next_message_id = 1
+        self.next_exchange_id = 1
+
+    def database_setup(self):
+        pass
+
+    def add_user(self, username, password, session_id):
+        with self.lock:
+            if username in self.users_by_name:
+                raise ValueError(f"Duplicate username: {username}")
+            user = (self.next_user_id, username, password, session_id)
+            self.next_user_id += 1
+            self.users[user[0]] = user
+            self.users_by_name[username] = user
+            if session_id:
+                self.users_by_session[session_id] = user
+            return user[0]
+
+    def get_user(self, username):
+        return self.users_by_name.get(username)
+
+    def get_username(self, user_id):
+        user = self.users.get(int(user_id))
+        return (user[1],) if user else None
+
+    def session_check(self, session_id):
+        return self.users_by_session.get(session_id)
+
+    def rotate_session(self, user_id, session_id):
+        with self.lock:
+            old = self.users.get(int(user_id))
+            if not old:
+                return
+            user = (old[0], old[1], old[2], session_id)
+            self.users_by_session.pop(old[3], None)
+            self.users[user[0]] = user
+            self.users_by_name[user[1]] = user
+            self.users_by_session[session_id] = user
+
+    def update_password(self, user_id, password):
+        with self.lock:
+            old = self.users.get(int(user_id))
+            if not old:
+                return
+            user = (old[0], old[1], password, old[3])
+            self.users[user[0]] = user
+            self.users_by_name[user[1]] = user
+            if user[3]:
+                self.users_by_session[user[3]] = user
+
+    def add_message(self, message_data):
+        with self.lock:
+            sender = message_data.get('sender')
+            receiver = message_data.get('receiver')
+            chat_id = message_chatid(message_data)
+            timestamp = datetime.fromtimestamp(message_data.get('timestamp') or time.time())
+            message = (self.next_message_id, sender, receiver, message_data.get('ciphertext'), message_data.get('iv'), chat_id, timestamp)
+            self.next_message_id += 1
+            self.messages[chat_id].append(message)
+            self.message_index[message[0]] = message
+            if receiver is not None:
+                read = self.reads.setdefault((receiver, chat_id), [0, 0])
+                read[1] += 1
+            return message[0]
+
+    def add_messages(self, messages):
+        with self.lock:
+            for message_data in messages:
+                self.add_message(message_data)
+
+    def get_messages(self, chat_id):
+        with self.lock:
+            return list(self.messages.get(chat_id, ()))
+
+    def get_messages_page(self, chat_id, before_id=None, limit=HISTORY_PAGE_SIZE):
+        limit = max(1, min(int(limit), HISTORY_MAX_PAGE_SIZE))
+        with self.lock:
+            messages = self.messages.get(chat_id, [])
+            end = len(messages) if before_id is None else bisect.bisect_left(messages, int(before_id), key=lambda m: m[0])
+            start = max(0, end - limit)
+            page = messages[start:end]
+        next_cursor = page[0][0] if start > 0 and page else None
+        return page, next_cursor
+
+    def get_messages_since(self, chat_id, since_id=None, since_ts=None, limit=HISTORY_MAX_PAGE_SIZE):
+        limit = max(1, min(int(limit), HISTORY_MAX_PAGE_SIZE))
+        with self.lock:
+            messages = self.messages.get(chat_id, [])
+            if since_id is not None:
+                start = bisect.bisect_right(messages, int(since_id), key=lambda m: m[0])
+                newer = messages[start:start + limit + 1]
+            else:
+                since = datetime.fromtimestamp(float(since_ts))
+                newer = sorted((m for m in messages if m[6] > since), key=lambda m: (m[6], m[0]))[:limit + 1]
+        return newer[:limit], len(newer) > limit
+
+    def get_messages_since_many(self, since, limit=HISTORY_MAX_PAGE_SIZE):
+        return {chat_id: self.get_messages_since(chat_id, since_id, limit=limit) for chat_id, since_id in since.items()}
+
+    def add_pending_deliveries(self, user_id, chat_id, message_ids, keep=None):
+        with self.lock:
+            pending = self.pending[user_id]
+            for message_id in message_ids:
+                pending.setdefault(message_id, (chat_id, time.time()))
+            if keep and len(pending) > keep:
+                for message_id in sorted(pending)[:len(pending) - keep]:
+                    del pending[message_id]
+
+    def get_pending_deliveries(self, user_id, limit=HISTORY_MAX_PAGE_SIZE):
+        with self.lock:
+            message_ids = sorted(self.pending.get(user_id, ()))
+            return [self.message_index[i] for i in message_ids[:limit] if i in self.message_index], len(message_ids) > limit
+
+    def delete_pending_deliveries(self, user_id, message_ids):
+        with self.lock:
+            pending = self.pending.get(user_id)
+            if pending is not None:
+                for message_id in message_ids:
+                    pending.pop(int(message_id), None)
+                if not pending:
+                    del self.pending[user_id]
+
+    def delete_pending_deliveries_through(self, user_id, cursors):
+        with self.lock:
+            pending = self.pending.get(user_id)
+            if pending is not None:
+                for message_id, (chat_id, _) in list(pending.items()):
+                    if message_id <= int(cursors.get(chat_id, 0)):
+                        del pending[message_id]
+                if not pending:
+                    del self.pending[user_id]
+
+    def expire_pending_deliveries(self, max_age):
+        cutoff = time.time() - max_age
+        with self.lock:
+            for user_id, pending in list(self.pending.items()):
+                for message_id, (_, queued_at) in list(pending.items()):
+                    if queued_at < cutoff:
+                        del pending[message_id]
+                if not pending:
+                    del self.pending[user_id]
+
+    def get_key_exchanges(self, user_id):
+        with self.lock:
+            return [self.key_exchanges[i] for i in self.exchanges_by_receiver.get(int(user_id), ())]
+
+    def add_key_exchange(self, reciever_id, sender_id, chat_id, public_key):
+        with self.lock:
+            exchange = (self.next_exchange_id, int(reciever_id), int(sender_id), chat_id, public_key, False)
+            self.next_exchange_id += 1
+            self.key_exchanges[exchange[0]] = exchange
+            self.exchanges_by_receiver[exchange[1]].append(exchange[0])
+            self.exchanges_by_sender[exchange[2]].append(exchange[0])
+            self.exchanges_by_chat.setdefault(chat_id, exchange[0])
+
+    def accept_key_exchange(self, reciever_id, chat_id):
+        with self.lock:
+            for exchange_id in self.exchanges_by_receiver.get(int(reciever_id), ()):
+                exchange = self.key_exchanges[exchange_id]
+                if exchange[3] != chat_id:
+                    continue
+                self.key_exchanges[exchange_id] = exchange[:5] + (True,)
+                self.accepted_by_user[exchange[1]].add(exchange_id)
+                self.accepted_by_user[exchange[2]].add(exchange_id)
+
+    def get_accepted_key_exchanges(self, user_id):
+        with self.lock:
+            return [self.key_exchanges[i] for i in sorted(self.accepted_by_user.get(int(user_id), ()))]
+
+    def get_user_key_exchanges(self, user_id):
+        user_id = int(user_id)
+        with self.lock:
+            received = [self.key_exchanges[i] for i in self.exchanges_by_receiver.get(user_id, ())]
+            sent = [self.key_exchanges[i] for i in self.exchanges_by_sender.get(user_id, ()) if self.key_exchanges[i][1] != user_id]
+            return received + sent
+
+    def get_chat_list(self, user_id):
+        with self.lock:
+            chats = []
+            for exchange in self.get_accepted_key_exchanges(user_id):
+                reciever = self.users.get(exchange[1])
+                sender = self.users.get(exchange[2])
+                chats.append((
+                    exchange[1],
+                    exchange[2],
+                    exchange[3],
+                    reciever[1] if reciever else None,
+                    sender[1] if sender else None,
+                    *self.reads.get((int(user_id), exchange[3]), (0, 0))[::-1]
+                ))
+            return chats
+
+    def mark_read(self, user_id, chat_id, message_id):
+        message_id = int(message_id)
+        with self.lock:
+            read = self.reads.setdefault((user_id, chat_id), [0, 0])
+            if message_id > read[0]:
+                messages = self.messages.get(chat_id, [])
+                start = bisect.bisect_right(messages, message_id, key=lambda m: m[0])
+                read[0] = message_id
+                read[1] = sum(1 for m in messages[start:] if m[2] == user_id or (m[2] is None and m[1] != user_id))
+            return tuple(read)
+
+    def get_key_exchange(self, chat_id):
+        exchange_id = self.exchanges_by_chat.get(chat_id)
+        return self.key_exchanges.get(exchange_id) if exchange_id is not None else None
+
+    def create_group(self, owner_id, name, member_ids):
+        with self.lock:
+            group_id = self.next_group_id
+            self.next_group_id += 1
+            self.groups[group_id] = (group_id, name, owner_id)
+            self.add_group_members(group_id, {owner_id, *member_ids})
+            return group_id
+
+    def get_group(self, group_id):
+        return self.groups.get(int(group_id))
+
+    def add_group_members(self, group_id, user_ids):
+        with self.lock:
+            for user_id in user_ids:
+                self.group_members[group_id].add(user_id)
+                self.groups_by_user[user_id].add(group_id)
+
+    def remove_group_member(self, group_id, user_id):
+        with self.lock:
+            self.group_members[group_id].discard(user_id)
+            self.groups_by_user[user_id].discard(group_id)
+            for key in [key for key in self.sender_keys if key[0] == group_id and user_id in key[1:]]:
+                del self.sender_keys[key]
+
+    def get_group_members(self, group_id):
+        with self.lock:
+            return list(self.group_members.get(int(group_id), ()))
+
+    def get_user_groups(self, user_id):
+        with self.lock:
+            groups = []
+            for group_id in sorted(self.groups_by_user.get(int(user_id), ())):
+                chat_id = group_chatid(group_id)
+                last_read_id = self.reads.get((int(user_id), chat_id), (0, 0))[0]
+                messages = self.messages.get(chat_id, [])
+                start = bisect.bisect_right(messages, last_read_id, key=lambda m: m[0])
+                unread = sum(1 for m in messages[start:] if m[1] != user_id)
+                groups.append((*self.groups[group_id], unread, last_read_id))
+            return groups
+
+    def add_sender_keys(self, group_id, sender_id, key_id, envelopes):
+        with self.lock:
+            for recipient_id, ciphertext, iv in envelopes:
+                self.sender_keys[(group_id, sender_id, recipient_id)] = (sender_id, key_id, ciphertext, iv)
+
+    def get_sender_keys(self, group_id, recipient_id):
+        with self.lock:
+            return [key for (group, _, recipient), key in self.sender_keys.items() if group == group_id and recipient == recipient_id]
+
+    def get_pool_status(self):
+        return None
+
+    def get_archive_status(self):
+        return None
+
+    @contextmanager
+    def unit_of_work(self, event=None):
+        # every call is already atomic under self.lock, so only after_commit callbacks are held back
+        if getattr(self.local, 'callbacks', None) is not None:
+            yield self
+            return
+        callbacks = self.local.callbacks = []
+        failed = False
+        try:
+            yield self
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.local.callbacks = None
+            if not failed:
+                for callback in callbacks:
+                    try:
+                        callback()
+                    except Exception as e:
+                        get_logger('memory_store').error("After commit callback error", extra=fields(error=str(e)))
+
+    def after_commit(self, callback):
+        callbacks = getattr(self.local, 'callbacks', None)
+        if callbacks is None:
+            callback()
+        else:
+            callbacks.append(callback)
+
+class AsyncMemoryStore:
+    """
+    Coroutine facade over MemoryStore for the asyncio server
+    """
+
+    def __init__(self, store=None):
+        self.store = store or MemoryStore()
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+        if name in ('get_pool_status', 'get_archive_status'):
+            return method
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
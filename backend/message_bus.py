@@ -0,0 +1,184 @@
+import os
+import socket
+import struct
+import threading
+import time
+import socketio
+from structured_log import get_logger, fields
+
+FRAME_HEADER = struct.Struct("!I")
+
+def send_frame(sock, payload):
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    sock.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+def recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError("Message bus connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+def recv_frame(sock):
+    (size,) = FRAME_HEADER.unpack(recv_exactly(sock, FRAME_HEADER.size))
+    return recv_exactly(sock, size)
+
+class UnixSocketBroker:
+    """
+    Minimal fan-out broker on a Unix socket for running several workers on one host
+
+    A client opens with a "PUB <channel>" or "SUB <channel>" frame. Every frame a
+    publisher sends afterwards is copied to every subscriber of that channel.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.subscribers = {}
+        self.lock = threading.Lock()
+        self.server = None
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        self.server.listen(128)
+        threading.Thread(target=self._accept_loop, name="bus-broker", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.close()
+            self.server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _accept_loop(self):
+        while self.server:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        try:
+            role, channel = recv_frame(conn).decode('utf-8').split(' ', 1)
+            if role == 'SUB':
+                with self.lock:
+                    self.subscribers.setdefault(channel, {})[conn] = threading.Lock()
+                # Subscribers never send after the handshake; block until they hang up.
+                while conn.recv(4096):
+                    pass
+            elif role == 'PUB':
+                while True:
+                    self._fan_out(channel, recv_frame(conn))
+        except (ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            with self.lock:
+                for subscribers in self.subscribers.values():
+                    subscribers.pop(conn, None)
+            conn.close()
+
+    def _fan_out(self, channel, payload):
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, {}).items())
+        for conn, send_lock in subscribers:
+            try:
+                with send_lock:
+                    send_frame(conn, payload)
+            except OSError:
+                with self.lock:
+                    self.subscribers.get(channel, {}).pop(conn, None)
+
+class UnixSocketManager(socketio.PubSubManager):
+    """
+    Socket.IO client manager that shares emits and room changes through a UnixSocketBroker
+    """
+    name = 'unix'
+
+    def __init__(self, url='unix:///tmp/vsc-bus.sock', channel='socketio', write_only=False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.path = url[len('unix://'):]
+        self.publisher = None
+        self.publish_lock = threading.Lock()
+
+    def _connect(self, role):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        send_frame(sock, f"{role} {self.channel}")
+        return sock
+
+    def _publish(self, data):
+        payload = self.json.dumps(data)
+        with self.publish_lock:
+            for retries_left in range(1, -1, -1):
+                try:
+                    if self.publisher is None:
+                        self.publisher = self._connect('PUB')
+                    send_frame(self.publisher, payload)
+                    return
+                except OSError as e:
+                    self.publisher = None
+                    if retries_left == 0:
+                        self._get_logger().error(f"Cannot publish to message bus: {e}")
+
+    def _listen(self):
+        retry_sleep = 0.1
+        while True:
+            try:
+                subscriber = self._connect('SUB')
+                retry_sleep = 0.1
+                while True:
+                    yield recv_frame(subscriber)
+            except (ConnectionError, OSError) as e:
+                self._get_logger().error(f"Cannot receive from message bus, retrying: {e}")
+                time.sleep(retry_sleep)
+                retry_sleep = min(retry_sleep * 2, 5)
+
+def on_worker_event(manager, event, handler):
+    """
+    Runs handler(data) on every worker for emits of event instead of sending them to clients.
+
+    For state each worker keeps about its own sockets, like which rooms they are in, that a
+    change on one worker has to reach. The emitting worker runs it too, before publishing.
+    """
+    handle_emit = manager._handle_emit
+
+    def intercept(message):
+        if message.get('event') != event:
+            return handle_emit(message)
+        data = message['data']
+        handler(data[0] if isinstance(data, list) and len(data) == 1 else data)
+    manager._handle_emit = intercept
+
+def create_manager(url, channel='vsc', write_only=False):
+    if url.startswith('unix://'):
+        return UnixSocketManager(url, channel=channel, write_only=write_only)
+    if url.startswith(('redis://', 'rediss://')):
+        return socketio.RedisManager(url, channel=channel, write_only=write_only)
+    if url.startswith('kafka://'):
+        return socketio.KafkaManager(url, channel=channel, write_only=write_only)
+    if url.startswith('zmq'):
+        return socketio.ZmqManager(url, channel=channel, write_only=write_only)
+    return socketio.KombuManager(url, channel=channel, write_only=write_only)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a standalone Unix socket message bus broker")
+    parser.add_argument("--path", default="/tmp/vsc-bus.sock")
+    args = parser.parse_args()
+
+    broker = UnixSocketBroker(args.path).start()
+    get_logger('message_bus').info("Message bus listening", extra=fields(path=args.path))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        broker.stop()
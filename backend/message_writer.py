@@ -0,0 +1,98 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from structured_log import get_logger, fields
+
+logger = get_logger('message_writer')
+
+class MessageWriter:
+    """
+    Write-behind queue that group-commits messages with a single flush call per batch.
+
+    A batch is flushed once it reaches max_batch messages or once flush_interval
+    seconds have passed since its first message. In durable mode submit() blocks
+    until the batch holding the message has been committed.
+    """
+
+    def __init__(self, flush, max_batch=256, flush_interval=0.005, max_queue=10000, durable=False, put_timeout=1.0):
+        self.flush = flush
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.durable = durable
+        self.put_timeout = put_timeout
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = None
+        self.stopping = threading.Event()
+        self.flushed_messages = 0
+        self.flushed_batches = 0
+        self.failed_messages = 0
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+            self.thread.start()
+
+    def submit(self, message_data):
+        if self.stopping.is_set():
+            raise RuntimeError("Message writer is stopped")
+        future = Future()
+        self.queue.put((message_data, future), timeout=self.put_timeout)
+        if self.durable:
+            future.result()
+        return future
+
+    def stop(self, timeout=None):
+        if self.thread is None:
+            return
+        self.stopping.set()
+        self.queue.put(None)
+        self.thread.join(timeout)
+        self.thread = None
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                if self.queue.empty():
+                    return
+                continue
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 and not self.stopping.is_set():
+                    break
+                try:
+                    item = self.queue.get(timeout=max(remaining, 0)) if remaining > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    continue
+                batch.append(item)
+            self._flush_batch(batch)
+            if self.stopping.is_set() and self.queue.empty():
+                return
+
+    def _flush_batch(self, batch):
+        try:
+            self.flush([message_data for message_data, _ in batch])
+        except Exception as e:
+            logger.error("Message writer flush error", extra=fields(error=str(e), batch=len(batch)))
+            self.failed_messages += len(batch)
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.flushed_messages += len(batch)
+        self.flushed_batches += 1
+        for _, future in batch:
+            future.set_result(True)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "flushed_messages": self.flushed_messages,
+            "flushed_batches": self.flushed_batches,
+            "failed_messages": self.failed_messages,
+            "durable": self.durable
+        }
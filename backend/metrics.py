@@ -0,0 +1,209 @@
+import bisect
+import functools
+import sys
+import threading
+import time
+import traceback
+from collections import defaultdict
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+def format_labels(label_names, label_values):
+    if not label_names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(label_names, label_values))
+    return "{" + pairs + "}"
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.values = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] += amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, labels, value) for labels, value in self.values.items()]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, *label_values, value):
+        with self.lock:
+            self.values[label_values] = value
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.counts = {}
+        self.sums = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def observe(self, *label_values, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.counts.get(label_values)
+            if counts is None:
+                counts = self.counts[label_values] = [0] * (len(self.buckets) + 1)
+            counts[index] += 1
+            self.sums[label_values] += value
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for labels, counts in self.counts.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    samples.append((f"{self.name}_bucket", labels + (le,), cumulative, self.label_names + ("le",)))
+                samples.append((f"{self.name}_count", labels, cumulative, self.label_names))
+                samples.append((f"{self.name}_sum", labels, self.sums[labels], self.label_names))
+        return samples
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self.register(Counter(name, help_text, label_names))
+
+    def gauge(self, name, help_text, label_names=()):
+        return self.register(Gauge(name, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, label_names, buckets))
+
+    def add_collector(self, collector):
+        """collector() returns an iterable of (name, value) gauges read at scrape time"""
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample in metric.samples():
+                name, labels, value = sample[:3]
+                label_names = sample[3] if len(sample) > 3 else metric.label_names
+                lines.append(f"{name}{format_labels(label_names, labels)} {value}")
+        for collector in self.collectors:
+            try:
+                for name, value in collector():
+                    if value is not None:
+                        lines.append(f"{name} {value}")
+            except Exception as e:
+                lines.append(f"# collector error: {e}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+EVENT_LATENCY = registry.histogram("vsc_socket_event_seconds", "Socket.IO handler latency", ("event",))
+EVENT_ERRORS = registry.counter("vsc_socket_event_errors_total", "Errors raised or reported by handlers", ("event",))
+QUERY_LATENCY = registry.histogram("vsc_db_query_seconds", "Storage function latency", ("query",))
+QUERY_ERRORS = registry.counter("vsc_db_query_errors_total", "Storage function errors", ("query",))
+POOL_CHECKOUT_WAIT = registry.histogram("vsc_db_pool_checkout_seconds", "Time spent waiting for a pooled connection")
+POOL_IN_USE = registry.gauge("vsc_db_pool_in_use", "Connections currently checked out of the pool")
+DB_CALLS_PER_EVENT = registry.histogram("vsc_db_calls_per_event", "Storage calls made by one socket event", ("event",), SIZE_BUCKETS)
+DB_CHECKOUTS_PER_EVENT = registry.histogram("vsc_db_checkouts_per_event", "Pool checkouts made by one socket event", ("event",), SIZE_BUCKETS)
+THROTTLED_EVENTS = registry.counter("vsc_socket_events_throttled_total", "Socket events refused by the per-socket rate limiter", ("event",))
+SLOW_CONSUMER_DISCONNECTS = registry.counter("vsc_slow_consumer_disconnects_total", "Sockets disconnected for an oversized outbound queue")
+EMIT_FANOUT = registry.histogram("vsc_emit_fanout", "Local sockets reached by one emit", ("event",), SIZE_BUCKETS)
+
+def instrument_event(event):
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return handler(*args, **kwargs)
+            except Exception:
+                EVENT_ERRORS.inc(event)
+                raise
+            finally:
+                EVENT_LATENCY.observe(event, value=time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def instrument_query(name, fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            QUERY_ERRORS.inc(name)
+            raise
+        finally:
+            QUERY_LATENCY.observe(name, value=time.perf_counter() - start)
+    return wrapper
+
+class SamplingProfiler:
+    """
+    Samples every thread's stack at a fixed interval and aggregates collapsed stacks
+
+    The output is the folded format understood by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = defaultdict(int)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.running = threading.Event()
+
+    def start(self):
+        if self.thread is None:
+            self.running.set()
+            self.thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.running.clear()
+            self.thread.join()
+            self.thread = None
+
+    def reset(self):
+        with self.lock:
+            self.stacks.clear()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while self.running.is_set():
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = traceback.extract_stack(frame, limit=self.max_depth)
+                key = ";".join(f"{f.name} ({f.filename.rsplit('/', 1)[-1]}:{f.lineno})" for f in stack)
+                with self.lock:
+                    self.stacks[key] += 1
+            time.sleep(self.interval)
+
+    def collapsed(self):
+        with self.lock:
+            return "\n".join(f"{stack} {count}" for stack, count in sorted(self.stacks.items(), key=lambda item: -item[1])) + "\n"
+
+profiler = SamplingProfiler()
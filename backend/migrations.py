@@ -0,0 +1,186 @@
+from structured_log import get_logger, fields
+
+logger = get_logger('migrations')
+
+def add_index(table, name, columns):
+    def step(cursor):
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+        """, (table, name))
+        if cursor.fetchone()[0] == 0:
+            cursor.execute(f"CREATE INDEX {name} ON {table} ({columns})")
+    return step
+
+MIGRATIONS = [
+    (1, "create base tables", [
+        """
+            CREATE TABLE IF NOT EXISTS users (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                username VARCHAR(16) UNIQUE,
+                password VARCHAR(32),
+                session_id CHAR(32)
+            )
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS messages (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                sender VARCHAR(10),
+                receiver VARCHAR(10),
+                ciphertext TEXT,
+                iv VARCHAR(24),
+                chat_id VARCHAR(50),
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS key_exchanges (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                reciever_id VARCHAR(20),
+                sender_id VARCHAR(20),
+                chat_id VARCHAR(50),
+                public_key TEXT,
+                accepted BOOLEAN DEFAULT FALSE
+            )
+        """,
+    ]),
+    (2, "add lookup indexes", [
+        add_index("users", "idx_users_session_id", "session_id"),
+        add_index("messages", "idx_messages_chat_id_id", "chat_id, id"),
+        add_index("messages", "idx_messages_chat_id_timestamp", "chat_id, timestamp"),
+        add_index("key_exchanges", "idx_key_exchanges_reciever_id", "reciever_id, accepted"),
+        add_index("key_exchanges", "idx_key_exchanges_sender_id", "sender_id, accepted"),
+        add_index("key_exchanges", "idx_key_exchanges_chat_id", "chat_id"),
+    ]),
+    (3, "integer id columns", [
+        "ALTER TABLE messages MODIFY sender INT, MODIFY receiver INT",
+        "ALTER TABLE key_exchanges MODIFY reciever_id INT, MODIFY sender_id INT",
+    ]),
+    (4, "widen password hash column", [
+        "ALTER TABLE users MODIFY password VARCHAR(60)",
+    ]),
+    (5, "binary ciphertext and iv", [
+        "ALTER TABLE messages MODIFY ciphertext BLOB, MODIFY iv VARBINARY(24)",
+        # rows that were never valid base64 keep their original bytes
+        "UPDATE messages SET ciphertext = COALESCE(FROM_BASE64(ciphertext), ciphertext), iv = COALESCE(FROM_BASE64(iv), iv)",
+    ]),
+    (6, "read cursors and unread counters", [
+        """
+            CREATE TABLE IF NOT EXISTS chat_reads (
+                user_id INT NOT NULL,
+                chat_id VARCHAR(50) NOT NULL,
+                last_read_id INT NOT NULL DEFAULT 0,
+                unread_count INT NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, chat_id)
+            )
+        """,
+        add_index("messages", "idx_messages_chat_id_receiver_id", "chat_id, receiver, id"),
+        # there was no read state before, so existing history starts out read
+        """
+            INSERT IGNORE INTO chat_reads (user_id, chat_id, last_read_id, unread_count)
+            SELECT receiver, chat_id, MAX(id), 0 FROM messages GROUP BY receiver, chat_id
+        """,
+    ]),
+    (7, "pending deliveries", [
+        """
+            CREATE TABLE IF NOT EXISTS pending_deliveries (
+                user_id INT NOT NULL,
+                message_id INT NOT NULL,
+                PRIMARY KEY (user_id, message_id)
+            )
+        """,
+    ]),
+    # group chat ids are "g:<chat_groups.id>"; group messages are stored once with a NULL receiver
+    (8, "group chats and sender keys", [
+        """
+            CREATE TABLE IF NOT EXISTS chat_groups (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                name VARCHAR(100) NOT NULL,
+                owner_id INT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS group_members (
+                group_id INT NOT NULL,
+                user_id INT NOT NULL,
+                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (group_id, user_id),
+                KEY idx_group_members_user_id (user_id)
+            )
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS group_sender_keys (
+                group_id INT NOT NULL,
+                sender_id INT NOT NULL,
+                recipient_id INT NOT NULL,
+                key_id INT NOT NULL,
+                ciphertext BLOB NOT NULL,
+                iv VARBINARY(24) NOT NULL,
+                PRIMARY KEY (group_id, recipient_id, sender_id)
+            )
+        """,
+    ]),
+    # queued rows carry their chat so reads and catch up can acknowledge them, and a time for expiry
+    (9, "pending delivery chat and age", [
+        "ALTER TABLE pending_deliveries ADD COLUMN chat_id VARCHAR(50) NOT NULL DEFAULT '', ADD COLUMN queued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP",
+        "UPDATE pending_deliveries p JOIN messages m ON m.id = p.message_id SET p.chat_id = m.chat_id",
+        add_index("pending_deliveries", "idx_pending_deliveries_chat_id", "user_id, chat_id, message_id"),
+        add_index("pending_deliveries", "idx_pending_deliveries_queued_at", "queued_at"),
+    ]),
+]
+
+def ensure_version_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(100),
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def current_version(cursor):
+    ensure_version_table(cursor)
+    cursor.execute("SELECT MAX(version) FROM schema_migrations")
+    version = cursor.fetchone()[0]
+    return version or 0
+
+def migrate(connection, target=None):
+    cursor = connection.cursor()
+    try:
+        version = current_version(cursor)
+        for number, name, steps in MIGRATIONS:
+            if number <= version or (target is not None and number > target):
+                continue
+            logger.info("Applying migration", extra=fields(version=number, name=name))
+            for step in steps:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (number, name))
+            connection.commit()
+            version = number
+        return version
+    finally:
+        cursor.close()
+
+if __name__ == "__main__":
+    import argparse
+    from database import get_connection
+
+    parser = argparse.ArgumentParser(description="Apply or inspect schema migrations")
+    parser.add_argument("--status", action="store_true", help="print the current schema version and exit")
+    parser.add_argument("--target", type=int, default=None, help="stop after this migration number")
+    args = parser.parse_args()
+
+    connection = get_connection()
+    try:
+        if args.status:
+            cursor = connection.cursor()
+            print(f"Schema version {current_version(cursor)} of {MIGRATIONS[-1][0]}")
+            cursor.close()
+        else:
+            print(f"Schema at version {migrate(connection, args.target)}")
+    finally:
+        connection.close()
@@ -0,0 +1,210 @@
+import asyncio
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import types
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+import bcrypt
+
+class HashingOverloaded(Exception):
+    pass
+
+class Throttled(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Too many attempts, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+def hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+def check_password(password, password_hash):
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+def watch_parent(parent, interval=1.0):
+    """
+    Pool worker initializer: exits once the server process is gone. Fork server children
+    keep the fork server itself alive, so the server's pid is polled rather than the parent.
+    """
+    def watch():
+        while True:
+            time.sleep(interval)
+            try:
+                os.kill(parent, 0)
+            except ProcessLookupError:
+                os._exit(0)
+            except PermissionError:
+                pass
+    threading.Thread(target=watch, name="parent-watch", daemon=True).start()
+
+main_lock = threading.Lock()
+
+@contextmanager
+def without_main():
+    """
+    Hides the parent's __main__ while pool workers start, so they only import this module
+    instead of re-running the server script as __mp_main__
+    """
+    with main_lock:
+        main = sys.modules['__main__']
+        sys.modules['__main__'] = types.ModuleType('__main__')
+        try:
+            yield
+        finally:
+            sys.modules['__main__'] = main
+
+def pool_context():
+    # forking copies whatever threads the parent runs (the log writer starts at import), so the
+    # pool comes from a fork server that only preloads this module, or from spawn where there is none
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context('spawn')
+
+def hash_rounds(password_hash):
+    try:
+        return int(password_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a bounded process pool so hashing never holds a request thread's CPU
+
+    At most max_pending operations may be queued or running; further calls fail
+    fast with HashingOverloaded instead of piling up behind the pool.
+    """
+
+    def __init__(self, workers=2, max_pending=32, rounds=12, timeout=10.0, latency_window=1024):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self.timeout = timeout
+        self.executor = None
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.latencies = deque(maxlen=latency_window)
+
+    def start(self):
+        # start every worker up front so the first logins don't pay for it
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=pool_context(), initializer=watch_parent, initargs=(os.getpid(),))
+            with without_main():
+                futures = [self.executor.submit(int) for _ in range(self.workers)]
+            for future in futures:
+                future.result()
+        return self
+
+    def stop(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def _submit(self, fn, *args):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HashingOverloaded("Password hashing queue is full")
+            self.pending += 1
+        start = time.perf_counter()
+
+        def done(_):
+            # a caller that timed out leaves the hash running, so it stays counted until it ends
+            with self.lock:
+                self.pending -= 1
+                self.completed += 1
+                self.latencies.append(time.perf_counter() - start)
+
+        try:
+            # workers start on demand, so any submit may be the one that launches a process
+            with without_main():
+                future = self.executor.submit(fn, *args)
+        except BaseException:
+            with self.lock:
+                self.pending -= 1
+            raise
+        future.add_done_callback(done)
+        return future
+
+    def _run(self, fn, *args):
+        try:
+            return self._submit(fn, *args).result(timeout=self.timeout)
+        except FutureTimeout:
+            raise HashingOverloaded("Password hashing timed out")
+
+    async def _run_async(self, fn, *args):
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(self._submit(fn, *args)), self.timeout)
+        except asyncio.TimeoutError:
+            raise HashingOverloaded("Password hashing timed out")
+
+    def hash(self, password):
+        return self._run(hash_password, password, self.rounds)
+
+    def verify(self, password, password_hash):
+        return self._run(check_password, password, password_hash)
+
+    async def hash_async(self, password):
+        return await self._run_async(hash_password, password, self.rounds)
+
+    async def verify_async(self, password, password_hash):
+        return await self._run_async(check_password, password, password_hash)
+
+    def needs_rehash(self, password_hash):
+        return hash_rounds(password_hash) != self.rounds
+
+    def stats(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            pending = self.pending
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else 0.0
+        return {
+            "workers": self.workers,
+            "rounds": self.rounds,
+            "queue_depth": pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "latency_p50": percentile(0.5),
+            "latency_p99": percentile(0.99)
+        }
+
+class AttemptThrottle:
+    """
+    Sliding-window attempt limiter keyed by an arbitrary string (client IP, username)
+    """
+
+    def __init__(self, max_attempts, window, max_keys=100000):
+        self.max_attempts = max_attempts
+        self.window = window
+        self.max_keys = max_keys
+        self.attempts = OrderedDict()
+        self.lock = threading.Lock()
+        self.throttled = 0
+
+    def hit(self, key):
+        now = time.monotonic()
+        with self.lock:
+            attempts = self.attempts.get(key)
+            if attempts is None:
+                attempts = self.attempts[key] = deque()
+                while len(self.attempts) > self.max_keys:
+                    self.attempts.popitem(last=False)
+            self.attempts.move_to_end(key)
+            while attempts and attempts[0] <= now - self.window:
+                attempts.popleft()
+            if len(attempts) >= self.max_attempts:
+                self.throttled += 1
+                raise Throttled(attempts[0] + self.window - now)
+            attempts.append(now)
+
+    def reset(self, key):
+        with self.lock:
+            self.attempts.pop(key, None)
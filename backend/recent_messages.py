@@ -0,0 +1,205 @@
+import bisect
+import sys
+import threading
+from collections import OrderedDict, deque
+from common import message_chatid, HISTORY_MAX_PAGE_SIZE
+
+class MessageRecord:
+    __slots__ = ("id", "sender", "receiver", "ciphertext", "iv", "chat_id", "timestamp")
+
+    def __init__(self, id, sender, receiver, ciphertext, iv, chat_id, timestamp):
+        self.id = id
+        self.sender = sender
+        self.receiver = receiver
+        self.ciphertext = ciphertext
+        self.iv = iv
+        self.chat_id = chat_id
+        self.timestamp = timestamp
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row[0], row[1], row[2], row[3], row[4], row[5], row[6].timestamp())
+
+    @classmethod
+    def from_message(cls, message_id, message_data):
+        sender = message_data.get('sender')
+        receiver = message_data.get('receiver')
+        return cls(message_id, sender, receiver, message_data.get('ciphertext'), message_data.get('iv'), message_chatid(message_data), message_data.get('timestamp'))
+
+    def to_dict(self):
+        return {"id": self.id, "sender": self.sender, "receiver": self.receiver, "ciphertext": self.ciphertext, "iv": self.iv, "chat_id": self.chat_id, "timestamp": self.timestamp}
+
+    def size(self):
+        return sys.getsizeof(self) + sys.getsizeof(self.ciphertext) + sys.getsizeof(self.iv)
+
+class ChatBuffer:
+    __slots__ = ("records", "complete", "size")
+
+    def __init__(self, capacity, records, complete):
+        self.records = deque(records, maxlen=capacity)
+        self.complete = complete
+        self.size = sum(record.size() for record in self.records)
+
+    def add(self, record):
+        """Returns the change in bytes"""
+        records = self.records
+        index = len(records)
+        if records and record.id <= records[-1].id:
+            index = bisect.bisect_left(records, record.id, key=lambda r: r.id)
+            if index < len(records) and records[index].id == record.id:
+                return 0
+        delta = record.size()
+        if len(records) == records.maxlen:
+            if index == 0:
+                # older than everything in a full buffer, so it belongs to the uncached part
+                return 0
+            delta -= records.popleft().size()
+            self.complete = False
+            index -= 1
+        records.insert(index, record)
+        self.size += delta
+        return delta
+
+class RecentMessageCache:
+    """
+    Per-chat ring buffers of the newest messages, evicted whole-chat LRU under a byte budget.
+
+    A buffer is only filled from a newest-first history read, so it always holds a
+    contiguous tail of the chat; complete means nothing older exists.
+    """
+
+    def __init__(self, loader, capacity=100, max_bytes=64 * 1024 * 1024):
+        self.loader = loader
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.chats = OrderedDict()
+        self.loading = {}
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_page(self, chat_id, before_id=None, limit=50):
+        """Returns (records oldest first, next_cursor) from the buffer, loading the chat on a miss"""
+        limit = max(1, min(int(limit), HISTORY_MAX_PAGE_SIZE))
+        page = self._read(chat_id, before_id, limit)
+        if page is not None:
+            return page
+        if before_id is not None:
+            rows, next_cursor = self.loader(chat_id, before_id, limit)
+            return [MessageRecord.from_row(row) for row in rows], next_cursor
+        with self.lock:
+            install = chat_id not in self.loading
+            if install:
+                self.loading[chat_id] = False
+        try:
+            rows, next_cursor = self.loader(chat_id, None, max(limit, self.capacity))
+        except Exception:
+            if install:
+                with self.lock:
+                    self.loading.pop(chat_id, None)
+            raise
+        records = [MessageRecord.from_row(row) for row in rows]
+        if install:
+            with self.lock:
+                dirty = self.loading.pop(chat_id)
+                if not dirty:
+                    self._install(chat_id, ChatBuffer(self.capacity, records, next_cursor is None and len(records) <= self.capacity))
+        if len(records) > limit:
+            return records[-limit:], records[-limit].id
+        return records, next_cursor
+
+    def _read(self, chat_id, before_id, limit):
+        with self.lock:
+            buffer = self.chats.get(chat_id)
+            if buffer is None:
+                self.misses += 1
+                return None
+            records = buffer.records
+            end = len(records) if before_id is None else bisect.bisect_left(records, int(before_id), key=lambda r: r.id)
+            start = end - limit
+            if start > 0:
+                page = [records[i] for i in range(start, end)]
+                next_cursor = page[0].id
+            elif start == 0 and not buffer.complete and end > 0:
+                # the page fits exactly but only the database knows whether anything older exists
+                self.misses += 1
+                return None
+            elif buffer.complete:
+                page = [records[i] for i in range(end)]
+                next_cursor = None
+            else:
+                self.misses += 1
+                return None
+            self.chats.move_to_end(chat_id)
+            self.hits += 1
+            return page, next_cursor
+
+    def get_since(self, chat_id, since_id, limit=HISTORY_MAX_PAGE_SIZE):
+        """Returns (records newer than since_id, more) when the buffer reaches back far enough, else None"""
+        limit = max(1, min(int(limit), HISTORY_MAX_PAGE_SIZE))
+        since_id = int(since_id)
+        with self.lock:
+            buffer = self.chats.get(chat_id)
+            if buffer is None or not (buffer.complete or (buffer.records and buffer.records[0].id <= since_id)):
+                self.misses += 1
+                return None
+            records = buffer.records
+            start = bisect.bisect_right(records, since_id, key=lambda r: r.id)
+            end = min(len(records), start + limit)
+            self.chats.move_to_end(chat_id)
+            self.hits += 1
+            return [records[i] for i in range(start, end)], len(records) - start > limit
+
+    def _install(self, chat_id, buffer):
+        old = self.chats.pop(chat_id, None)
+        if old is not None:
+            self.bytes -= old.size
+        self.chats[chat_id] = buffer
+        self.bytes += buffer.size
+        self._evict()
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and len(self.chats) > 1:
+            _, buffer = self.chats.popitem(last=False)
+            self.bytes -= buffer.size
+            self.evictions += 1
+
+    def add(self, message_id, message_data):
+        """Write-through for a stored message; chats that aren't cached are left alone"""
+        record = MessageRecord.from_message(message_id, message_data)
+        with self.lock:
+            if record.chat_id in self.loading:
+                self.loading[record.chat_id] = True
+            buffer = self.chats.get(record.chat_id)
+            if buffer is not None:
+                self.bytes += buffer.add(record)
+                self._evict()
+
+    def invalidate(self, chat_id):
+        with self.lock:
+            if chat_id in self.loading:
+                self.loading[chat_id] = True
+            buffer = self.chats.pop(chat_id, None)
+            if buffer is not None:
+                self.bytes -= buffer.size
+
+    def clear(self):
+        with self.lock:
+            self.chats.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "chats": len(self.chats),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions
+            }
@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import OrderedDict
+
+class SessionCache:
+    """
+    Bounded LRU cache of session_id -> user row with a per-entry TTL
+    """
+
+    def __init__(self, loader, max_size=10000, ttl=60.0):
+        self.loader = loader
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(session_id)
+            if entry is not None:
+                user, expires_at = entry
+                if expires_at > now:
+                    self.entries.move_to_end(session_id)
+                    self.hits += 1
+                    return user
+                del self.entries[session_id]
+            self.misses += 1
+
+        user = self.loader(session_id)
+        if user:
+            self.put(session_id, user)
+        return user
+
+    def put(self, session_id, user):
+        with self.lock:
+            self.entries[session_id] = (user, time.monotonic() + self.ttl)
+            self.entries.move_to_end(session_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, session_id):
+        with self.lock:
+            self.entries.pop(session_id, None)
+
+    def invalidate_user(self, user_id):
+        with self.lock:
+            for session_id in [s for s, (user, _) in self.entries.items() if user[0] == user_id]:
+                del self.entries[session_id]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
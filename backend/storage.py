@@ -0,0 +1,59 @@
+import os
+from metrics import instrument_query
+from common import generate_chatid, decode_chatid, HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE
+
+STORAGE_BACKEND = os.getenv('VSC_STORAGE', 'mysql')
+
+if STORAGE_BACKEND == 'memory':
+    from memory_store import MemoryStore
+    backend = MemoryStore()
+elif STORAGE_BACKEND == 'mysql':
+    import database as backend
+else:
+    raise ValueError(f"Unknown storage backend: {STORAGE_BACKEND}")
+
+# every instrumented storage call by name, for tools that need to wrap them all
+QUERIES = {}
+
+def query(name):
+    QUERIES[name] = instrument_query(name, getattr(backend, name))
+    return QUERIES[name]
+
+database_setup = backend.database_setup
+add_user = query('add_user')
+get_user = query('get_user')
+get_username = query('get_username')
+session_check = query('session_check')
+rotate_session = query('rotate_session')
+update_password = query('update_password')
+add_message = query('add_message')
+add_messages = query('add_messages')
+get_messages = query('get_messages')
+get_messages_page = query('get_messages_page')
+get_messages_since = query('get_messages_since')
+get_messages_since_many = query('get_messages_since_many')
+get_key_exchanges = query('get_key_exchanges')
+add_pending_deliveries = query('add_pending_deliveries')
+get_pending_deliveries = query('get_pending_deliveries')
+delete_pending_deliveries = query('delete_pending_deliveries')
+delete_pending_deliveries_through = query('delete_pending_deliveries_through')
+expire_pending_deliveries = query('expire_pending_deliveries')
+add_key_exchange = query('add_key_exchange')
+accept_key_exchange = query('accept_key_exchange')
+get_accepted_key_exchanges = query('get_accepted_key_exchanges')
+get_user_key_exchanges = query('get_user_key_exchanges')
+get_chat_list = query('get_chat_list')
+get_key_exchange = query('get_key_exchange')
+mark_read = query('mark_read')
+create_group = query('create_group')
+get_group = query('get_group')
+add_group_members = query('add_group_members')
+remove_group_member = query('remove_group_member')
+get_group_members = query('get_group_members')
+get_user_groups = query('get_user_groups')
+add_sender_keys = query('add_sender_keys')
+get_sender_keys = query('get_sender_keys')
+get_pool_status = backend.get_pool_status
+get_archive_status = backend.get_archive_status
+unit_of_work = backend.unit_of_work
+after_commit = backend.after_commit
@@ -0,0 +1,157 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
+
+def parse_overrides(value, convert):
+    """'send_message=WARNING,database=DEBUG' -> {'send_message': 'WARNING', 'database': 'DEBUG'}"""
+    overrides = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, _, setting = item.partition('=')
+        overrides[name.strip()] = convert(setting.strip())
+    return overrides
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# per event level and sampling overrides, keyed by the name passed to get_logger
+LOG_LEVELS = parse_overrides(os.getenv('LOG_LEVELS', ''), str.upper)
+LOG_SAMPLE = parse_overrides(os.getenv('LOG_SAMPLE', ''), float)
+# records per second allowed for one logger and message before the rest are counted and dropped
+LOG_RATE = float(os.getenv('LOG_RATE', 20))
+LOG_BURST = float(os.getenv('LOG_BURST', 100))
+LOG_QUEUE = int(os.getenv('LOG_QUEUE', 10000))
+LOG_PAYLOADS = os.getenv('LOG_PAYLOADS') == '1'
+PAYLOAD_FIELDS = frozenset({'ciphertext', 'iv', 'public_key', 'password', 'data', 'payload'})
+
+def fields(**values):
+    """Structured fields for one record: logger.info("message stored", extra=fields(chat_id=chat_id))"""
+    return {'fields': values}
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line; payload fields are replaced unless LOG_PAYLOADS=1
+    """
+
+    def format(self, record):
+        entry = {"ts": record.created, "level": record.levelname, "logger": record.name, "msg": record.getMessage()}
+        for key, value in getattr(record, 'fields', {}).items():
+            entry[key] = "[redacted]" if key in PAYLOAD_FIELDS and not LOG_PAYLOADS else value
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["traceback"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per (logger, message template) plus per logger sampling of records below WARNING.
+
+    Suppressed records are counted and the count rides on the next record that gets through.
+    """
+
+    def __init__(self, rate, burst, sample=None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.sample = sample or {}
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            fraction = self.sample.get(record.name.rpartition('.')[2])
+            if fraction is not None and random.random() >= fraction:
+                return False
+        if self.rate <= 0:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                self.suppressed += 1
+                return False
+            bucket[0] -= 1
+            record.suppressed, bucket[2] = bucket[2], 0
+        return True
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread without blocking; a full queue drops the record
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # formatting happens on the listener thread; args and exc_info travel with the record
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class LogPipeline:
+    """
+    The vsc logger tree: filter and enqueue on the calling thread, format and write on a background one
+    """
+
+    def __init__(self, stream=None, max_queue=LOG_QUEUE, rate=LOG_RATE, burst=LOG_BURST, sample=None):
+        # the JSON lines never carry caller, thread or process details, so skip collecting them
+        logging._srcfile = None
+        logging.logThreads = False
+        logging.logProcesses = False
+        logging.logMultiprocessing = False
+        self.root = logging.getLogger('vsc')
+        self.root.setLevel(LOG_LEVEL)
+        self.root.propagate = False
+        self.filter = RateLimitFilter(rate, burst, LOG_SAMPLE if sample is None else sample)
+        self.handler = DroppingQueueHandler(queue.Queue(max_queue))
+        self.handler.addFilter(self.filter)
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(JsonFormatter())
+        self.listener = QueueListener(self.handler.queue, output)
+        self.root.handlers = [self.handler]
+
+    def start(self):
+        self.listener.start()
+        return self
+
+    def stop(self):
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def stats(self):
+        return {
+            "queued": self.handler.queue.qsize(),
+            "max_queue": self.handler.queue.maxsize,
+            "dropped": self.handler.dropped,
+            "suppressed": self.filter.suppressed
+        }
+
+@lru_cache(maxsize=None)
+def get_logger(name):
+    """Logger for one module or socket event; LOG_LEVELS can raise or lower it by name"""
+    logger = logging.getLogger(f'vsc.{name}')
+    if name in LOG_LEVELS:
+        logger.setLevel(LOG_LEVELS[name])
+    return logger
+
+pipeline = LogPipeline().start()
+atexit.register(pipeline.stop)
@@ -0,0 +1,48 @@
+import os
+import sys
+import tempfile
+import uuid
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# main reads its configuration at import time, so the test setup has to be in place first
+os.environ['VSC_STORAGE'] = 'memory'
+os.environ.pop('MESSAGE_BUS', None)
+os.environ.pop('VSC_WORKER', None)
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+os.environ.setdefault('EVENT_RATE', '0')
+os.environ.setdefault('AUTH_IP_ATTEMPTS', '1000000')
+os.environ.setdefault('ATTACHMENT_DIR', tempfile.mkdtemp(prefix='vsc-attachments-'))
+
+@pytest.fixture(scope='session')
+def server():
+    import main
+    return main
+
+@pytest.fixture
+def signup(server):
+    """Signs up a fresh user and returns (socket test client, user id)"""
+    clients = []
+
+    def create(name='user'):
+        http = server.app.test_client()
+        http.post('/api/signup', json={'username': f"{name}_{uuid.uuid4().hex[:8]}", 'password': 'test-password'})
+        user_id = http.get('/api/authenticate').json['data']['User_id']
+        client = server.socketio.test_client(server.app, flask_test_client=http)
+        client.get_received()
+        clients.append(client)
+        return client, user_id
+
+    yield create
+    for client in clients:
+        if client.is_connected():
+            client.disconnect()
+
+@pytest.fixture
+def received():
+    """Payloads of one event the client has received since the last call"""
+    def collect(client, event):
+        return [packet['args'][0] if packet['args'] else None for packet in client.get_received() if packet['name'] == event]
+    return collect
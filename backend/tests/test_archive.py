@@ -0,0 +1,66 @@
+import os
+from datetime import datetime
+import pytest
+from archive import Archive, write_segment
+
+DIRECT = '1:2'
+GROUP = 'g:7'
+
+def row(message_id, chat_id=DIRECT, receiver=2):
+    return (message_id, 1, receiver, b'ciphertext-%d' % message_id, b'iv-iv-iv-iv-', chat_id, datetime.fromtimestamp(1700000000 + message_id))
+
+@pytest.fixture
+def archive(tmp_path):
+    # two segments with disjoint id ranges, the way the archiver writes them
+    write_segment(str(tmp_path / '000001.seg'), [row(i) for i in range(1, 6)] + [row(3 + 100, GROUP, None)])
+    write_segment(str(tmp_path / '000002.seg'), [row(i) for i in range(6, 11)])
+    return Archive(str(tmp_path), refresh_interval=0)
+
+def ids(rows):
+    return [r[0] for r in rows]
+
+def test_page_reads_newest_segment_first(archive):
+    rows, more = archive.get_page(DIRECT, None, 3)
+    assert ids(rows) == [8, 9, 10] and more
+
+def test_page_crosses_segments(archive):
+    rows, more = archive.get_page(DIRECT, 8, 4)
+    assert ids(rows) == [4, 5, 6, 7] and more
+    rows, more = archive.get_page(DIRECT, 4, 10)
+    assert ids(rows) == [1, 2, 3] and not more
+
+def test_complete_page_fills_from_archive(archive):
+    hot = [row(11), row(12)]
+    messages, next_cursor = archive.complete_page(DIRECT, hot, None, 5)
+    assert ids(messages) == [8, 9, 10, 11, 12]
+    assert next_cursor == 8
+
+def test_since_reads_oldest_segment_first(archive):
+    rows, more = archive.get_since(DIRECT, 3, 4)
+    assert ids(rows) == [4, 5, 6, 7] and more
+    rows, more = archive.get_since(DIRECT, 7, 10)
+    assert ids(rows) == [8, 9, 10] and not more
+
+def test_time_cursor(archive):
+    assert archive.id_before_time(DIRECT, 1700000000 + 6.5) == 6
+    assert archive.id_before_time(DIRECT, 0) == 0
+
+def test_rows_round_trip(archive):
+    rows, _ = archive.get_since(DIRECT, 0, 1)
+    assert rows == [row(1)]
+
+def test_group_rows_keep_null_receiver(archive):
+    rows, _ = archive.get_page(GROUP, None, 10)
+    assert rows == [row(103, GROUP, None)]
+
+def test_failed_write_leaves_no_files(tmp_path):
+    path = str(tmp_path / '000003.seg')
+    with pytest.raises(TypeError):
+        write_segment(path, [row(1), (2, 1, 2, None, b'', DIRECT, datetime.now())])
+    assert os.listdir(tmp_path) == []
+
+def test_new_segments_show_up_on_refresh(tmp_path):
+    archive = Archive(str(tmp_path), refresh_interval=0)
+    assert archive.max_id() == 0
+    write_segment(str(tmp_path / '000001.seg'), [row(1)])
+    assert archive.max_id() == 1
@@ -0,0 +1,55 @@
+import hashlib
+import io
+import os
+import pytest
+from attachments import AttachmentStore, InvalidChunk
+
+BLOB = bytes(range(256)) * 40
+
+def upload(store, owner, blob, chunk_size, order):
+    created = store.create(owner, len(blob), chunk_size, hashlib.sha256(blob).hexdigest())
+    for index in order:
+        chunk = blob[index * chunk_size:(index + 1) * chunk_size]
+        store.write_chunk(owner, created["upload_id"], index, io.BytesIO(chunk), len(chunk))
+    return created
+
+def test_directories_are_made_by_the_first_upload(tmp_path):
+    store = AttachmentStore(str(tmp_path / 'attachments'))
+    assert not os.path.exists(store.directory)
+
+    upload(store, 1, BLOB, 4096, [0, 1, 2])
+    assert os.path.isdir(store.uploads) and os.path.isdir(store.quota)
+
+def test_digest_is_complete_before_the_upload_is(tmp_path):
+    store = AttachmentStore(str(tmp_path))
+    created = upload(store, 1, BLOB, 4096, [2, 0, 1])
+    assert store.digests[created["upload_id"]]["next"] == 3
+
+    result = store.complete(1, created["upload_id"])
+    assert result["attachment_id"] == hashlib.sha256(BLOB).hexdigest()
+    assert store.object_path(result["attachment_id"]) is not None
+
+def test_received_chunk_is_not_rewritten(tmp_path):
+    store = AttachmentStore(str(tmp_path))
+    created = upload(store, 1, BLOB, 4096, [0])
+    store.write_chunk(1, created["upload_id"], 0, io.BytesIO(b'x' * 4096), 4096)
+    for index in (1, 2):
+        chunk = BLOB[index * 4096:(index + 1) * 4096]
+        store.write_chunk(1, created["upload_id"], index, io.BytesIO(chunk), len(chunk))
+
+    result = store.complete(1, created["upload_id"])
+    with open(store.object_path(result["attachment_id"]), 'rb') as f:
+        assert f.read() == BLOB
+
+def test_proof_is_checked_against_the_stored_blob(tmp_path):
+    store = AttachmentStore(str(tmp_path))
+    store.complete(1, upload(store, 1, BLOB, 4096, [0, 1, 2])["upload_id"])
+    sha256 = hashlib.sha256(BLOB).hexdigest()
+
+    wrong = store.create(2, len(BLOB), 4096, sha256)
+    with pytest.raises(InvalidChunk):
+        store.prove(2, wrong["upload_id"], sha256)
+    right = store.create(2, len(BLOB), 4096, sha256)
+    proof = hashlib.sha256(right["proof_nonce"].encode('ascii') + BLOB).hexdigest()
+    assert store.prove(2, right["upload_id"], proof)["attachment_id"] == sha256
+    assert store.proofs == {}
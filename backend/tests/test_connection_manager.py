@@ -0,0 +1,49 @@
+import time
+import mysql.connector
+from connection_manager import ConnectionManager
+
+class Connection:
+    def __init__(self):
+        self.unread_result = False
+        self.in_transaction = False
+        self.closed = False
+        self.alive = True
+
+    def ping(self, reconnect=False):
+        if not self.alive:
+            raise mysql.connector.errors.InterfaceError("gone away")
+
+    def close(self):
+        self.closed = True
+
+class Manager(ConnectionManager):
+    """Pool over fake connections, so no database is needed"""
+
+    def __init__(self, **kwargs):
+        super().__init__({}, **kwargs)
+        self.opened = []
+
+    def _connect(self):
+        self.opened.append(Connection())
+        return self.opened[-1]
+
+def test_idle_connections_are_trimmed_to_min_size():
+    pool = Manager(min_size=1, max_size=3, idle_timeout=0.05)
+    checked_out = [pool.get_connection() for _ in range(3)]
+    for connection in checked_out[:2]:
+        connection.close()
+    time.sleep(0.1)
+    checked_out[2].close()
+
+    assert pool.stats()['pool_size'] == 1
+    assert pool.stats()['trimmed'] == 2
+    assert [c.closed for c in pool.opened] == [True, True, False]
+
+def test_dead_idle_connection_is_replaced():
+    pool = Manager(min_size=0, max_size=1, validate_after=0)
+    pool.get_connection().close()
+    pool.opened[0].alive = False
+    connection = pool.get_connection(timeout=0.5)
+
+    assert connection._connection is pool.opened[1]
+    assert pool.stats()['invalid'] == 1 and pool.stats()['pool_size'] == 1
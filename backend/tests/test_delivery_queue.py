@@ -0,0 +1,107 @@
+from common import generate_chatid
+from delivery import DeliveryQueue
+
+class Storage:
+    """Spilled rows in memory, standing in for the pending_deliveries table"""
+
+    def __init__(self):
+        self.rows = {}
+        self.messages = {}
+
+    def spill(self, user_id, chat_id, message_ids, keep):
+        rows = self.rows.setdefault(user_id, {})
+        for message_id in message_ids:
+            rows[message_id] = chat_id
+        for message_id in sorted(rows)[:-keep]:
+            del rows[message_id]
+
+    def load(self, user_id, limit):
+        ids = sorted(self.rows.get(user_id, {}))
+        return [self.messages[message_id] for message_id in ids[:limit]], len(ids) > limit
+
+    def drop(self, user_id, message_ids):
+        for message_id in message_ids:
+            self.rows.get(user_id, {}).pop(message_id, None)
+
+    def drop_through(self, user_id, cursors):
+        rows = self.rows.get(user_id, {})
+        for message_id, chat_id in list(rows.items()):
+            if message_id <= cursors.get(chat_id, 0):
+                del rows[message_id]
+
+    def expire(self, max_age):
+        self.expired_with = max_age
+
+def make_queue(storage, **kwargs):
+    return DeliveryQueue(storage.spill, storage.load, storage.drop, storage.drop_through, storage.expire, **kwargs)
+
+def message(storage, message_id, chat_id='1:2'):
+    storage.messages[message_id] = {'id': message_id, 'chat_id': chat_id}
+    return storage.messages[message_id]
+
+def test_queued_until_acked():
+    storage = Storage()
+    queue = make_queue(storage)
+    for message_id in (1, 2, 3):
+        queue.enqueue(2, message(storage, message_id))
+
+    assert [m['id'] for m in queue.pending(2, 10)[0]] == [1, 2, 3]
+    queue.ack(2, [1, 2])
+    assert [m['id'] for m in queue.pending(2, 10)[0]] == [3]
+    queue.ack(2, [3])
+    assert not queue.has_pending(2)
+
+def test_overflow_spills_to_storage_in_order():
+    storage = Storage()
+    queue = make_queue(storage, max_per_user=2)
+    for message_id in (1, 2, 3, 4):
+        queue.enqueue(2, message(storage, message_id))
+
+    assert sorted(storage.rows[2]) == [3, 4]
+    messages, more = queue.pending(2, 10)
+    assert [m['id'] for m in messages] == [1, 2, 3, 4] and not more
+    queue.ack(2, [1, 2, 3, 4])
+    assert storage.rows[2] == {}
+
+def test_stored_rows_are_capped_per_user():
+    storage = Storage()
+    queue = make_queue(storage, max_per_user=0, max_stored_per_user=2)
+    for message_id in (1, 2, 3):
+        queue.enqueue(2, message(storage, message_id))
+
+    assert sorted(storage.rows[2]) == [2, 3]
+
+def test_ack_through_covers_history_and_read_cursors():
+    storage = Storage()
+    queue = make_queue(storage, max_per_user=2)
+    first, second = generate_chatid(1, 2), generate_chatid(2, 3)
+    for message_id, chat_id in ((1, first), (2, second), (3, first), (4, second)):
+        queue.enqueue(2, message(storage, message_id, chat_id))
+
+    queue.ack_through(2, {first: 3})
+    assert [m['id'] for m in queue.pending(2, 10)[0]] == [2, 4]
+    assert sorted(storage.rows[2]) == [4]
+
+def test_old_entries_expire():
+    storage = Storage()
+    queue = make_queue(storage, ttl=60)
+    queue.enqueue(2, message(storage, 1))
+    queue.expire(now=queue.queues[2][1][0] + 61)
+
+    assert not queue.has_pending(2)
+    assert queue.stats()['expired'] == 1
+    assert storage.expired_with == 60
+
+def test_offline_message_is_delivered_on_connect_and_acked_by_read(server, signup, received):
+    alice, alice_id = signup('alice')
+    bob, bob_id = signup('bob')
+    bob.disconnect()
+    chat_id = generate_chatid(alice_id, bob_id)
+    alice.emit('send_message', {'chat_id': chat_id, 'sender': alice_id, 'receiver': bob_id, 'ciphertext': 'b2ZmbGluZQ==', 'iv': 'aXYtaXYtaXYtaXYt'})
+    assert server.delivery_queue.has_pending(bob_id)
+
+    bob.connect()
+    pending = received(bob, 'pending_messages')
+    assert [m['ciphertext'] for m in pending[0]['messages']] == ['b2ZmbGluZQ==']
+    bob.emit('mark_read', {'chat_id': chat_id, 'message_id': pending[0]['messages'][0]['id']})
+    assert not server.delivery_queue.has_pending(bob_id)
@@ -0,0 +1,29 @@
+import os
+import socket
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port_pair():
+    while True:
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        with socket.socket() as first, socket.socket() as second:
+            try:
+                first.bind(('127.0.0.1', port))
+                second.bind(('127.0.0.1', port + 1))
+            except OSError:
+                continue
+        return port
+
+def test_message_reaches_user_on_another_worker():
+    # two real worker processes joined by the Unix socket bus, as workers.py runs them
+    env = dict(os.environ, VSC_STORAGE='memory')
+    result = subprocess.run(
+        [sys.executable, os.path.join(BACKEND_DIR, 'fanout_check.py'), '--storage', 'memory', '--base-port', str(free_port_pair())],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, timeout=120
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "ok: message sent on worker 0 was delivered on worker 1" in result.stdout
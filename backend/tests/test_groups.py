@@ -0,0 +1,42 @@
+from common import generate_chatid
+
+def contacts(owner, owner_id, *members):
+    for member, member_id in members:
+        chat_id = generate_chatid(owner_id, member_id)
+        owner.emit('key_exchange_request', {'reciever_id': member_id, 'chat_id': chat_id, 'public_key': 'owner-key'})
+        member.emit('key_exchange_success', {'chat_id': chat_id, 'public_key': 'member-key'})
+
+def test_group_needs_accepted_contacts(signup, received):
+    alice, alice_id = signup('alice')
+    bob, bob_id = signup('bob')
+    _, carol_id = signup('carol')
+    contacts(alice, alice_id, (bob, bob_id))
+    alice.emit('create_group', {'name': 'friends', 'member_ids': [bob_id, carol_id, carol_id + 1000]})
+
+    errors = received(alice, 'group_error')
+    assert errors == [{'message': 'Members must be accepted contacts', 'user_ids': [carol_id, carol_id + 1000]}]
+    assert received(bob, 'group_added') == []
+
+def test_added_members_must_be_contacts(signup, received):
+    alice, alice_id = signup('alice')
+    bob, bob_id = signup('bob')
+    carol, carol_id = signup('carol')
+    contacts(alice, alice_id, (bob, bob_id))
+    alice.emit('create_group', {'name': 'friends', 'member_ids': [bob_id]})
+    chat_id = received(alice, 'group_added')[0]['chat_id']
+    alice.emit('add_group_members', {'chat_id': chat_id, 'member_ids': [carol_id]})
+
+    assert received(alice, 'group_error')[0]['user_ids'] == [carol_id]
+    assert received(carol, 'group_added') == []
+
+def test_removed_member_stops_receiving(signup, received):
+    alice, alice_id = signup('alice')
+    bob, bob_id = signup('bob')
+    contacts(alice, alice_id, (bob, bob_id))
+    alice.emit('create_group', {'name': 'friends', 'member_ids': [bob_id]})
+    chat_id = received(alice, 'group_added')[0]['chat_id']
+    alice.emit('remove_group_member', {'chat_id': chat_id, 'user_id': bob_id})
+    assert received(bob, 'group_removed') == [{'chat_id': chat_id}]
+
+    alice.emit('send_message', {'chat_id': chat_id, 'sender': alice_id, 'ciphertext': 'Z3JvdXA=', 'iv': 'aXYtaXYtaXYtaXYt'})
+    assert received(bob, 'new_message') == []
@@ -0,0 +1,56 @@
+from common import generate_chatid
+
+def request_exchange(sender, sender_id, receiver_id, key='sender-key'):
+    chat_id = generate_chatid(sender_id, receiver_id)
+    sender.emit('key_exchange_request', {'reciever_id': receiver_id, 'chat_id': chat_id, 'public_key': key})
+    return chat_id
+
+def test_request_reaches_receiver(signup, received):
+    alice, alice_id = signup('alice')
+    bob, bob_id = signup('bob')
+    chat_id = request_exchange(alice, alice_id, bob_id)
+
+    requests = received(bob, 'new_key_exchange_request')
+    assert requests == [{'sender_id': alice_id, 'chat_id': chat_id, 'public_key': 'sender-key'}]
+
+def test_user_can_accept_two_exchanges(signup, received):
+    # the receiver's index entry is loaded before the second request arrives, so this
+    # only passes when the request handler records new exchanges in the index
+    alice, alice_id = signup('alice')
+    carol, carol_id = signup('carol')
+    bob, bob_id = signup('bob')
+    bob.emit('connected_chats')
+    first = request_exchange(alice, alice_id, bob_id)
+    bob.emit('key_exchange_success', {'chat_id': first, 'public_key': 'bob-key'})
+    second = request_exchange(carol, carol_id, bob_id)
+    bob.emit('key_exchange_success', {'chat_id': second, 'public_key': 'bob-key'})
+
+    assert [event['chat_id'] for event in received(alice, 'key_exchange_success')] == [first]
+    assert [event['chat_id'] for event in received(carol, 'key_exchange_success')] == [second]
+    bob.emit('connected_chats')
+    chats = received(bob, 'connected_chats')[-1]['chats']
+    assert sorted(chat['chat_id'] for chat in chats) == sorted([first, second])
+
+def test_duplicate_request_is_ignored(signup, received):
+    alice, alice_id = signup('alice')
+    bob, bob_id = signup('bob')
+    request_exchange(alice, alice_id, bob_id)
+    request_exchange(alice, alice_id, bob_id, key='replacement-key')
+
+    assert [event['public_key'] for event in received(bob, 'new_key_exchange_request')] == ['sender-key']
+
+def test_request_for_someone_elses_chat_disconnects(signup):
+    alice, alice_id = signup('alice')
+    bob, bob_id = signup('bob')
+    _, carol_id = signup('carol')
+    alice.emit('key_exchange_request', {'reciever_id': bob_id, 'chat_id': generate_chatid(bob_id, carol_id), 'public_key': 'sender-key'})
+
+    assert not alice.is_connected()
+
+def test_only_the_receiver_can_accept(signup, received):
+    alice, alice_id = signup('alice')
+    bob, bob_id = signup('bob')
+    chat_id = request_exchange(alice, alice_id, bob_id)
+    alice.emit('key_exchange_success', {'chat_id': chat_id, 'public_key': 'alice-key'})
+
+    assert received(bob, 'key_exchange_success') == []
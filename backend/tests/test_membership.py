@@ -0,0 +1,46 @@
+from common import generate_chatid, group_chatid
+from exchange_index import ChatMembership, chat_members, is_member
+
+def test_direct_chat_members_are_decoded():
+    chat_id = generate_chatid(3, 7)
+    assert chat_members(chat_id) == {3, 7}
+    assert is_member(3, chat_id) and not is_member(4, chat_id)
+    assert chat_members('not-a-chat') is None
+
+def test_group_members_are_loaded_once():
+    loads = []
+    membership = ChatMembership(lambda group_id: loads.append(group_id) or [1, 2])
+    chat_id = group_chatid(5)
+
+    assert membership.is_member(1, chat_id)
+    assert not membership.is_member(3, chat_id)
+    assert loads == [5]
+    assert membership.stats()['hits'] == 1
+
+def test_set_replaces_cached_members():
+    membership = ChatMembership(lambda group_id: [1, 2])
+    chat_id = group_chatid(5)
+    membership.members(chat_id)
+    membership.set(5, [1, 3])
+
+    assert membership.members(chat_id) == {1, 3}
+
+def test_ttl_reloads_changes_from_other_workers():
+    stored = {5: [1, 2]}
+    membership = ChatMembership(lambda group_id: stored[group_id], ttl=0)
+    chat_id = group_chatid(5)
+    membership.members(chat_id)
+    stored[5] = [1]
+
+    assert membership.members(chat_id) == {1}
+
+def test_least_recently_used_group_is_evicted():
+    membership = ChatMembership(lambda group_id: [group_id], max_groups=2)
+    for group_id in (1, 2, 1, 3):
+        membership.members(group_chatid(group_id))
+
+    assert list(membership.groups) == [1, 3]
+
+def test_malformed_group_id():
+    membership = ChatMembership(lambda group_id: [])
+    assert membership.members('g:nope') is None
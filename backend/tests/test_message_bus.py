@@ -0,0 +1,32 @@
+import socketio
+from message_bus import on_worker_event
+
+class Manager(socketio.PubSubManager):
+    """Publishes into a list instead of a broker"""
+
+    def __init__(self):
+        super().__init__()
+        self.published = []
+
+    def _publish(self, data):
+        self.published.append(data)
+
+def test_worker_event_runs_here_and_on_other_workers():
+    handled = []
+    manager, other = Manager(), Manager()
+    for worker in (manager, other):
+        on_worker_event(worker, 'vsc:leave_chat', handled.append)
+    manager.emit('vsc:leave_chat', {'user_id': 2, 'chat_id': 'g:1'}, namespace='/')
+    other._handle_emit(manager.published[0])
+
+    assert handled == [{'user_id': 2, 'chat_id': 'g:1'}] * 2
+
+def test_other_events_still_reach_clients():
+    handled = []
+    manager = Manager()
+    sent = []
+    manager._handle_emit = sent.append
+    on_worker_event(manager, 'vsc:leave_chat', handled.append)
+    manager.emit('new_message', {'id': 1}, room='chat_g:1', namespace='/')
+
+    assert handled == [] and [message['event'] for message in sent] == ['new_message']
@@ -0,0 +1,65 @@
+import pytest
+import database
+from memory_store import MemoryStore
+
+class Connection:
+    def __init__(self, fail_commit=False):
+        self.fail_commit = fail_commit
+        self.events = []
+
+    def commit(self):
+        self.events.append('commit')
+        if self.fail_commit:
+            raise RuntimeError("commit failed")
+
+    def rollback(self):
+        self.events.append('rollback')
+
+    def close(self):
+        self.events.append('close')
+
+def test_callbacks_run_after_commit_and_release():
+    unit = database.UnitOfWork()
+    unit.connection = connection = Connection()
+    unit.after_commit(lambda: connection.events.append('emit'))
+    unit.finish()
+
+    assert connection.events == ['commit', 'close', 'emit']
+
+def test_rolled_back_unit_drops_callbacks():
+    unit = database.UnitOfWork()
+    unit.connection = connection = Connection()
+    unit.after_commit(lambda: connection.events.append('emit'))
+    unit.failed = True
+    unit.finish()
+
+    assert connection.events == ['rollback', 'close']
+
+def test_failed_commit_drops_callbacks():
+    unit = database.UnitOfWork()
+    unit.connection = connection = Connection(fail_commit=True)
+    unit.after_commit(lambda: connection.events.append('emit'))
+    with pytest.raises(RuntimeError):
+        unit.finish()
+
+    assert connection.events == ['commit', 'close']
+
+def test_memory_store_defers_callbacks_to_the_end_of_the_unit():
+    store = MemoryStore()
+    events = []
+    with store.unit_of_work():
+        store.after_commit(lambda: events.append('emit'))
+        events.append('body')
+    store.after_commit(lambda: events.append('outside'))
+
+    assert events == ['body', 'emit', 'outside']
+
+def test_memory_store_drops_callbacks_when_the_unit_raises():
+    store = MemoryStore()
+    events = []
+    with pytest.raises(ValueError):
+        with store.unit_of_work():
+            store.after_commit(lambda: events.append('emit'))
+            raise ValueError("handler failed")
+
+    assert events == []
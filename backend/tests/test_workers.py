@@ -0,0 +1,30 @@
+from workers import forward_head, pick_worker
+
+def head(target, *headers):
+    return b"\r\n".join([f"GET {target} HTTP/1.1".encode('latin-1'), b"Host: chat"] + list(headers)) + b"\r\n\r\n"
+
+def test_requests_follow_the_worker_in_their_sid():
+    assert pick_worker(head("/socket.io/?EIO=4&transport=polling&sid=1.AbC-_x"), 2) == 1
+    assert pick_worker(head("/socket.io/?EIO=4&transport=websocket&sid=0.AbC"), 2) == 0
+
+def test_handshakes_and_foreign_sids_are_unrouted():
+    assert pick_worker(head("/socket.io/?EIO=4&transport=polling"), 2) is None
+    assert pick_worker(head("/socket.io/?EIO=4&transport=polling&sid=AbC"), 2) is None
+    assert pick_worker(head("/socket.io/?EIO=4&transport=polling&sid=5.AbC"), 2) is None
+    assert pick_worker(b"garbage\r\n\r\n", 2) is None
+
+def test_polling_requests_close_after_one_response():
+    forwarded = forward_head(head("/socket.io/?sid=0.a", b"Connection: keep-alive"), "10.0.0.7")
+    assert b"Connection: close\r\n" in forwarded
+    assert b"keep-alive" not in forwarded
+    assert forwarded.endswith(b"\r\n\r\n")
+
+def test_websocket_upgrades_stay_open():
+    forwarded = forward_head(head("/socket.io/?sid=0.a", b"Connection: Upgrade", b"Upgrade: websocket"), "10.0.0.7")
+    assert b"Connection: Upgrade\r\n" in forwarded
+    assert b"Connection: close" not in forwarded
+
+def test_client_address_replaces_any_forwarded_for():
+    forwarded = forward_head(head("/api/login", b"X-Forwarded-For: 1.2.3.4"), "10.0.0.7")
+    assert b"X-Forwarded-For: 10.0.0.7\r\n" in forwarded
+    assert b"1.2.3.4" not in forwarded
@@ -0,0 +1,130 @@
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import itertools
+import sys
+from urllib.parse import parse_qs, urlsplit
+from message_bus import UnixSocketBroker
+from structured_log import get_logger, fields
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def start_workers(count, base_port, bus_url, extra_env=None):
+    workers = []
+    for index in range(count):
+        env = dict(os.environ, **(extra_env or {}))
+        env.update({
+            'VSC_WORKER': str(index),
+            'HOST': '127.0.0.1',
+            'PORT': str(base_port + index),
+            'MESSAGE_BUS': bus_url
+        })
+        workers.append(subprocess.Popen([sys.executable, os.path.join(BACKEND_DIR, 'main.py')], env=env, cwd=BACKEND_DIR))
+    return workers
+
+def route_session_ids(eio, index):
+    """Prefixes every Engine.IO sid this worker hands out with its index so the proxy can route on it"""
+    generate_id = eio.generate_id
+    eio.generate_id = lambda: f"{index}.{generate_id()}"
+
+def pick_worker(head, count):
+    # Engine.IO puts the sid in the query string of every request after the
+    # handshake; handshakes and plain API calls carry none and return None.
+    try:
+        target = head.split(b"\r\n", 1)[0].split(b" ")[1].decode('latin-1')
+    except IndexError:
+        return None
+    sid = parse_qs(urlsplit(target).query).get('sid', [''])[0]
+    index, dot, _ = sid.partition('.')
+    if dot and index.isdigit() and int(index) < count:
+        return int(index)
+    return None
+
+def forward_head(head, client_ip):
+    """Request head as sent to the worker: the client address in X-Forwarded-For, polling closed after one response"""
+    lines = head.split(b"\r\n")
+    upgrade = any(line.lower().startswith(b"upgrade:") for line in lines[1:])
+    # the proxy is the only hop the workers trust, so whatever the client claimed is dropped
+    dropped = (b"x-forwarded-for:",) if upgrade else (b"x-forwarded-for:", b"connection:")
+    lines = [lines[0]] + [line for line in lines[1:] if not line.lower().startswith(dropped)]
+    lines.insert(1, b"X-Forwarded-For: " + client_ip.encode('latin-1'))
+    if not upgrade:
+        # Keep-alive would send the next request on this connection to the same
+        # worker whatever its sid says, so only websocket upgrades stay open.
+        lines.insert(1, b"Connection: close")
+    return b"\r\n".join(lines)
+
+async def pipe(reader, writer):
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def sticky_proxy(host, port, base_port, count):
+    handshakes = itertools.count()
+
+    async def handle(client_reader, client_writer):
+        try:
+            head = await client_reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            client_writer.close()
+            return
+        index = pick_worker(head, count)
+        if index is None:
+            index = next(handshakes) % count
+        worker_port = base_port + index
+        try:
+            worker_reader, worker_writer = await asyncio.open_connection('127.0.0.1', worker_port)
+        except OSError:
+            client_writer.close()
+            return
+        worker_writer.write(forward_head(head, client_writer.get_extra_info('peername')[0]))
+        await asyncio.gather(pipe(client_reader, worker_writer), pipe(worker_reader, client_writer))
+
+    server = await asyncio.start_server(handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run N server workers behind one port with a shared message bus")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--worker-base-port", type=int, default=5100)
+    parser.add_argument("--bus", default=os.getenv('MESSAGE_BUS', 'unix:///tmp/vsc-bus.sock'),
+                        help="unix:// starts a local broker, anything else is passed to the workers as is")
+    args = parser.parse_args()
+
+    broker = None
+    if args.bus.startswith('unix://'):
+        broker = UnixSocketBroker(args.bus[len('unix://'):]).start()
+
+    workers = start_workers(args.workers, args.worker_base_port, args.bus)
+    get_logger('workers').info("Started workers", extra=fields(workers=args.workers, ports=f"{args.worker_base_port}-{args.worker_base_port + args.workers - 1}", host=args.host, port=args.port))
+
+    def shutdown(*_):
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.wait()
+        if broker:
+            broker.stop()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    try:
+        asyncio.run(sticky_proxy(args.host, args.port, args.worker_base_port, args.workers))
+    except KeyboardInterrupt:
+        shutdown()
+
+if __name__ == "__main__":
+    main()